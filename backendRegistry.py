@@ -0,0 +1,94 @@
+import importlib
+from exceptions import BasicException
+
+# Backend registry
+# Backends are registered by kind (configuration section) and type name as "module:Class" strings, so a backend's module
+# (and its dependencies) is only imported when a configuration selects it.  Third-party backends register through entry
+# points, for example in pyproject.toml:
+#
+#   [project.entry-points."smartsprinkler.forecast"]
+#   openmeteo = "smartsprinkler_openmeteo:OpenMeteoPredict"
+#
+# Backend classes are created with their classmethod fromConfig(settings, config) and declare the fast paths they support in
+# their capabilities attribute:
+#   batch- one request serves several locations (getPrecipProbBatch)
+#   async- awaitable methods do not block (no worker thread needed)
+#   cached- results are cached across runs (cache attribute holds the persistent cache, if any)
+
+ENTRY_POINT_GROUPS = {'pws': "smartsprinkler.pws", 'sprinklerInterface': "smartsprinkler.sprinkler",
+                      'weatherPredict': "smartsprinkler.forecast", 'reportInterface': "smartsprinkler.report"}
+
+class BackendRegistry(object):
+    def __init__(self):
+        self.targets = {kind: dict() for kind in ENTRY_POINT_GROUPS}
+        self.classes = dict() # (kind, name) -> loaded class
+        self.entryPointsLoaded = set() # kinds whose entry points have been read
+
+    def register(self, kind, name, target):
+    # Register backend
+    # Inputs:
+    # kind- configuration section ('pws', 'sprinklerInterface', 'weatherPredict' or 'reportInterface')
+    # name- type name used in configuration (case insensitive)
+    # target- "module:Class" string (imported when first used) or class
+        if (kind not in self.targets):
+            raise BasicException("BackendRegistry - Unknown backend kind '{}'.".format(kind))
+        self.targets[kind][name.lower()] = target
+        self.classes.pop((kind, name.lower()), None)
+
+    def loadEntryPoints(self, kind):
+        # Read installed third-party backends (only done when a type is not built in)
+        self.entryPointsLoaded.add(kind)
+        from importlib.metadata import entry_points
+        installed = entry_points()
+        if (hasattr(installed, 'select')):
+            installed = installed.select(group=ENTRY_POINT_GROUPS[kind])
+        else: # Python 3.9 returns dictionary of groups
+            installed = installed.get(ENTRY_POINT_GROUPS[kind], [])
+        for entryPoint in installed:
+            if (entryPoint.name.lower() not in self.targets[kind]): # built-in backends take precedence
+                self.targets[kind][entryPoint.name.lower()] = entryPoint.value
+
+    def names(self, kind):
+        # Registered type names (including installed third-party backends)
+        if (kind not in self.entryPointsLoaded):
+            self.loadEntryPoints(kind)
+        return sorted(self.targets[kind])
+
+    def resolve(self, kind, name):
+        # Backend class for type name (None if no backend is registered)
+        name = str(name).lower()
+        if ((kind, name) in self.classes):
+            return self.classes[(kind, name)]
+
+        if (name not in self.targets[kind] and kind not in self.entryPointsLoaded):
+            self.loadEntryPoints(kind)
+        target = self.targets[kind].get(name)
+        if (target is None):
+            return None
+
+        if (isinstance(target, str)):
+            moduleName, _, className = target.partition(":")
+            target = getattr(importlib.import_module(moduleName), className)
+        self.classes[(kind, name)] = target
+        return target
+
+    def create(self, kind, settings, config):
+        # Backend instance for configuration section (None if type is not registered)
+        backendClass = self.resolve(kind, settings["type"])
+        if (backendClass is None):
+            print("BackendRegistry - No {} backend of type '{}' is registered.".format(kind, settings["type"]))
+            return None
+        return backendClass.fromConfig(settings, config)
+
+def supports(backend, capability):
+    # Whether backend instance declares capability
+    return capability in getattr(backend, 'capabilities', ())
+
+registry = BackendRegistry()
+
+# Built-in backends
+registry.register('pws', "weewx", "weewxInterface:WeeWXInterface")
+registry.register('sprinklerInterface', "ospi", "openSprinklerInterface:OSPiInterface")
+registry.register('weatherPredict', "nws", "nwsPredict:NWSPredict")
+registry.register('weatherPredict', "wunderground", "wundergroundPredict:WundergroundPredict")
+registry.register('reportInterface', "ifttt", "iftttInterface:IFTTTInterface")
@@ -0,0 +1,306 @@
+import argparse
+import asyncio
+import contextlib
+import copy
+import datetime
+import itertools
+import json
+import os
+import tempfile
+import time
+from array import array
+from bisect import bisect_left, bisect_right
+from pwsInterface import PWSInterface
+from sprinklerInterface import SprinklerInterface
+from weatherPredict import WeatherPredict
+from smartSprinkler import SmartSprinkler, SSStatus, calculateWeekTimes
+from zoneBalance import loadNumpy
+
+# Historical backtesting of the watering decision path
+# runSprinklerLogic is run once per simulated day against in-memory, array-backed stand-ins for the PWS, sprinkler controller
+# and forecast.  Programs pushed by a run are executed by the simulated controller and appear in its run log for later runs,
+# so the effect of settings such as minPrecipProb, maxDaysBetweenWater, excessRollover and deficitMakeup can be evaluated over
+# years of recorded rainfall.
+
+class BacktestPWS(PWSInterface):
+# Daily rainfall rows held in arrays; only days completed before the simulated time are visible
+    capabilities = frozenset(["async"]) # in memory, awaited without worker thread
+
+    def __init__(self, rainRows, clock):
+        super().__init__(None)
+        rainRows = sorted(rainRows)
+        self.dayTimes = array('q', [int(row[0]) for row in rainRows])
+        self.rain = array('d', [row[1] if row[1] and row[1] > 0 else 0.0 for row in rainRows])
+        self.clock = clock
+
+    def visibleRange(self, startTime, endTime):
+        endEpoch = min(datetime.datetime.timestamp(endTime), datetime.datetime.timestamp(self.clock()) - 86400) # day rows complete a day after they start
+        return bisect_left(self.dayTimes, datetime.datetime.timestamp(startTime)), bisect_right(self.dayTimes, endEpoch)
+
+    def getRainfall(self, startTime, endTime, minRainAmount):
+        first, last = self.visibleRange(startTime, endTime)
+        rainfall = 0.0
+        lastDayOfRain = 0
+        for idx in range(first, last):
+            rainfall += self.rain[idx]
+            if (self.rain[idx] > 0 and self.rain[idx] > minRainAmount):
+                lastDayOfRain = self.dayTimes[idx]
+        return rainfall, lastDayOfRain
+
+    def getDailyRainfall(self, startTime, endTime):
+        first, last = self.visibleRange(startTime, endTime)
+        return [[self.dayTimes[idx], self.rain[idx]] for idx in range(first, last)]
+
+    async def getDailyRainfallAsync(self, startTime, endTime):
+        return self.getDailyRainfall(startTime, endTime) # in memory so no worker thread needed
+
+class BacktestSprinkler(SprinklerInterface):
+# Simulated controller: one weekly program per zone, executed when the simulated time passes its next start
+    capabilities = frozenset(["async"]) # in memory, awaited without worker thread
+
+    def __init__(self, numZones):
+        super().__init__(None, numZones, [])
+        self.programs = dict() # zone -> [next start epoch, duration]
+        self.logZones = array('q')
+        self.logDurations = array('d')
+        self.logEnds = array('q')
+        self.now = 0
+
+    def advance(self, toEpoch):
+        # Run programs starting before toEpoch
+        runs = []
+        for zone, (startEpoch, duration) in self.programs.items():
+            while (startEpoch <= toEpoch):
+                runs.append((startEpoch + duration, zone, duration))
+                startEpoch += 7*86400 # weekly program repeats until replaced
+            self.programs[zone][0] = startEpoch
+        for endEpoch, zone, duration in sorted(runs):
+            self.logZones.append(zone)
+            self.logDurations.append(duration)
+            self.logEnds.append(int(endEpoch))
+        self.now = toEpoch
+
+    def getSprinklerLog(self, zones, startTime, endTime):
+        first = bisect_left(self.logEnds, datetime.datetime.timestamp(startTime))
+        last = bisect_right(self.logEnds, min(datetime.datetime.timestamp(endTime), self.now))
+        zones = set(zones)
+        return [[self.logZones[idx], self.logDurations[idx], self.logEnds[idx]] for idx in range(first, last) if self.logZones[idx] in zones]
+
+    async def getSprinklerLogAsync(self, zones, startTime, endTime):
+        return self.getSprinklerLog(zones, startTime, endTime)
+
+    def getSprinklerTotals(self, zones, startTime, endTime):
+        runTimes = {zone: {'totalRunTime': 0, 'lastRunTime': 0} for zone in zones}
+        for zone, duration, endEpoch in self.getSprinklerLog(zones, startTime, endTime):
+            runTimes[zone]['totalRunTime'] += duration
+            runTimes[zone]['lastRunTime'] = max(runTimes[zone]['lastRunTime'], endEpoch)
+        return runTimes
+
+    def updateProgram(self, zoneNum, durationSec, runTimeEpoch):
+        # Weekly program starts at the first occurrence of run time (day of week and time of day) after now
+        startEpoch = runTimeEpoch
+        if (startEpoch <= self.now):
+            startEpoch += ((self.now - startEpoch) // (7*86400) + 1) * 7*86400
+        self.programs[zoneNum] = [startEpoch, durationSec]
+
+    def disableProgram(self, zoneNum):
+        self.programs.pop(zoneNum, None)
+
+class BacktestForecast(WeatherPredict):
+# Precipitation probability from a forecast archive, from actual rainfall ("oracle") or none
+    capabilities = frozenset(["async"]) # in memory, awaited without worker thread
+
+    def __init__(self, mode, clock, archive=None, rainRows=None, minRainAmount=0.0):
+        super().__init__(None)
+        self.mode = mode
+        self.clock = clock
+
+        # Archive of daily forecasts by issue date ({"YYYY-MM-DD": [[epoch of day, probability], ...]})
+        self.issueDates = sorted(archive) if archive else []
+        self.archive = archive or dict()
+
+        # Actual rain days for oracle forecasts
+        self.rainDays = {datetime.date.fromtimestamp(epoch) for epoch, rainfall in (rainRows or []) if rainfall and rainfall > minRainAmount}
+
+    def getPrecipProb(self, startTime, endTime, location):
+        startDay = datetime.datetime(startTime.year, startTime.month, startTime.day)
+        if (self.mode == "oracle"):
+            numDays = (endTime - startDay).days + 1
+            days = [startDay + datetime.timedelta(days=i) for i in range(numDays)]
+            return [[day, 100 if day.date() in self.rainDays else 0] for day in days]
+        elif (self.mode == "archive"):
+            # Latest forecast issued by now
+            idx = bisect_right(self.issueDates, self.clock().date().isoformat()) - 1
+            if (idx < 0):
+                return []
+            forecast = [[datetime.datetime.fromtimestamp(epoch), prob] for epoch, prob in self.archive[self.issueDates[idx]]]
+            return [day for day in forecast if startDay <= day[0] <= endTime]
+
+        return []
+
+    async def getPrecipProbAsync(self, startTime, endTime, location):
+        return self.getPrecipProb(startTime, endTime, location)
+
+class Backtest(object):
+# Day by day simulation of the watering decisions of one configuration
+    def __init__(self, settings, rainRows, forecastMode="none", forecastArchive=None, runTimeOfDay=datetime.timedelta(hours=1)):
+        self.settings = settings
+        self.rainRows = rainRows
+        self.forecastMode = forecastMode
+        self.forecastArchive = forecastArchive
+        self.runTimeOfDay = runTimeOfDay # time of day of each simulated run
+        self.simTime = None
+
+    def clock(self):
+        return self.simTime
+
+    def run(self, startDay, endDay):
+    # Simulate runs on every day from start day to end day (dates)
+    # Outputs:
+    # results- summary of water applied and decisions (see summarize)
+        with tempfile.TemporaryDirectory() as tmpDir:
+            settings = copy.deepcopy(self.settings)
+            for key in ('pws', 'sprinklerInterface', 'weatherPredict', 'reportInterface', 'metricsFile', 'http'):
+                settings.pop(key, None)
+            settings['enable'] = True
+            settings['logFile'] = os.path.join(tmpDir, "backtest.log")
+            settings['statusFile'] = os.path.join(tmpDir, "backtestStatus.json")
+
+            smartSprinkler = SmartSprinkler(settings, [])
+            config = smartSprinkler.config
+            smartSprinkler.clock = self.clock
+            smartSprinkler.eventLoop = asyncio.new_event_loop()
+            config.pws = BacktestPWS(self.rainRows, self.clock)
+            config.sprinklerInterface = BacktestSprinkler(len(config['zones']))
+            config.weatherPredict = BacktestForecast(self.forecastMode, self.clock, self.forecastArchive, self.rainRows, config['minRainAmount'])
+
+            statusCounts = {ssStatus.name: 0 for ssStatus in SSStatus}
+            numDays = (endDay - startDay).days + 1
+            try:
+                with open(os.devnull, "w") as devnull, contextlib.redirect_stdout(devnull):
+                    for dayIdx in range(numDays):
+                        day = startDay + datetime.timedelta(days=dayIdx)
+                        self.simTime = datetime.datetime(day.year, day.month, day.day) + self.runTimeOfDay
+                        config.sprinklerInterface.advance(datetime.datetime.timestamp(self.simTime))
+                        smartSprinkler.lastLogEntry = None
+                        smartSprinkler.runSprinklerLogic()
+                        if (smartSprinkler.lastLogEntry):
+                            for zoneStatus in smartSprinkler.lastLogEntry['zoneStatus']:
+                                statusCounts[SSStatus(int(zoneStatus)).name] += 1
+            finally:
+                smartSprinkler.eventLoop.close()
+
+            endOfSim = datetime.datetime(endDay.year, endDay.month, endDay.day) + datetime.timedelta(days=1)
+            config.sprinklerInterface.advance(datetime.datetime.timestamp(endOfSim))
+
+            return self.summarize(config, startDay, endDay, statusCounts)
+
+    def summarize(self, config, startDay, endDay, statusCounts):
+        # Weekly water (rain and sprinklers) per zone over complete weeks of the simulation
+        zones = config['zones']
+        zoneIndex = {zone: idx for idx, zone in enumerate(zones)}
+        _, firstWeek, _ = calculateWeekTimes(datetime.datetime(startDay.year, startDay.month, startDay.day))
+        if (firstWeek.date() < startDay):
+            firstWeek += datetime.timedelta(days=7)
+        numWeeks = ((endDay - firstWeek.date()).days + 1) // 7
+        firstEpoch = datetime.datetime.timestamp(firstWeek)
+
+        def weekIndex(epoch):
+            return (datetime.date.fromtimestamp(epoch) - firstWeek.date()).days // 7
+
+        weeklyRain = [0.0] * numWeeks
+        for epoch, rainfall in self.rainRows:
+            week = weekIndex(epoch) if epoch >= firstEpoch else -1
+            if (0 <= week < numWeeks and rainfall and rainfall > 0):
+                weeklyRain[week] += rainfall
+
+        sprinkler = config.sprinklerInterface
+        weeklyRunTimes = [[0.0] * len(zones) for _ in range(numWeeks)]
+        totalRunTime = [0.0] * len(zones)
+        numRuns = [0] * len(zones)
+        for zone, duration, endEpoch in zip(sprinkler.logZones, sprinkler.logDurations, sprinkler.logEnds):
+            idx = zoneIndex[zone]
+            totalRunTime[idx] += duration
+            numRuns[idx] += 1
+            week = weekIndex(endEpoch) if endEpoch >= firstEpoch else -1
+            if (0 <= week < numWeeks):
+                weeklyRunTimes[week][idx] += duration
+
+        # Weeks below 90% of requirement (the decision logic's "requirement met" threshold), evaluated over all weeks at once
+        sprinklerWater, underWateredWeeks, excessWater = config.zoneBalance.weeklyShortfall(weeklyRain, weeklyRunTimes, 0.9)
+
+        return {'days': (endDay - startDay).days + 1, 'weeks': numWeeks,
+                'sprinklerWater': [round(water, 3) for water in sprinklerWater], # inches over complete weeks
+                'sprinklerMinutes': [round(runTime/60.0, 1) for runTime in totalRunTime],
+                'runs': numRuns, 'underWateredWeeks': underWateredWeeks, 'excessWater': [round(excess, 3) for excess in excessWater],
+                'rain': round(sum(weeklyRain), 3), 'zoneStatus': statusCounts}
+
+def loadRainRows(weatherDbFile, startDay, endDay):
+    # Daily rainfall rows from weeWX database
+    from weewxInterface import WeeWXInterface
+    pws = WeeWXInterface(weatherDbFile, rollup=False)
+    try:
+        return pws.getDailyRainfall(datetime.datetime(startDay.year, startDay.month, startDay.day) - datetime.timedelta(days=21),
+                                    datetime.datetime(endDay.year, endDay.month, endDay.day, 23, 59, 59))
+    finally:
+        pws.close()
+
+def parseSweep(sweeps):
+    # "key=value1,value2" settings to try (values parsed as YAML scalars)
+    import yaml
+    keys = []
+    values = []
+    for sweep in sweeps:
+        key, _, valueList = sweep.partition("=")
+        keys.append(key)
+        values.append([yaml.safe_load(value) for value in valueList.split(",")])
+
+    return [dict(zip(keys, combination)) for combination in itertools.product(*values)]
+
+def main():
+    from smartSprinklerExecute import loadSettings
+    parser = argparse.ArgumentParser(description="Backtest SmartSprinkler settings against recorded weeWX rainfall.")
+    parser.add_argument("--config", default="smartSprinkler.yaml", help="configuration file")
+    parser.add_argument("--weatherDb", help="weeWX database (default from configuration)")
+    parser.add_argument("--start", required=True, type=datetime.date.fromisoformat, help="first day to simulate (YYYY-MM-DD)")
+    parser.add_argument("--end", required=True, type=datetime.date.fromisoformat, help="last day to simulate (YYYY-MM-DD)")
+    parser.add_argument("--forecast", choices=["none", "oracle", "archive"], default="none", help="forecast source (oracle uses actual rainfall)")
+    parser.add_argument("--forecastArchive", help="JSON forecast archive ({\"YYYY-MM-DD\": [[epoch of day, probability], ...]})")
+    parser.add_argument("--runTime", default="01:00", help="time of day of simulated runs (HH:MM)")
+    parser.add_argument("--set", action="append", default=[], metavar="KEY=V1,V2", help="setting values to sweep (repeatable)")
+    parser.add_argument("--output", help="write results to JSON file")
+    args = parser.parse_args()
+
+    if (args.forecast == "archive" and not args.forecastArchive):
+        parser.error("--forecast archive requires --forecastArchive")
+
+    loadNumpy() # whole-zone calculations use numpy arrays when installed
+    settings = loadSettings(args.config)
+    rainRows = loadRainRows(args.weatherDb or settings['pws']['weatherDbFile'], args.start, args.end)
+    archive = None
+    if (args.forecastArchive):
+        with open(args.forecastArchive) as f:
+            archive = json.load(f)
+    hours, minutes = args.runTime.split(":")
+    runTimeOfDay = datetime.timedelta(hours=int(hours), minutes=int(minutes))
+
+    results = []
+    for overrides in parseSweep(args.set):
+        trialSettings = copy.deepcopy(settings)
+        trialSettings.update(overrides)
+        start = time.perf_counter()
+        summary = Backtest(trialSettings, rainRows, args.forecast, archive, runTimeOfDay).run(args.start, args.end)
+        elapsed = time.perf_counter() - start
+        results.append({'settings': overrides, 'summary': summary, 'elapsed': round(elapsed, 3)})
+
+        zones = len(summary['runs'])
+        print("{} ({:.1f} s): sprinkler water {:.2f} in/zone, runs {:.0f}/zone, under-watered weeks {:.1f}/{}, excess {:.2f} in/zone".format(
+            overrides or "configured settings", elapsed, sum(summary['sprinklerWater'])/zones, sum(summary['runs'])/zones,
+            sum(summary['underWateredWeeks'])/zones, summary['weeks'], sum(summary['excessWater'])/zones))
+
+    if (args.output):
+        with open(args.output, "w") as f:
+            json.dump(results, f, indent=2)
+
+if __name__ == "__main__":
+    main()
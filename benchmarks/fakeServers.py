@@ -0,0 +1,144 @@
+import bisect
+import datetime
+import json
+import random
+import threading
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import urlsplit, parse_qs
+
+class FakeServer(object):
+# Local HTTP server run from a background thread
+    def __init__(self, handlerClass):
+        handler = type(handlerClass.__name__, (handlerClass,), {'fake': self})
+        self.server = ThreadingHTTPServer(("127.0.0.1", 0), handler)
+        self.server.daemon_threads = True
+        self.thread = threading.Thread(target=self.server.serve_forever, daemon=True)
+        self.thread.start()
+
+    @property
+    def url(self):
+        return "http://127.0.0.1:{}/".format(self.server.server_address[1])
+
+    def close(self):
+        self.server.shutdown()
+        self.server.server_close()
+
+class QuietHandler(BaseHTTPRequestHandler):
+    protocol_version = "HTTP/1.1" # keep-alive like the real controller and NWS
+    disable_nagle_algorithm = True # headers and body are written separately, so avoid delayed ACK stalls
+
+    def reply(self, body, contentType="application/json"):
+        body = body.encode('utf-8')
+        self.send_response(200)
+        self.send_header("Content-Type", contentType)
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, format, *args):
+        pass
+
+class OSPiHandler(QuietHandler):
+    # jl, jp and cp commands of OpenSprinkler firmware 2.1.8
+    def do_GET(self):
+        parts = urlsplit(self.path)
+        command = parts.path.strip("/").split("/")[-1]
+        params = {key: values[0] for key, values in parse_qs(parts.query).items()}
+        self.fake.requests[command] = self.fake.requests.get(command, 0) + 1
+
+        if (command == "jl"):
+            self.reply(json.dumps(self.fake.getLog(int(params['start']), int(params['end']))))
+        elif (command == "jp"):
+            self.reply(json.dumps(self.fake.getPrograms()))
+        elif (command == "cp"):
+            self.fake.setProgram(int(params['pid']), params['name'], json.loads(params['v']))
+            self.reply('{"result":1}')
+        else:
+            self.reply('{"result":1}')
+
+class FakeOSPi(FakeServer):
+# OpenSprinkler stand-in with a generated run log
+    def __init__(self, numZones, historyDays, seed=1):
+        self.numZones = numZones
+        self.programs = []
+        self.requests = dict()
+        self.lock = threading.Lock()
+
+        # Run log: each zone runs on about a third of days
+        rand = random.Random(seed)
+        now = int(datetime.datetime.now().timestamp())
+        entries = []
+        for day in range(historyDays):
+            for zone in range(numZones):
+                if (rand.random() < 0.3):
+                    entries.append([zone + 1, zone, rand.choice([300, 600, 900, 1200]), now - day*86400 - rand.randint(0, 80000)])
+        entries.sort(key=lambda entry: entry[3])
+        self.log = entries
+        self.logEnds = [entry[3] for entry in entries]
+
+        super().__init__(OSPiHandler)
+
+    def getLog(self, start, end):
+        return self.log[bisect.bisect_left(self.logEnds, start):bisect.bisect_right(self.logEnds, end)]
+
+    def getPrograms(self):
+        with self.lock:
+            return {'nprogs': len(self.programs), 'nboards': (self.numZones + 7) // 8, 'mnp': 40, 'pd': [list(program) for program in self.programs]}
+
+    def setProgram(self, pid, name, settings):
+        with self.lock:
+            program = settings + [name]
+            if (0 <= pid < len(self.programs)):
+                self.programs[pid] = program
+            else:
+                self.programs.append(program)
+
+class NDFDHandler(QuietHandler):
+    def do_GET(self):
+        self.fake.requests += 1
+        params = {key: values[0] for key, values in parse_qs(urlsplit(self.path).query).items()}
+        numPoints = len(params.get('zipCodeList', '').split())
+        self.reply(self.fake.getXml(max(numPoints, 1)), "text/xml")
+
+class FakeNDFD(FakeServer):
+# Static NDFD DWML time-series server (12 hour probability of precipitation and 6 hour liquid precipitation)
+    def __init__(self, days=7):
+        self.days = days
+        self.requests = 0
+        self.xml = dict()
+        super().__init__(NDFDHandler)
+
+    def getXml(self, numPoints):
+        if (numPoints not in self.xml):
+            self.xml[numPoints] = ndfdXml(self.days, numPoints)
+        return self.xml[numPoints]
+
+def ndfdXml(days, numPoints):
+    now = datetime.datetime.now()
+    timeFormat = '%Y-%m-%dT%H:%M:%S-05:00'
+
+    # 12 hour and 6 hour periods
+    periods12 = []
+    periods6 = []
+    for i in range(days*2):
+        start = now.replace(hour=8 if i % 2 == 0 else 20, minute=0, second=0, microsecond=0) + datetime.timedelta(days=i//2)
+        periods12.append((start, start + datetime.timedelta(hours=12)))
+        periods6.append((start, start + datetime.timedelta(hours=6)))
+        periods6.append((start + datetime.timedelta(hours=6), start + datetime.timedelta(hours=12)))
+
+    def layout(key, periods):
+        times = ''.join('<start-valid-time>{}</start-valid-time><end-valid-time>{}</end-valid-time>'.format(start.strftime(timeFormat), end.strftime(timeFormat)) for start, end in periods)
+        return '<time-layout time-coordinate="local" summarization="12hourly"><layout-key>{}</layout-key>{}</time-layout>'.format(key, times)
+
+    key12 = 'k-p12h-n{}-1'.format(len(periods12))
+    key6 = 'k-p6h-n{}-2'.format(len(periods6))
+    locations = ''.join('<location><location-key>point{}</location-key><point latitude="{:.2f}" longitude="-90.20"/></location>'.format(point + 1, 38.0 + point*0.01) for point in range(numPoints))
+    parameters = ''
+    for point in range(numPoints):
+        parameters += '<parameters applicable-location="point{}">'.format(point + 1)
+        parameters += '<precipitation type="liquid" units="inches" time-layout="{}"><name>Liquid Precipitation Amount</name>{}</precipitation>'.format(key6, ''.join('<value>{:.2f}</value>'.format((i*7 + point) % 5 / 10.0) for i in range(len(periods6))))
+        parameters += '<probability-of-precipitation type="12 hour" units="percent" time-layout="{}"><name>12 Hourly Probability of Precipitation</name>{}</probability-of-precipitation>'.format(key12, ''.join('<value>{}</value>'.format((i*13 + point*7) % 100) for i in range(len(periods12))))
+        parameters += '</parameters>'
+
+    return ('<?xml version="1.0"?><dwml version="1.0" xmlns:xsi="http://www.w3.org/2001/XMLSchema-instance"><head><product><creation-date refresh-frequency="PT1H">{}</creation-date></product></head>'
+            '<data>{}{}{}{}</data></dwml>').format(now.strftime('%Y-%m-%dT%H:%M:%SZ'), locations, layout(key12, periods12), layout(key6, periods6), parameters)
@@ -0,0 +1,106 @@
+import argparse
+import json
+import os
+import platform
+import statistics
+import subprocess
+import sys
+import tempfile
+
+# Startup benchmark: each measurement runs in a fresh interpreter so module import costs are included
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+
+from runBenchmarks import makeConfig, compareBaseline
+
+HEAVY_MODULES = ["yaml", "requests", "astral", "xml.etree.ElementTree", "numpy", "http.server", "sqlite3", "asyncio"]
+
+IMPORT_MODULES = ["smartSprinklerExecute", "smartSprinkler", "weewxInterface", "openSprinklerInterface", "nwsPredict", "iftttInterface", "smartSprinklerDaemon"]
+
+MEASURE = '''
+import json, sys, time
+sys.path.insert(0, {root!r})
+start = time.perf_counter()
+{statement}
+elapsed = time.perf_counter() - start
+print(json.dumps({{'time': elapsed, 'loaded': [name for name in {heavy!r} if name in sys.modules]}}))
+'''
+
+def measure(statement, repeat, cwd=None):
+    # Median wall time of statement in fresh interpreters and heavy modules it loaded
+    times = []
+    loaded = []
+    for rep in range(repeat):
+        code = MEASURE.format(root=ROOT, statement=statement, heavy=HEAVY_MODULES)
+        result = subprocess.run([sys.executable, "-c", code], capture_output=True, text=True, cwd=cwd, check=True)
+        output = json.loads(result.stdout.strip().splitlines()[-1])
+        times.append(output['time'])
+        loaded = output['loaded']
+
+    return statistics.median(times), loaded
+
+def runStartup(repeat, numZones):
+    import yaml
+    results = dict()
+    loadedModules = dict()
+
+    # Module imports
+    for module in IMPORT_MODULES:
+        results["import." + module], loadedModules["import." + module] = measure("import " + module, repeat)
+
+    # Configuration load from YAML and from compiled configuration snapshot
+    with tempfile.TemporaryDirectory() as tmpDir:
+        config = makeConfig(tmpDir, numZones, "http://127.0.0.1:9/", True)
+        with open(os.path.join(tmpDir, "weewx.sdb"), "w"):
+            pass
+        settingsFile = os.path.join(tmpDir, "smartSprinkler.yaml")
+        with open(settingsFile, "w") as f:
+            yaml.safe_dump(config, f)
+        snapshotFile = os.path.join(tmpDir, "config.snapshot")
+
+        load = "from smartSprinklerExecute import loadSmartSprinkler\nloadSmartSprinkler({!r}, [], {!r})"
+        results["startup.yaml"], loadedModules["startup.yaml"] = measure(load.format(settingsFile, None), repeat, tmpDir)
+        measure(load.format(settingsFile, snapshotFile), 1, tmpDir) # write snapshot
+        results["startup.snapshot"], loadedModules["startup.snapshot"] = measure(load.format(settingsFile, snapshotFile), repeat, tmpDir)
+
+    return results, loadedModules
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark SmartSprinkler module import and configuration load time.")
+    parser.add_argument("--repeat", type=int, default=7, help="interpreter launches per measurement (median reported)")
+    parser.add_argument("--zones", type=int, default=48, help="number of zones in generated configuration")
+    parser.add_argument("--output", help="write results to JSON file")
+    parser.add_argument("--baseline", help="compare against results JSON file and exit with status 1 on regressions")
+    parser.add_argument("--threshold", type=float, default=0.25, help="allowed slowdown against baseline (fraction)")
+    parser.add_argument("--minDelta", type=float, default=0.005, help="ignore slowdowns smaller than this (seconds)")
+    args = parser.parse_args()
+
+    startup, loadedModules = runStartup(args.repeat, args.zones)
+    for metric, value in startup.items():
+        print("  {:40s} {:.4f} s   loads {}".format(metric, value, ", ".join(loadedModules[metric]) or "-"))
+
+    results = {'python': platform.python_version(), 'platform': platform.platform(), 'repeat': args.repeat, 'scenarios': {'startup': startup}, 'loadedModules': loadedModules}
+    if (args.output):
+        with open(args.output, "w") as f:
+            json.dump(results, f, indent=2)
+
+    if (args.baseline):
+        with open(args.baseline) as f:
+            baseline = json.load(f)
+        regressions = compareBaseline(results['scenarios'], baseline['scenarios'], args.threshold, args.minDelta)
+        for scenario, metric, base, value in regressions:
+            print("REGRESSION {} {}: {:.4f} s -> {:.4f} s ({:+.0%})".format(scenario, metric, base, value, value/base - 1.0))
+
+        # Heavy modules newly loaded at startup
+        for metric, modules in loadedModules.items():
+            added = set(modules) - set(baseline.get('loadedModules', dict()).get(metric, modules))
+            if (added):
+                regressions.append(('startup', metric, None, None))
+                print("REGRESSION {} now loads {}".format(metric, ", ".join(sorted(added))))
+
+        if (regressions):
+            sys.exit(1)
+        print("No regressions against", args.baseline)
+
+if __name__ == "__main__":
+    main()
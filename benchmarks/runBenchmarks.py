@@ -0,0 +1,173 @@
+import argparse
+import contextlib
+import datetime
+import io
+import json
+import os
+import platform
+import statistics
+import sys
+import tempfile
+import time
+
+# Benchmarks run against the modules in the repository root
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from fakeServers import FakeOSPi, FakeNDFD
+from weewxData import makeWeewxDatabase
+
+DEFAULT_ZONES = [4, 48, 200]
+DEFAULT_HISTORY = [7, 365, 1826] # days (1 week, 1 year, 5 years)
+
+def makeConfig(tmpDir, numZones, ospiUrl, useCache):
+    zones = list(range(1, numZones + 1))
+    config = {
+        "enable": True, "zones": zones, "zoneWateringRate": [0.02]*numZones, "weeklyWaterReq": [1.0]*numZones,
+        "minWateringLength": [180]*numZones, "maxWateringLength": [1800]*numZones,
+        "minPrecipProb": 50, "minDaysBetweenWater": 2, "maxDaysBetweenWater": 4, "minRainAmount": 0.1,
+        "logFile": os.path.join(tmpDir, "smartSprinkler.log"), "statusFile": os.path.join(tmpDir, "status.json"),
+        "location": [38.6, -90.2, "63101", "US/Central"], "desiredRunTimeOfDay": ["sunrise -02:00", "sunset +00:00"],
+        "catchup": True, "excessRollover": True, "deficitMakeup": True, "reportEnable": 0,
+        "maxConcurrentStations": 2,
+        "pws": {"type": "weewx", "weatherDbFile": os.path.join(tmpDir, "weewx.sdb")},
+        "weatherPredict": {"type": "nws"},
+        "sprinklerInterface": {"type": "ospi", "url": ospiUrl, "pw": "opendoor"},
+    }
+    if (useCache):
+        config["cacheDir"] = tmpDir
+
+    return config
+
+def timeCall(func, repeat):
+    # Median and minimum wall time of repeated calls (seconds)
+    times = []
+    for rep in range(repeat):
+        start = time.perf_counter()
+        func(rep)
+        times.append(time.perf_counter() - start)
+
+    return statistics.median(times), min(times)
+
+def runScenario(numZones, historyDays, repeat, useCache):
+    from smartSprinkler import SmartSprinkler
+    from nwsPredict import NWSPredict
+    import stageTimer
+
+    results = dict()
+    with tempfile.TemporaryDirectory() as tmpDir:
+        makeWeewxDatabase(os.path.join(tmpDir, "weewx.sdb"), historyDays)
+        ospi = FakeOSPi(numZones, historyDays)
+        ndfd = FakeNDFD()
+        config = None
+        try:
+            quiet = io.StringIO()
+            with contextlib.redirect_stdout(quiet):
+                start = time.perf_counter()
+                smartSprinkler = SmartSprinkler(makeConfig(tmpDir, numZones, ospi.url, useCache), [])
+                results["loadConfig"] = time.perf_counter() - start
+            config = smartSprinkler.config
+            config.weatherPredict.path = ndfd.url
+
+            now = datetime.datetime.now()
+            historyStart = now - datetime.timedelta(days=historyDays)
+            runWindow = now - datetime.timedelta(days=21) # widest window used by one run
+            zones = config['zones']
+
+            # End to end (first run builds local caches and programs)
+            def run(rep):
+                with contextlib.redirect_stdout(quiet):
+                    with stageTimer.collect() as timings:
+                        smartSprinkler.runSprinklerLogic()
+                return timings
+
+            NWSPredict.sharedForecasts.clear()
+            start = time.perf_counter()
+            stages = run(0).summary()['stages']
+            results["run.first"] = time.perf_counter() - start
+            results["run.median"], results["run.min"] = timeCall(run, repeat)
+            results.update({"stage." + stage: entry['time'] for stage, entry in stages.items()})
+
+            # Interface methods
+            results["pws.getRainfall.history"], _ = timeCall(lambda rep: config.pws.getRainfall(historyStart, now, config['minRainAmount']), repeat)
+            results["pws.getDailyRainfall.run"], _ = timeCall(lambda rep: config.pws.getDailyRainfall(runWindow, now), repeat)
+            results["ospi.getSprinklerLog.run"], _ = timeCall(lambda rep: config.sprinklerInterface.getSprinklerLog(zones, runWindow, now), repeat)
+            results["ospi.getSprinklerTotals.history"], _ = timeCall(lambda rep: config.sprinklerInterface.getSprinklerTotals(zones, historyStart, now), repeat)
+
+            def fetchForecast(rep):
+                NWSPredict.sharedForecasts.clear()
+                cache, config.weatherPredict.cache = config.weatherPredict.cache, None # always fetch and parse
+                try:
+                    config.weatherPredict.getPrecipProb(now, now + datetime.timedelta(days=6), config['location']['zipcode'])
+                finally:
+                    config.weatherPredict.cache = cache
+            results["nws.getPrecipProb"], _ = timeCall(fetchForecast, repeat)
+
+            def updatePrograms(rep):
+                config.sprinklerInterface.loadPrograms()
+                runTime = now.timestamp() + 86400
+                for zone in zones:
+                    config.sprinklerInterface.updateProgram(zone, 600 + rep, runTime) # changed duration so every program is written
+            results["ospi.updatePrograms"], _ = timeCall(updatePrograms, repeat)
+
+            results["ospi.requests"] = sum(ospi.requests.values())
+        finally:
+            ospi.close()
+            ndfd.close()
+            if (config and config.pws):
+                config.pws.close()
+
+    return results
+
+def compareBaseline(current, baseline, threshold, minDelta):
+    # Timings slower than baseline by more than threshold (fraction) and minDelta (seconds)
+    regressions = []
+    for scenario, metrics in current.items():
+        for metric, value in metrics.items():
+            if (metric == "ospi.requests"):
+                continue
+            base = baseline.get(scenario, dict()).get(metric)
+            if (base is None):
+                continue
+            if (value > base * (1.0 + threshold) and value - base > minDelta):
+                regressions.append((scenario, metric, base, value))
+
+    return regressions
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark SmartSprinkler against local OpenSprinkler, NDFD and weeWX stand-ins.")
+    parser.add_argument("--zones", type=int, nargs="+", default=DEFAULT_ZONES, help="zone counts to benchmark")
+    parser.add_argument("--history", type=int, nargs="+", default=DEFAULT_HISTORY, help="days of rain and run log history to generate")
+    parser.add_argument("--repeat", type=int, default=5, help="repetitions per measurement (median reported)")
+    parser.add_argument("--noCache", action="store_true", help="benchmark without cacheDir (no rain rollup file, log mirror or sun table file)")
+    parser.add_argument("--output", help="write results to JSON file")
+    parser.add_argument("--baseline", help="compare against results JSON file and exit with status 1 on regressions")
+    parser.add_argument("--threshold", type=float, default=0.25, help="allowed slowdown against baseline (fraction)")
+    parser.add_argument("--minDelta", type=float, default=0.002, help="ignore slowdowns smaller than this (seconds)")
+    args = parser.parse_args()
+
+    scenarios = dict()
+    for numZones in args.zones:
+        for historyDays in args.history:
+            name = "zones{}_days{}".format(numZones, historyDays)
+            print("Running", name, flush=True)
+            scenarios[name] = runScenario(numZones, historyDays, args.repeat, not args.noCache)
+            for metric, value in scenarios[name].items():
+                print("  {:40s} {}".format(metric, value if metric == "ospi.requests" else "{:.4f} s".format(value)))
+
+    results = {'python': platform.python_version(), 'platform': platform.platform(), 'repeat': args.repeat, 'cache': not args.noCache, 'scenarios': scenarios}
+    if (args.output):
+        with open(args.output, "w") as f:
+            json.dump(results, f, indent=2)
+
+    if (args.baseline):
+        with open(args.baseline) as f:
+            baseline = json.load(f)
+        regressions = compareBaseline(scenarios, baseline['scenarios'], args.threshold, args.minDelta)
+        for scenario, metric, base, value in regressions:
+            print("REGRESSION {} {}: {:.4f} s -> {:.4f} s ({:+.0%})".format(scenario, metric, base, value, value/base - 1.0))
+        if (regressions):
+            sys.exit(1)
+        print("No regressions against", args.baseline)
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,23 @@
+import datetime
+import os
+import random
+import sqlite3
+
+def makeWeewxDatabase(path, historyDays, seed=1):
+    # Generate weeWX database with archive_day_rain rows for each of the last historyDays days (and today)
+    if (os.path.exists(path)):
+        os.remove(path)
+
+    conn = sqlite3.connect(path)
+    with conn:
+        conn.execute('CREATE TABLE archive_day_rain (dateTime INTEGER NOT NULL UNIQUE PRIMARY KEY, min REAL, mintime INTEGER, max REAL, maxtime INTEGER, sum REAL, count INTEGER, wsum REAL, sumtime INTEGER)')
+        rand = random.Random(seed)
+        today = datetime.date.today()
+        rows = []
+        for daysAgo in range(historyDays, -1, -1):
+            day = today - datetime.timedelta(days=daysAgo)
+            dayStart = int(datetime.datetime(day.year, day.month, day.day).timestamp())
+            rain = rand.choice([0.0, 0.0, 0.0, 0.0, 0.02, 0.1, 0.25, 0.6])
+            rows.append((dayStart, 0.0, dayStart, rain, dayStart, rain, 288, rain*86400, 86400))
+        conn.executemany('INSERT INTO archive_day_rain VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?)', rows)
+    conn.close()
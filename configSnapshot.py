@@ -0,0 +1,75 @@
+import hashlib
+import os
+import pickle
+import sys
+import tempfile
+
+SNAPSHOT_VERSION = 1 # increase when snapshot file format changes
+
+# Modules whose classes make up the compiled configuration (any change to them invalidates snapshots)
+COMPILED_MODULES = ["smartSprinkler", "zoneTable", "runTimeSchedule", "zoneBalance", "configSnapshot"]
+
+# Compiled configuration snapshot
+# Saves the validated configuration (without interfaces) so later runs with an unchanged settings file skip importing and
+# running the YAML parser and validation.  Snapshots are keyed by a hash of the settings file contents, the Python version,
+# SNAPSHOT_VERSION and the size and modification time of the compiled configuration modules; any other snapshot is ignored
+# and rewritten, so upgraded code never unpickles configuration saved by older classes.
+
+codeVersion = None
+
+def getCodeVersion():
+    # Hash of size and modification time of compiled configuration module sources (computed once per process)
+    global codeVersion
+    if (codeVersion is None):
+        directory = os.path.dirname(os.path.abspath(__file__))
+        stats = []
+        for module in COMPILED_MODULES:
+            try:
+                fileStat = os.stat(os.path.join(directory, module + ".py"))
+                stats.append("{}:{}:{}".format(module, fileStat.st_size, fileStat.st_mtime_ns))
+            except OSError: # e.g. installed without sources, so fall back to snapshot version only
+                stats.append(module + ":-")
+        codeVersion = hashlib.sha1(";".join(stats).encode('utf-8')).hexdigest()[:12]
+
+    return codeVersion
+
+def defaultSnapshotFile(settingsFile):
+    # Hidden snapshot file alongside settings file
+    directory, name = os.path.split(os.path.abspath(settingsFile))
+    return os.path.join(directory, "." + name + ".snapshot")
+
+def snapshotKey(settingsData):
+    return "{}:{}:{}.{}:{}".format(SNAPSHOT_VERSION, getCodeVersion(), sys.version_info[0], sys.version_info[1], hashlib.sha1(settingsData).hexdigest())
+
+def readSnapshot(snapshotFile, key):
+    # Returns object saved for key, or None if snapshot is missing, stale or unreadable
+    try:
+        with open(snapshotFile, 'rb') as f:
+            savedKey, payload = pickle.load(f)
+    except (OSError, EOFError, ValueError, TypeError, pickle.UnpicklingError):
+        return None
+
+    if (savedKey != key):
+        return None
+
+    try:
+        return pickle.loads(payload)
+    except Exception: # saved by incompatible code
+        return None
+
+def writeSnapshot(snapshotFile, key, obj):
+    # Write snapshot atomically so concurrent readers never see a partial file (snapshots are optional, so errors are reported and ignored)
+    tmpPath = None
+    try:
+        payload = pickle.dumps(obj, protocol=pickle.HIGHEST_PROTOCOL)
+        fd, tmpPath = tempfile.mkstemp(prefix=os.path.basename(snapshotFile) + ".", suffix=".tmp", dir=os.path.dirname(os.path.abspath(snapshotFile)))
+        with os.fdopen(fd, 'wb') as f:
+            pickle.dump((key, payload), f, protocol=pickle.HIGHEST_PROTOCOL)
+        os.replace(tmpPath, snapshotFile)
+    except (OSError, pickle.PicklingError, TypeError, AttributeError) as err:
+        print("ConfigSnapshot - Unable to write configuration snapshot:", str(err))
+        if (tmpPath):
+            try:
+                os.remove(tmpPath)
+            except OSError:
+                pass
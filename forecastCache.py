@@ -0,0 +1,106 @@
+import json
+import os
+import tempfile
+import threading
+import time
+
+class ForecastCache(object):
+# Persistent cache of parsed daily forecasts
+# Entries are keyed by zipcode and forecast window and record the forecast issue time and the time they were fetched.  Entries
+# are fresh for ttl seconds after being fetched and can be served stale for a further grace period when the upstream fails.
+# The number of entries is bounded, with the least recently used entries evicted first.
+# Caches using the same file in a process (e.g. fleet sites) share their entries and lock, and entries written by other
+# processes are merged in before each save.
+
+    stores = dict() # cache file -> {'lock': lock, 'entries': entries (None until loaded)}
+    storesLock = threading.Lock()
+
+    def __init__(self, path, ttl=3600, gracePeriod=86400, maxEntries=64):
+        self.path = path
+        self.ttl = ttl
+        self.gracePeriod = gracePeriod
+        self.maxEntries = maxEntries
+
+        with ForecastCache.storesLock:
+            self.store = ForecastCache.stores.setdefault(os.path.abspath(path), {'lock': threading.Lock(), 'entries': None})
+        self.lock = self.store['lock']
+
+    @staticmethod
+    def key(zipcode, startTime, endTime):
+        return "{}|{}|{}".format(zipcode, startTime.strftime('%Y-%m-%d'), endTime.strftime('%Y-%m-%d'))
+
+    def read(self):
+        try:
+            with open(self.path) as f:
+                return json.load(f)
+        except (OSError, ValueError): # missing or corrupt cache file starts empty
+            return dict()
+
+    def load(self):
+        if (self.store['entries'] is None):
+            self.store['entries'] = self.read()
+
+        return self.store['entries']
+
+    def save(self):
+        # Merge entries saved by other processes, then write cache atomically so concurrent readers never see a partial file
+        entries = self.load()
+        for key, entry in self.read().items():
+            if (key not in entries or entry['fetched'] > entries[key]['fetched']):
+                entries[key] = entry
+        self.evict(entries)
+
+        fd, tmpPath = tempfile.mkstemp(prefix=os.path.basename(self.path) + ".", suffix=".tmp", dir=os.path.dirname(os.path.abspath(self.path)))
+        try:
+            with os.fdopen(fd, "w") as f:
+                json.dump(entries, f)
+            os.replace(tmpPath, self.path)
+        except OSError:
+            try:
+                os.remove(tmpPath)
+            except OSError:
+                pass
+            raise
+
+    def evict(self, entries):
+        # Evict least recently used entries
+        while (len(entries) > self.maxEntries):
+            oldest = min(entries, key=lambda k: entries[k]['accessed'])
+            del entries[oldest]
+
+    def get(self, key):
+    # Returns fresh forecast data and issue time for key, or None if missing or expired
+        with self.lock:
+            entry = self.load().get(key)
+            if (not entry or time.time() - entry['fetched'] > self.ttl):
+                return None
+
+            entry['accessed'] = time.time()
+            return entry['data'], entry['issued']
+
+    def getStale(self, zipcode):
+    # Returns the most recently fetched forecast data and issue time for zipcode within the grace period, or None
+        with self.lock:
+            stale = None
+            for key, entry in self.load().items():
+                if (key.split("|")[0] != str(zipcode) or time.time() - entry['fetched'] > self.ttl + self.gracePeriod):
+                    continue
+                if (not stale or entry['fetched'] > stale['fetched']):
+                    stale = entry
+
+            if (not stale):
+                return None
+
+            return stale['data'], stale['issued']
+
+    def put(self, key, data, issued):
+        with self.lock:
+            entries = self.load()
+            now = time.time()
+            entries[key] = {'data': data, 'issued': issued, 'fetched': now, 'accessed': now}
+            self.evict(entries)
+
+            try:
+                self.save()
+            except OSError as e: # cache is an optimization so keep running without persistence
+                print("ForecastCache - Unable to write cache file {}: {}".format(self.path, e))
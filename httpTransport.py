@@ -0,0 +1,201 @@
+import contextlib
+import contextvars
+import random
+import threading
+import time
+from urllib.parse import urlsplit
+from exceptions import BasicException
+import stageTimer
+import metrics
+
+currentDeadline = contextvars.ContextVar('currentDeadline', default=None)
+
+@contextlib.contextmanager
+def deadline(seconds):
+    # Fail requests made in this context (including from worker threads started with asyncio.to_thread, which copy the context)
+    # once seconds have passed; connect and read timeouts and retry backoff are shortened to the time remaining
+    end = time.time() + seconds
+    outer = currentDeadline.get()
+    token = currentDeadline.set(min(end, outer) if outer is not None else end)
+    try:
+        yield
+    finally:
+        currentDeadline.reset(token)
+
+def remainingTime():
+    # Seconds left before deadline of current context (None if no deadline)
+    end = currentDeadline.get()
+    return None if end is None else end - time.time()
+
+class CircuitBreaker(object):
+# Per-host circuit breaker
+# After failureThreshold consecutive failures the circuit opens and requests fail immediately for resetTimeout seconds.
+# A single trial request is then allowed through; success closes the circuit and failure opens it again.
+
+    def __init__(self, failureThreshold, resetTimeout):
+        self.failureThreshold = failureThreshold
+        self.resetTimeout = resetTimeout
+        self.failures = 0
+        self.openedAt = None
+        self.lock = threading.Lock()
+
+    def allow(self):
+        with self.lock:
+            if (self.openedAt is None):
+                return True
+            if (time.time() - self.openedAt >= self.resetTimeout): # half open so allow trial request
+                self.openedAt = time.time()
+                return True
+            return False
+
+    def recordSuccess(self):
+        with self.lock:
+            self.failures = 0
+            self.openedAt = None
+
+    def recordFailure(self):
+        with self.lock:
+            self.failures += 1
+            if (self.failures >= self.failureThreshold):
+                self.openedAt = time.time()
+
+class HTTPTransport(object):
+# Shared HTTP transport for all interfaces
+# Keeps a pooled keep-alive session per host, applies connect/read timeouts, retries failed requests with exponential backoff
+# and jitter, and guards each host with a circuit breaker.
+
+    retryStatus = (429, 500, 502, 503, 504) # response codes worth retrying
+
+    settingNames = ("connectTimeout", "readTimeout", "retries", "backoff", "maxBackoff", "failureThreshold", "resetTimeout", "poolSize")
+
+    def __init__(self, connectTimeout=5.0, readTimeout=30.0, retries=3, backoff=0.5, maxBackoff=10.0, failureThreshold=5, resetTimeout=60.0, poolSize=4):
+        self.connectTimeout = connectTimeout
+        self.readTimeout = readTimeout
+        self.retries = retries
+        self.backoff = backoff
+        self.maxBackoff = maxBackoff
+        self.failureThreshold = failureThreshold
+        self.resetTimeout = resetTimeout
+        self.poolSize = poolSize
+        self.defaults = {name: getattr(self, name) for name in self.settingNames}
+
+        self.sessions = dict()
+        self.breakers = dict()
+        self.lock = threading.Lock()
+
+    def configure(self, settings):
+    # Apply http settings (settings not given return to their defaults)
+    # The transport is shared by every site in the process, so the last configuration loaded applies to all of them; the fleet
+    # runner rejects sites whose http settings differ when running sites in threads.  Existing circuit breakers and connection
+    # pools are updated in place.
+        with self.lock:
+            previousPoolSize = self.poolSize
+            for name in self.settingNames:
+                setattr(self, name, settings[name] if name in settings else self.defaults[name])
+
+            for breaker in self.breakers.values():
+                with breaker.lock:
+                    breaker.failureThreshold = self.failureThreshold
+                    breaker.resetTimeout = self.resetTimeout
+
+            if (self.poolSize != previousPoolSize): # replace connection pools of existing sessions
+                for host, session in self.sessions.items():
+                    previousAdapter = session.get_adapter(host)
+                    session.mount(host, self.makeAdapter())
+                    previousAdapter.close()
+
+    def makeAdapter(self):
+        from requests.adapters import HTTPAdapter
+        return HTTPAdapter(pool_connections=1, pool_maxsize=self.poolSize)
+
+    def getHost(self, url):
+        parts = urlsplit(url)
+        return parts.scheme + "://" + parts.netloc
+
+    def getSession(self, host):
+        with self.lock:
+            if (host not in self.sessions):
+                import requests # imported on first request to keep startup fast
+                session = requests.Session()
+                session.mount(host, self.makeAdapter())
+                self.sessions[host] = session
+                self.breakers[host] = CircuitBreaker(self.failureThreshold, self.resetTimeout)
+
+            return self.sessions[host], self.breakers[host]
+
+    def backoffDelay(self, attempt):
+        # Exponential backoff with full jitter
+        return random.uniform(0, min(self.maxBackoff, self.backoff * 2**attempt))
+
+    def request(self, method, url, params=None, data=None, stream=False, retry=True):
+    # Issue HTTP request
+    # Requests are retried on connection errors, timeouts and retryable response codes when retry is True.  The last response
+    # is returned if retries are exhausted; the last exception is raised if no response was received.
+        import requests
+        host = self.getHost(url)
+        session, breaker = self.getSession(host)
+        if (not breaker.allow()):
+            raise BasicException("HTTPTransport - Circuit open for {} after repeated failures.".format(host))
+
+        attempts = self.retries + 1 if retry else 1
+        hostName = stageTimer.hostName(url)
+        for attempt in range(attempts):
+            if (attempt > 0):
+                metrics.retries.inc(host=hostName)
+                delay = self.backoffDelay(attempt - 1)
+                remaining = remainingTime()
+                time.sleep(delay if remaining is None else max(0.0, min(delay, remaining)))
+
+            timeout = (self.connectTimeout, self.readTimeout)
+            remaining = remainingTime()
+            if (remaining is not None):
+                if (remaining <= 0):
+                    raise BasicException("HTTPTransport - Deadline exceeded before request to {}.".format(host))
+                timeout = (min(self.connectTimeout, remaining), min(self.readTimeout, remaining))
+
+            start = time.perf_counter()
+            try:
+                r = session.request(method, url, params=params, data=data, stream=stream, timeout=timeout)
+            except (requests.ConnectionError, requests.Timeout) as e:
+                stageTimer.recordRequest(url, time.perf_counter() - start, 0)
+                metrics.requestDuration.observe(time.perf_counter() - start, host=hostName)
+                metrics.httpRequests.inc(host=hostName, code="error")
+                if (attempt == attempts - 1):
+                    breaker.recordFailure()
+                    raise e
+                continue
+
+            # Streamed bodies are counted as they are read
+            stageTimer.recordRequest(url, time.perf_counter() - start, 0 if stream else len(r.content))
+            metrics.requestDuration.observe(time.perf_counter() - start, host=hostName)
+            metrics.httpRequests.inc(host=hostName, code=r.status_code)
+
+            if (r.status_code in self.retryStatus and attempt < attempts - 1):
+                r.close()
+                continue
+
+            if (r.status_code >= 500):
+                breaker.recordFailure()
+            else:
+                breaker.recordSuccess()
+
+            return r
+
+    def get(self, url, params=None, stream=False):
+        return self.request("GET", url, params=params, stream=stream)
+
+    def post(self, url, data=None, retry=False):
+        # Posts are not retried by default since they may not be idempotent
+        return self.request("POST", url, data=data, retry=retry)
+
+transport = HTTPTransport()
+
+def getTransport():
+    return transport
+
+def setTransport(newTransport):
+    # Replace process-wide transport (e.g. to record or replay requests), returning previous transport
+    global transport
+    previous = transport
+    transport = newTransport
+    return previous
@@ -1,5 +1,6 @@
-import requests
-from reportInterface import ReportInterface
+from httpTransport import getTransport
+from reportInterface import ReportInterface, DELIVERED, RETRY, REJECTED
+import stageTimer
 
 class IFTTTInterface(ReportInterface):
     def __init__(self, key):
@@ -7,7 +8,12 @@ class IFTTTInterface(ReportInterface):
 
         self.key = key
         self.url = "https://maker.ifttt.com/trigger/"
+
+    @classmethod
+    def fromConfig(cls, settings, config):
+        return cls(settings["key"])
     
+    @stageTimer.timed("ifttt.post")
     def post(self, event):
         eventName = event['name']
         
@@ -20,5 +26,13 @@ class IFTTTInterface(ReportInterface):
         
         # Create post request
         url = self.url + eventName + "/with/key/" + self.key
-        r = requests.post(url, data=payload)
+        r = getTransport().post(url, data=payload)
+
+        if (r.ok):
+            return DELIVERED
+        if (r.status_code == 429 or r.status_code >= 500): # rate limited or service problem
+            return RETRY
+
+        print("IFTTTInterface - Event {} rejected (HTTP {}): {}".format(eventName, r.status_code, r.text))
+        return REJECTED
 
@@ -0,0 +1,247 @@
+import contextlib
+import json
+import os
+import tempfile
+import threading
+try:
+    import fcntl
+except ImportError: # not available on Windows, where state file updates are only serialized within a process
+    fcntl = None
+
+DEFAULT_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0, 60.0, 120.0, 300.0)
+
+def escapeLabel(value):
+    return str(value).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n')
+
+def formatLabels(labelNames, labelValues, extra=None):
+    pairs = list(zip(labelNames, labelValues)) + ([extra] if extra else [])
+    if (not pairs):
+        return ""
+    return "{" + ",".join('{}="{}"'.format(name, escapeLabel(value)) for name, value in pairs) + "}"
+
+def formatValue(value):
+    if (value == float('inf')):
+        return "+Inf"
+    return repr(float(value)) if isinstance(value, float) else str(value)
+
+def writeAtomic(path, text):
+    # Write file atomically so readers (e.g. the textfile collector) never see a partial file
+    fd, tmpPath = tempfile.mkstemp(prefix=os.path.basename(path) + ".", suffix=".tmp", dir=os.path.dirname(os.path.abspath(path)))
+    try:
+        with os.fdopen(fd, "w") as f:
+            f.write(text)
+        os.replace(tmpPath, path)
+    except OSError:
+        try:
+            os.remove(tmpPath)
+        except OSError:
+            pass
+        raise
+
+@contextlib.contextmanager
+def fileLock(path):
+    # Hold exclusive lock on path (created if missing) so processes sharing a file take turns updating it
+    if (not fcntl):
+        yield
+        return
+    with open(path, "a") as f:
+        fcntl.flock(f, fcntl.LOCK_EX)
+        try:
+            yield
+        finally:
+            fcntl.flock(f, fcntl.LOCK_UN)
+
+class Metric(object):
+# Named metric with one series per combination of label values
+    kind = "untyped"
+    cumulative = False # values accumulate over runs (counters and histograms)
+
+    def __init__(self, name, description, labelNames=()):
+        self.name = name
+        self.description = description
+        self.labelNames = tuple(labelNames)
+        self.series = dict() # label values -> value
+        self.lock = threading.Lock()
+
+    def labelValues(self, labels):
+        return tuple(str(labels.get(name, "")) for name in self.labelNames)
+
+    def copySeries(self):
+        with self.lock:
+            return dict(self.series)
+
+    def render(self, series=None):
+        # Lines for metric's series (or for series given, e.g. totals over runs)
+        lines = ["# HELP {} {}".format(self.name, self.description), "# TYPE {} {}".format(self.name, self.kind)]
+        for labelValues, value in sorted((series if series is not None else self.copySeries()).items()):
+            lines.append(self.name + formatLabels(self.labelNames, labelValues) + " " + formatValue(value))
+        return lines
+
+class Counter(Metric):
+    kind = "counter"
+    cumulative = True
+
+    def add(self, value, other, sign=1):
+        return value + sign*other
+
+    def compatible(self, value):
+        return isinstance(value, (int, float))
+
+    def inc(self, amount=1, **labels):
+        key = self.labelValues(labels)
+        with self.lock:
+            self.series[key] = self.series.get(key, 0) + amount
+
+class Gauge(Metric):
+    kind = "gauge"
+
+    def set(self, value, **labels):
+        with self.lock:
+            self.series[self.labelValues(labels)] = value
+
+class Histogram(Metric):
+    kind = "histogram"
+    cumulative = True
+
+    def __init__(self, name, description, labelNames=(), buckets=DEFAULT_BUCKETS):
+        super().__init__(name, description, labelNames)
+        self.buckets = tuple(buckets) + (float('inf'),)
+
+    def observe(self, value, **labels):
+        key = self.labelValues(labels)
+        with self.lock:
+            series = self.series.get(key)
+            if (series is None):
+                series = self.series[key] = [[0]*len(self.buckets), 0.0, 0] # bucket counts, sum, count
+            for idx, bound in enumerate(self.buckets):
+                if (value <= bound):
+                    series[0][idx] += 1
+            series[1] += value
+            series[2] += 1
+
+    def add(self, value, other, sign=1):
+        return [[a + sign*b for a, b in zip(value[0], other[0])], value[1] + sign*other[1], value[2] + sign*other[2]]
+
+    def compatible(self, value):
+        return isinstance(value, list) and len(value) == 3 and len(value[0]) == len(self.buckets)
+
+    def copySeries(self):
+        with self.lock:
+            return {labelValues: [list(bucketCounts), total, count] for labelValues, (bucketCounts, total, count) in self.series.items()}
+
+    def render(self, series=None):
+        lines = ["# HELP {} {}".format(self.name, self.description), "# TYPE {} {}".format(self.name, self.kind)]
+        for labelValues, (bucketCounts, total, count) in sorted((series if series is not None else self.copySeries()).items()):
+            for bound, bucketCount in zip(self.buckets, bucketCounts):
+                lines.append(self.name + "_bucket" + formatLabels(self.labelNames, labelValues, ("le", formatValue(float(bound)))) + " " + str(bucketCount))
+            lines.append(self.name + "_sum" + formatLabels(self.labelNames, labelValues) + " " + formatValue(total))
+            lines.append(self.name + "_count" + formatLabels(self.labelNames, labelValues) + " " + str(count))
+        return lines
+
+class MetricsRegistry(object):
+# Process-wide metrics in Prometheus text exposition format
+    def __init__(self):
+        self.metrics = dict()
+        self.lock = threading.Lock()
+        self.flushed = dict() # state file -> cumulative series values already added to it by this process
+
+    def register(self, metricClass, name, description, labelNames=(), **kwargs):
+        with self.lock:
+            if (name not in self.metrics):
+                self.metrics[name] = metricClass(name, description, labelNames, **kwargs)
+            return self.metrics[name]
+
+    def counter(self, name, description, labelNames=()):
+        return self.register(Counter, name, description, labelNames)
+
+    def gauge(self, name, description, labelNames=()):
+        return self.register(Gauge, name, description, labelNames)
+
+    def histogram(self, name, description, labelNames=(), buckets=DEFAULT_BUCKETS):
+        return self.register(Histogram, name, description, labelNames, buckets=buckets)
+
+    def render(self, totals=dict()):
+        with self.lock:
+            metrics = list(self.metrics.values())
+        lines = []
+        for metric in metrics:
+            lines.extend(metric.render(totals.get(metric.name)))
+        return "\n".join(lines) + "\n"
+
+    def accumulate(self, statePath):
+    # Add cumulative series values recorded since the last call to the totals saved in state file
+    # Counters and histograms of one-shot (cron) runs start at zero in every process, so exported values only keep increasing
+    # across runs if totals are carried between processes.  Runs started together (e.g. by cron) may share a state file, so
+    # the load, merge and replace are done holding a lock on <statePath>.lock.
+    #
+    # Outputs:
+    # totals- {metric name: {label values: total}} for counters and histograms
+        with self.lock, fileLock(statePath + ".lock"):
+            try:
+                with open(statePath) as f:
+                    saved = json.load(f)
+            except (OSError, ValueError): # missing or corrupt state starts from zero
+                saved = dict()
+
+            metrics = [metric for metric in self.metrics.values() if metric.cumulative]
+            flushed = self.flushed.setdefault(statePath, dict())
+            totals = dict()
+            for metric in metrics:
+                series = {tuple(labelValues): value for labelValues, value in saved.get(metric.name, []) if metric.compatible(value)}
+                current = metric.copySeries()
+                for labelValues, value in current.items():
+                    previous = flushed.get(metric.name, dict()).get(labelValues)
+                    delta = metric.add(value, previous, -1) if previous is not None else value
+                    series[labelValues] = metric.add(series[labelValues], delta) if labelValues in series else delta
+                flushed[metric.name] = current
+                totals[metric.name] = series
+
+            writeAtomic(statePath, json.dumps({name: [[list(labelValues), value] for labelValues, value in series.items()] for name, series in totals.items()}))
+
+        return totals
+
+    def writeTextfile(self, path, statePath=None):
+        # Write metrics for textfile collector (with statePath, counters and histograms are totals over all runs saved there)
+        writeAtomic(path, self.render(self.accumulate(statePath) if statePath else dict()))
+
+registry = MetricsRegistry()
+
+# Metrics recorded by SmartSprinkler and its interfaces
+runDuration = registry.histogram("smartsprinkler_run_duration_seconds", "Duration of sprinkler logic runs.", ("site",))
+runs = registry.counter("smartsprinkler_runs_total", "Sprinkler logic runs by result.", ("site", "result"))
+zoneStatus = registry.gauge("smartsprinkler_zone_status", "Number of zones in each status after the last run.", ("site", "status"))
+zoneStatusTotal = registry.counter("smartsprinkler_zone_status_total", "Zone status results of all runs.", ("site", "status"))
+requestDuration = registry.histogram("smartsprinkler_http_request_duration_seconds", "Latency of HTTP requests to external hosts.", ("host",))
+httpRequests = registry.counter("smartsprinkler_http_requests_total", "HTTP requests to external hosts by response code (error if no response).", ("host", "code"))
+retries = registry.counter("smartsprinkler_http_retries_total", "HTTP request retries.", ("host",))
+cacheRequests = registry.counter("smartsprinkler_cache_requests_total", "Cache lookups by cache and result.", ("cache", "result"))
+
+def makeMetricsHandler():
+    # Request handler class (http.server is imported only when metrics are served)
+    from http.server import BaseHTTPRequestHandler
+
+    class MetricsHandler(BaseHTTPRequestHandler):
+        def do_GET(self):
+            if (self.path.split("?")[0] not in ("/", "/metrics")):
+                self.send_error(404)
+                return
+
+            body = registry.render().encode('utf-8')
+            self.send_response(200)
+            self.send_header("Content-Type", "text/plain; version=0.0.4; charset=utf-8")
+            self.send_header("Content-Length", str(len(body)))
+            self.end_headers()
+            self.wfile.write(body)
+
+        def log_message(self, format, *args): # no access log
+            pass
+
+    return MetricsHandler
+
+def serveMetrics(port, address="127.0.0.1"):
+    # Serve metrics over HTTP from a background thread (returns server so it can be shut down)
+    from http.server import ThreadingHTTPServer
+    server = ThreadingHTTPServer((address, port), makeMetricsHandler())
+    server.daemon_threads = True
+    threading.Thread(target=server.serve_forever, name="MetricsServer", daemon=True).start()
+    return server
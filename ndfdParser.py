@@ -0,0 +1,116 @@
+import datetime
+
+XSI_NIL = '{http://www.w3.org/2001/XMLSchema-instance}nil'
+
+class NDFDForecast(object):
+# Daily forecast for one NDFD point
+    def __init__(self, locationKey):
+        self.locationKey = locationKey
+        self.popLayout = None
+        self.popValues = []
+        self.qpfLayout = None
+        self.qpfValues = []
+        self.pop = [] # [[day, max probability of precipitation]]
+        self.qpf = [] # [[day, total liquid precipitation]]
+
+def dailyAggregate(days, values, combine):
+    # Combine values falling on the same day (values are in time order so days are contiguous)
+    daily = []
+    for day, value in zip(days, values):
+        if (value is None): # missing value
+            continue
+        if (daily and daily[-1][0] == day):
+            daily[-1][1] = combine(daily[-1][1], value)
+        else:
+            daily.append([day, value])
+
+    return daily
+
+def parseNDFD(chunks):
+# Streaming parser for NDFD DWML time-series responses
+# Inputs:
+# chunks- iterable of raw response byte chunks
+#
+# Outputs:
+# issued- forecast issue (creation) time
+# forecasts- list of NDFDForecast, one per point in the order returned by NDFD
+    import xml.etree.ElementTree as ET # only needed when a forecast is fetched
+    parser = ET.XMLPullParser(events=('start', 'end'))
+
+    issued = None
+    forecasts = dict()
+    locationKeys = []
+    layouts = dict() # layout key -> list of days
+    dayCache = dict() # date string -> datetime
+
+    layoutKey = None
+    layoutDays = None
+    forecast = None
+    values = None
+    stack = []
+
+    for chunk in chunks:
+        parser.feed(chunk)
+        for event, elem in parser.read_events():
+            tag = elem.tag
+            if (event == 'start'):
+                stack.append(tag)
+                if (tag == 'time-layout'):
+                    layoutKey = None
+                    layoutDays = []
+                elif (tag == 'parameters'):
+                    key = elem.get('applicable-location')
+                    forecast = forecasts.setdefault(key, NDFDForecast(key))
+                elif (forecast and tag == 'probability-of-precipitation'):
+                    forecast.popLayout = elem.get('time-layout')
+                    values = forecast.popValues
+                elif (forecast and tag == 'precipitation' and elem.get('type') == 'liquid'):
+                    forecast.qpfLayout = elem.get('time-layout')
+                    values = forecast.qpfValues
+                continue
+
+            # End of element
+            stack.pop()
+            parent = stack[-1] if stack else None
+            if (tag == 'value' and values is not None):
+                if (elem.text is None or elem.get(XSI_NIL) == 'true'):
+                    values.append(None)
+                else:
+                    values.append(float(elem.text))
+            elif (tag == 'start-valid-time' and layoutDays is not None):
+                dayStr = elem.text[0:10] # only interested in day
+                day = dayCache.get(dayStr)
+                if (not day):
+                    day = datetime.datetime(int(dayStr[0:4]), int(dayStr[5:7]), int(dayStr[8:10]))
+                    dayCache[dayStr] = day
+                layoutDays.append(day)
+            elif (tag == 'layout-key' and parent == 'time-layout'):
+                layoutKey = elem.text
+            elif (tag == 'time-layout'):
+                layouts[layoutKey] = layoutDays
+                layoutDays = None
+            elif (tag == 'location-key' and parent == 'location'):
+                locationKeys.append(elem.text)
+            elif (tag == 'creation-date'):
+                issued = elem.text
+            elif (tag in ('probability-of-precipitation', 'precipitation')):
+                values = None
+            elif (tag == 'parameters'):
+                forecast = None
+
+            # Discard parsed content
+            if (tag != 'dwml'):
+                elem.clear()
+
+    parser.close()
+
+    # Daily max probability of precipitation and total liquid precipitation for each point
+    for fcst in forecasts.values():
+        fcst.pop = dailyAggregate(layouts.get(fcst.popLayout, []), [int(v) if v is not None else None for v in fcst.popValues], max)
+        fcst.qpf = dailyAggregate(layouts.get(fcst.qpfLayout, []), fcst.qpfValues, lambda a, b: a + b)
+
+    # Order forecasts by point
+    ordered = [forecasts[key] for key in locationKeys if key in forecasts]
+    ordered += [fcst for key, fcst in forecasts.items() if key not in locationKeys]
+
+    return issued, ordered
@@ -1,106 +1,213 @@
 from weatherPredict import WeatherPredict
-import datetime, requests
-import xml.etree.ElementTree as ET
+import datetime
+import os
+import threading
+import time
 from exceptions import ModuleException, BasicException
+from forecastCache import ForecastCache
+from ndfdParser import parseNDFD
+from httpTransport import getTransport
+import stageTimer
+import metrics
 
 class NWSPredict(WeatherPredict):
 # National Weather Service Digital Forecast Database REST Web Service Interface
 # https://graphical.weather.gov/xml/rest.php#what
 
-    def __init__(self):
+    chunkSize = 16384 # bytes read per chunk when streaming response
+    batchSize = 50 # zip codes per request
+
+    # Forecasts shared by all instances in this process so concurrent site runs fetch each zipcode once
+    sharedLock = threading.Lock()
+    sharedForecasts = dict() # cache key -> [fetch time, precipitation probability]
+    inflight = dict() # cache key -> event set when fetch completes
+
+    capabilities = frozenset(["batch", "cached"])
+
+    def __init__(self, cacheFile=None, cacheTtl=3600, cacheGracePeriod=86400, cacheMaxEntries=64):
         self.path = "https://graphical.weather.gov/xml/sample_products/browser_interface/ndfdXMLclient.php"
+        self.cacheTtl = cacheTtl
+        self.staleErrors = dict() # zip code -> error behind stale forecast served by last request (non-fatal, reported by run)
+
+        # Forecast cache (NDFD is only updated about hourly)
+        if (cacheFile):
+            self.cache = ForecastCache(cacheFile, cacheTtl, cacheGracePeriod, cacheMaxEntries)
+        else:
+            self.cache = None
+
+    @classmethod
+    def fromConfig(cls, settings, config):
+        cacheSettings = {key: settings[key] for key in ["cacheFile", "cacheTtl", "cacheGracePeriod", "cacheMaxEntries"] if key in settings}
+        if ("cacheFile" not in cacheSettings and "cacheDir" in config): # default forecast cache location
+            cacheSettings["cacheFile"] = os.path.join(config["cacheDir"], "nwsForecastCache.json")
+        return cls(**cacheSettings)
 
     def getPrecipProb(self, startTime, endTime, location):
+    # Get precipitation probability for desired period, using cached forecast if still valid
+        return self.getPrecipProbBatch(startTime, endTime, [location])[location]
+
+    def getPrecipProbBatch(self, startTime, endTime, locations):
+    # Get precipitation probability for desired period for many zip codes
+    # Zip codes without a valid cached forecast are requested together, batchSize zip codes per request.
+    # Inputs:
+    # startTime- start time of interval to check for chance of precipitation
+    # endTime- end time of interval to check for chance of precipitation
+    # locations- zip codes to check for chance of precipitation
+    #
+    # Outputs:
+    # precipProbs- dictionary of zip code to precipitation probability array (see fetchForecasts)
+        precipProbs = dict()
+        keys = dict()
+        claimed = []
+        waiting = []
+
+        with NWSPredict.sharedLock:
+            # Drop expired shared forecasts
+            for key in [key for key, shared in NWSPredict.sharedForecasts.items() if time.time() - shared[0] > self.cacheTtl]:
+                del NWSPredict.sharedForecasts[key]
+
+            for location in locations:
+                if (location in keys): # duplicate
+                    continue
+                key = ForecastCache.key(location, startTime, endTime)
+                keys[location] = key
+
+                # Check forecasts shared in process, then persistent cache
+                shared = NWSPredict.sharedForecasts.get(key)
+                if (shared and time.time() - shared[0] <= self.cacheTtl):
+                    metrics.cacheRequests.inc(cache="nwsShared", result="hit")
+                    precipProbs[location] = shared[1]
+                    continue
+                metrics.cacheRequests.inc(cache="nwsShared", result="miss")
+                cached = self.cache.get(key) if self.cache else None
+                if (self.cache):
+                    metrics.cacheRequests.inc(cache="nwsForecast", result="hit" if cached else "miss")
+                if (cached):
+                    precipProbs[location] = self.decodePrecipProb(cached[0])
+                    NWSPredict.sharedForecasts[key] = [time.time(), precipProbs[location]]
+                    continue
+
+                if (key in NWSPredict.inflight): # already being fetched by another run
+                    waiting.append(location)
+                else:
+                    NWSPredict.inflight[key] = threading.Event()
+                    claimed.append(location)
+
+        # Fetch forecasts not available from cache
+        error = None
+        staleErrors = dict()
+        for i in range(0, len(claimed), self.batchSize):
+            batch = claimed[i:i+self.batchSize]
+            forecasts = dict()
+            try:
+                issued, forecasts = self.fetchForecasts(startTime, endTime, batch)
+                for location in batch:
+                    precipProbs[location] = forecasts[location]
+                    if (self.cache):
+                        self.cache.put(keys[location], self.encodePrecipProb(forecasts[location]), issued)
+            except ModuleException as err:
+                error = err
+                for location in batch:
+                    stale = self.getStalePrecipProb(startTime, endTime, location, err)
+                    if (stale is not None):
+                        precipProbs[location], staleErrors[location] = stale
+            finally:
+                with NWSPredict.sharedLock:
+                    for location in batch:
+                        if (location in forecasts): # share fresh forecasts only
+                            NWSPredict.sharedForecasts[keys[location]] = [time.time(), precipProbs[location]]
+                        NWSPredict.inflight.pop(keys[location]).set()
+
+        # Remember errors behind stale forecasts served so runs can report them
+        for location in keys:
+            if (location in staleErrors):
+                self.staleErrors[location] = staleErrors[location]
+            elif (location not in waiting):
+                self.staleErrors.pop(location, None)
+
+        # Collect forecasts fetched by other runs
+        for location in waiting:
+            event = NWSPredict.inflight.get(keys[location])
+            if (event):
+                event.wait()
+            shared = NWSPredict.sharedForecasts.get(keys[location])
+            if (shared):
+                precipProbs[location] = shared[1]
+                self.staleErrors.pop(location, None)
+            else: # other fetch failed so try directly
+                precipProbs[location] = self.getPrecipProb(startTime, endTime, location)
+
+        # Raise error if any forecast could not be retrieved
+        if (error and any(location not in precipProbs for location in keys)):
+            raise error
+
+        return precipProbs
+
+    def getStalePrecipProb(self, startTime, endTime, location, err):
+        # Serve stale forecast within grace period
+        # Outputs (None if no stale forecast):
+        # precipProb- cached precipitation probability for period
+        # staleError- exception describing upstream error and forecast issue time (non-fatal)
+        stale = self.cache.getStale(location) if self.cache else None
+        if (not stale):
+            return None
+
+        message = "NWSPredict - Using cached forecast for {} issued {} after error: {}".format(location, stale[1], err.message)
+        print(message)
+        startDay = datetime.datetime(startTime.year, startTime.month, startTime.day)
+        return [day for day in self.decodePrecipProb(stale[0]) if startDay <= day[0] <= endTime], ModuleException(message, err, None)
+
+    def staleForecastError(self, location):
+        # Error behind stale forecast served for location by last request (None if forecast was current)
+        return self.staleErrors.get(location)
+
+    def encodePrecipProb(self, precipProbs):
+        return [[datetime.datetime.timestamp(day), prob] for day, prob in precipProbs]
+
+    def decodePrecipProb(self, data):
+        return [[datetime.datetime.fromtimestamp(epoch), prob] for epoch, prob in data]
+
+    @stageTimer.timed("nws.fetchForecasts")
+    def fetchForecasts(self, startTime, endTime, locations):
     # Get precipitation probability for desired period
     # Inputs:
     # startTime- start time of interval to check for chance of precipitation
     # endTime- end time of interval to check for chance of precipitation
-    # location- location to check for chance of precipitation
+    # locations- zip codes to check for chance of precipitation
     #
     # Outputs:
-    # precipProb- array of epoch time and and chance of precipitation for every day between start and end times
+    # issued- forecast issue (creation) time
+    # precipProbs- dictionary of zip code to array of epoch time and and chance of precipitation for every day between start and end times
         try:
             # Pull forecast data from source server
             beginTimeString = startTime.strftime('%Y-%m-%dT%H:%M:%S') 
             endTimeString = endTime.strftime('%Y-%m-%dT%H:%M:%S') 
 
-            payload = {'zipCodeList': location, 'product': 'time-series', 'begin': beginTimeString, 'end': endTimeString, 'pop12': 'pop12', 'qpf': 'qpf'} # 12-hour increment probability of precipitation and liquid precipitation amount
+            payload = {'zipCodeList': " ".join(str(location) for location in locations), 'product': 'time-series', 'begin': beginTimeString, 'end': endTimeString, 'pop12': 'pop12', 'qpf': 'qpf'} # 12-hour increment probability of precipitation and liquid precipitation amount
 
-            r = requests.get(self.path, params=payload)
+            r = getTransport().get(self.path, params=payload, stream=True) # retried with backoff by transport
             if (r.ok == False):
-                # Try get again
-                r = requests.get(self.path, params=payload)
-                
-                if (r.ok == False):
-                    message = "NWSPredict - Unable to get predict information."
-                    raise BasicException(message)
+                r.close()
+                message = "NWSPredict - Unable to get predict information."
+                raise BasicException(message)
                     
-            # Parse xml
+            # Parse xml incrementally from raw response bytes
+            import xml.etree.ElementTree as ET
             try: 
-                root = ET.fromstring(r.text)
+                issued, forecasts = parseNDFD(stageTimer.meteredChunks(self.path, r.iter_content(chunk_size=self.chunkSize)))
             except ET.ParseError as e: # badly formed XML from NWS
                 message = "NWSPredict - Badly formed XML received from NWS."
                 raise BasicException(message)
-                
-            data = root.find('data')
-            times = data.findall('time-layout') # start and end times
-            params = data.find('parameters')
-            prob_of_precip = params.find('probability-of-precipitation') # 12-hour probability of precipitation
-            prob_time_key = prob_of_precip.attrib['time-layout'] # probability time key
-            liquid_precip_amount = params.find('precipitation') # amount of liquid precipitation
-            precip_time_key = liquid_precip_amount.attrib['time-layout']
-
-            # Precip probability values
-            probs = []
-            for prob in prob_of_precip.findall('value'): 
-                probs.append(int(prob.text))
-
-            # Liquid preciptitation amounts
-            precips = []
-            for precip in liquid_precip_amount.findall('value'): 
-                precips.append(float(precip.text))
-
-            # Get times for data
-            prob_times = []
-            precip_times = []
-            for time_layout in times:
-                layout_key = time_layout.find('layout-key').text
-                if (layout_key == prob_time_key): # probability times
-                    start_times = time_layout.findall('start-valid-time')
-                    end_times = time_layout.findall('end-valid-time')
-                    prob_times = [[a[0].text, a[1].text] for a in zip(start_times, end_times)]
-                elif (layout_key == precip_time_key):
-                    start_times = time_layout.findall('start-valid-time')
-                    end_times = time_layout.findall('end-valid-time')
-                    precip_times = [[a[0].text, a[1].text] for a in zip(start_times, end_times)]
-                
-            # Return chance of precipitation for each day in inputted time period
-            precipProbs = []
-            currentDay = None
-            currentMaxProb = 0
-            for i in range(len(probs)): # Iterate through returned precipitation data
-                #timeStr = prob_times[i][0][:-6] # strip time zone offset
-                #day = datetime.datetime.strptime(timeStr, '%Y-%m-%dT%H:%M:%S').strftime('%d')
-                timeStr = prob_times[i][0][0:10] # only interested in day
-                day = datetime.datetime.strptime(timeStr, "%Y-%m-%d")
-            
-                if (not currentDay): # first day
-                    currentDay = day
-                    currentMaxProb = probs[i]
-                else:
-                    if(day == currentDay): # same day
-                        if (probs[i] > currentMaxProb): # greater probability for this day
-                            currentMaxProb = probs[i]
-                    else: # new day
-                        # Store previous days probability
-                        precipProbs.append([currentDay, currentMaxProb])
-
-                        # Update current day information
-                        currentDay = day
-                        currentMaxProb = probs[i]
-        
-            # Add last day's information
-            precipProbs.append([day, currentMaxProb])
+            finally:
+                r.close()
+
+            # Points are returned in the order zip codes were requested
+            if (len(forecasts) != len(locations)):
+                message = "NWSPredict - Received forecasts for {} points but requested {} zip codes.".format(len(forecasts), len(locations))
+                raise BasicException(message)
+
+            # Chance of precipitation for each day in inputted time period
+            precipProbs = {location: forecast.pop for location, forecast in zip(locations, forecasts)}
         
         except Exception as e: # failed to get weather forecast
             # Get traceback
@@ -111,5 +218,5 @@ class NWSPredict(WeatherPredict):
             raise ModuleException(message, e, tb)
         
         
-        return precipProbs
+        return issued, precipProbs
 
@@ -1,31 +1,66 @@
 from sprinklerInterface import SprinklerInterface
 import time
 from datetime import datetime
-import requests
+from httpTransport import getTransport
 import hashlib
+import os
 from exceptions import ModuleException, BasicException
+from ospiLogMirror import OSPiLogMirror
+import stageTimer
 
 class OSPiInterface(SprinklerInterface):
     # Interface to OpenSprinkler per Firmware 2.1.8 API (May 25, 2018)
     # https://openthings.freshdesk.com/support/solutions/articles/5000716363-os-api-documents
 
-    def __init__(self, path, numZones, pw):
+    def __init__(self, path, numZones, pw, logMirror=None):
         super().__init__(path, numZones, [])
 
+        # Local mirror of controller run log
+        self.logMirror = OSPiLogMirror(logMirror) if logMirror else None
+
         # Store password for api calls
         self.pw = hashlib.md5(pw.encode('utf-8')).hexdigest() 
 
         # Sprinkler program settings
         self.programFlag = 65 # enabled, weekday program schedule, fixed start time
+        self.programs = None # current controller programs by pid (None if unknown)
+
+    @classmethod
+    def fromConfig(cls, settings, config):
+        logMirror = settings["logMirror"] if "logMirror" in settings else None
+        if (not logMirror and "cacheDir" in config): # default log mirror location (one per controller)
+            logMirror = os.path.join(config["cacheDir"], "ospiLog_" + hashlib.md5(settings["url"].encode('utf-8')).hexdigest()[:12] + ".sqlite")
+        return cls(settings["url"], len(config["zones"]), settings["pw"], logMirror)
 
     def getSprinklerTotals(self, zones, startTime, endTime):
+        if (self.logMirror): # indexed queries on local mirror
+            self.syncLogMirror(startTime, endTime)
+            return self.logMirror.getTotals(zones, datetime.timestamp(startTime), datetime.timestamp(endTime))
+
         # Initialize output
         runTimes = dict()
         for zone in zones:
             runTimes.update({zone: {'totalRunTime': 0, 'lastRunTime': 0}})  
-   
+
+        # Compile zone stats
+        for zone, duration, endEpoch in self.getSprinklerLog(zones, startTime, endTime):
+            runTimes[zone]['totalRunTime'] += duration
+            if endEpoch > runTimes[zone]['lastRunTime']: # zone run more recent last stored
+                runTimes[zone]['lastRunTime'] = endEpoch
+                
+        return runTimes             
+
+    def close(self):
+        if (self.logMirror):
+            self.logMirror.close()
+
+    def syncLogMirror(self, startTime, endTime):
+        self.logMirror.sync(self.fetchLog, datetime.timestamp(startTime), datetime.timestamp(endTime))
+
+    @stageTimer.timed("ospi.fetchLog")
+    def fetchLog(self, startEpoch, endEpoch):
         # Retrieve log from OSPi
-        log_r = requests.get(self.path + "jl", params = {'pw': self.pw, 'start': str(int(datetime.timestamp(startTime))), 'end': str(int(datetime.timestamp(endTime)))})
+        log_r = getTransport().get(self.path + "jl", params = {'pw': self.pw, 'start': str(int(startEpoch)), 'end': str(int(endEpoch))})
         # TODO put in result processing based on API information - need to check if json response or requested array of log times
         logEntries = log_r.json()
         
@@ -33,31 +68,33 @@ class OSPiInterface(SprinklerInterface):
         try: # check for result code
             if ('result' in logEntries):
                 if (logEntries['result'] == 17): # date is out of range
-                    raise ModuleException("OSPIInterface - Date range is not valid. Provided start time/end time: {}, {}".format(startTime, endTime), None, None) 
+                    raise ModuleException("OSPIInterface - Date range is not valid. Provided start time/end time: {}, {}".format(datetime.fromtimestamp(startEpoch), datetime.fromtimestamp(endEpoch)), None, None) 
         except ModuleException as e:
             raise e
         except Exception as e:
             pass
-        
-        for entry in logEntries:
-            try:
-                if (entry[0] == 0): # special event record, not a run log
-                    continue
-                zone = entry[1] + 1
-                if zone in zones: # Compile zone stats
-                    duration = entry[2]     
-                    runTimes[zone]['totalRunTime'] += duration
-                    if entry[3] > runTimes[zone]['lastRunTime']: # zone run more recent last stored
-                        runTimes[zone]['lastRunTime'] = entry[3]
-            except TypeError as e:
-                # Get traceback
-                import traceback
-                tb = traceback.format_exc()
-
-                message = "OSPIInterface - An error occurred of type " + type(e).__name__ + " " + str(log_r.text) + " " + str(startTime) + " " + str(endTime)
-                raise ModuleException(message, e, tb)
-                
-        return runTimes             
+
+        # Check log entry format
+        if (not isinstance(logEntries, list) or any(not isinstance(entry, list) or len(entry) < 4 for entry in logEntries)):
+            message = "OSPIInterface - Unexpected log format received: " + str(log_r.text) + " " + str(datetime.fromtimestamp(startEpoch)) + " " + str(datetime.fromtimestamp(endEpoch))
+            raise ModuleException(message, None, None)
+
+        return logEntries
+
+    def getSprinklerLog(self, zones, startTime, endTime):
+        if (self.logMirror): # indexed queries on local mirror
+            self.syncLogMirror(startTime, endTime)
+            return self.logMirror.getLog(zones, datetime.timestamp(startTime), datetime.timestamp(endTime))
+
+        runLog = []
+        for entry in self.fetchLog(datetime.timestamp(startTime), datetime.timestamp(endTime)):
+            if (entry[0] == 0): # special event record, not a run log
+                continue
+            zone = entry[1] + 1
+            if zone in zones:
+                runLog.append([zone, entry[2], entry[3]]) # zone, duration, end time
+
+        return runLog
     
     def updateProgram(self, zoneNum, durationSec, runTimeEpoch):
         # Determine day of week
@@ -73,24 +110,67 @@ class OSPiInterface(SprinklerInterface):
         zoneId = self.getZoneId(zoneNum)
         zones = [int(0)] * self.numZones
         zones[zoneNum-1] = durationSec # duration of zone to run
-        progSettings = str([self.programFlag, days0, 0, [startTime, -1, -1, -1], zones]).replace(" ", "") 
 
         # Issue program change call to OpenSprinkler using HTTP API
-        r_changeProgram = requests.get(self.path + "cp", params = {'pid': str(zoneId), 'name': "Zone" + str(zoneNum), 'pw': self.pw, 'v': progSettings})
-        #print(r_changeProgram)
+        self.pushProgram(zoneId, "Zone" + str(zoneNum), [self.programFlag, days0, 0, [startTime, -1, -1, -1], zones])
 
     def disableProgram(self, zoneNum):
         zoneId = self.getZoneId(zoneNum) 
         
-        progSettings = str([self.programFlag-1, 1, 0, [0, -1, -1, -1], [int(0)]*self.numZones]).replace(" ", "") 
         try:
-            r_disableProgram = requests.get(self.path + "cp", params = {'pid': str(zoneId), 'name': "Zone" + str(zoneNum), 'pw': self.pw, 'v': progSettings})
+            self.pushProgram(zoneId, "Zone" + str(zoneNum), [self.programFlag-1, 1, 0, [0, -1, -1, -1], [int(0)]*self.numZones])
         except ConnectionError as e:
             import traceback
             tb = traceback.format_exc()
 
-            message = "OSPIInterface - An error occurred of type " + type(e).__name__ + " " + str(log_r.text) + " " + str(startTime) + " " + str(endTime)
+            message = "OSPIInterface - An error occurred of type " + type(e).__name__ + " disabling program for zone " + str(zoneNum)
             raise ModuleException(message, e, tb)
+
+    @stageTimer.timed("ospi.loadPrograms")
+    def loadPrograms(self):
+        # Read current programs from OSPi once per run so unchanged programs are not rewritten
+        r_programs = getTransport().get(self.path + "jp", params = {'pw': self.pw})
+        try:
+            self.programs = {pid: program for pid, program in enumerate(r_programs.json()['pd'])}
+        except (ValueError, KeyError, TypeError): # unknown program state so write every program
+            print("OSPIInterface - Unexpected program data received, all programs will be written:", r_programs.text)
+            self.programs = None
+
+    def programMatches(self, pid, name, settings):
+        # Check if controller program already has requested name and settings
+        if (self.programs is None or pid not in self.programs):
+            return False
+
+        current = self.programs[pid]
+        if (len(current) < 6 or current[:4] != settings[:4] or current[5] != name):
+            return False
+
+        # Stations beyond configured zones must be off
+        durations = settings[4]
+        return current[4][:len(durations)] == durations and not any(current[4][len(durations):])
+
+    def pushProgram(self, pid, name, settings):
+        # Send program to OSPi only if it differs from current controller program
+        if (self.programMatches(pid, name, settings)):
+            return
+
+        with stageTimer.span("ospi.pushProgram"):
+            progSettings = str(settings).replace(" ", "") 
+            r_changeProgram = getTransport().get(self.path + "cp", params = {'pid': str(pid), 'name': name, 'pw': self.pw, 'v': progSettings})
+
+        # Only record program as applied if controller accepted it (result code 1)
+        try:
+            accepted = r_changeProgram.status_code == 200 and r_changeProgram.json()['result'] == 1
+        except (ValueError, KeyError, TypeError):
+            accepted = False
+
+        if (not accepted):
+            if (self.programs is not None):
+                self.programs.pop(pid, None) # controller program unknown so rewrite it next time
+            raise ModuleException("OSPIInterface - Program change for {} rejected (HTTP {}): {}".format(name, r_changeProgram.status_code, r_changeProgram.text), None, None)
+
+        if (self.programs is not None):
+            self.programs[pid] = settings + [name]
         
     def getZoneId(self, zoneNum):
         return zoneNum-1
@@ -0,0 +1,86 @@
+import sqlite3
+import threading
+import time
+import stageTimer
+
+class OSPiLogMirror(object):
+# Local SQLite mirror of the OpenSprinkler run log
+# The mirror records the span of time it has synchronized and only requests log entries outside that span from the
+# controller, so each sync fetches just the entries newer than the last one (plus a small overlap).  Entries are kept after
+# the controller discards them, and totals and last run times come from indexed range queries on (zone, end time).
+
+    overlap = 86400 # seconds re-requested before high-water mark (covers late log writes and controller local time offsets)
+
+    def __init__(self, path):
+        self.path = path
+        self.lock = threading.Lock()
+
+        self.conn = sqlite3.connect(path, timeout=5.0, check_same_thread=False)
+        with self.conn:
+            self.conn.execute('CREATE TABLE IF NOT EXISTS runs (zone INTEGER NOT NULL, endTime INTEGER NOT NULL, pid INTEGER NOT NULL, duration INTEGER NOT NULL, PRIMARY KEY (zone, endTime, pid)) WITHOUT ROWID')
+            self.conn.execute('CREATE INDEX IF NOT EXISTS runsByEndTime ON runs (endTime)')
+            self.conn.execute('CREATE TABLE IF NOT EXISTS syncState (key TEXT PRIMARY KEY, value INTEGER)')
+
+    def getState(self, key):
+        row = self.conn.execute('SELECT value FROM syncState WHERE key = ?', (key,)).fetchone()
+        return row[0] if row else None
+
+    def setState(self, key, value):
+        self.conn.execute('INSERT OR REPLACE INTO syncState (key, value) VALUES (?, ?)', (key, value))
+
+    @stageTimer.timed("ospiLogMirror.sync")
+    def sync(self, fetchLog, startEpoch, endEpoch):
+    # Bring mirror up to date for the requested period
+    # Inputs:
+    # fetchLog- function(startEpoch, endEpoch) returning raw controller log entries ([pid, station, duration, end time])
+    # startEpoch- start of period needed
+    # endEpoch- end of period needed
+        with self.lock:
+            syncedFrom = self.getState('syncedFrom')
+            syncedTo = self.getState('syncedTo')
+            endEpoch = min(int(endEpoch), int(time.time())) # entries can only exist up to now
+            startEpoch = int(startEpoch)
+
+            fetches = []
+            if (syncedFrom is None): # empty mirror
+                fetches.append((startEpoch, endEpoch))
+            else:
+                if (startEpoch < syncedFrom): # backfill older history
+                    fetches.append((startEpoch, syncedFrom))
+                if (endEpoch > syncedTo): # entries newer than high-water mark
+                    fetches.append((syncedTo - self.overlap, endEpoch))
+
+            for fetchStart, fetchEnd in fetches:
+                entries = fetchLog(fetchStart, fetchEnd)
+                with self.conn:
+                    self.conn.executemany('INSERT OR IGNORE INTO runs (zone, endTime, pid, duration) VALUES (?, ?, ?, ?)',
+                        [(entry[1] + 1, entry[3], entry[0], entry[2]) for entry in entries if entry[0] != 0]) # skip special event records
+                    self.setState('syncedFrom', min(fetchStart, syncedFrom) if syncedFrom is not None else fetchStart)
+                    self.setState('syncedTo', max(fetchEnd, syncedTo) if syncedTo is not None else fetchEnd)
+                    syncedFrom = self.getState('syncedFrom')
+                    syncedTo = self.getState('syncedTo')
+
+    def getLog(self, zones, startEpoch, endEpoch):
+        # Run log entries ([zone, duration, end time]) for zones between start and end times
+        with self.lock:
+            rows = self.conn.execute('SELECT zone, duration, endTime FROM runs WHERE endTime BETWEEN ? AND ? ORDER BY endTime', (startEpoch, endEpoch)).fetchall()
+
+        zones = set(zones)
+        return [list(row) for row in rows if row[0] in zones]
+
+    def getTotals(self, zones, startEpoch, endEpoch):
+        # Total run time and last run time for each zone between start and end times
+        with self.lock:
+            rows = self.conn.execute('SELECT zone, TOTAL(duration), MAX(endTime) FROM runs WHERE endTime BETWEEN ? AND ? GROUP BY zone', (startEpoch, endEpoch)).fetchall()
+
+        totals = {zone: (totalRunTime, lastRunTime) for zone, totalRunTime, lastRunTime in rows}
+        runTimes = dict()
+        for zone in zones: # zones without runs in period have zero totals
+            totalRunTime, lastRunTime = totals.get(zone, (0, 0))
+            runTimes[zone] = {'totalRunTime': int(totalRunTime), 'lastRunTime': lastRunTime or 0}
+
+        return runTimes
+
+    def close(self):
+        with self.lock:
+            self.conn.close()
@@ -1,8 +1,17 @@
 
+import asyncio
+
 class PWSInterface:
+    capabilities = frozenset() # fast paths supported (see backendRegistry)
+
     def __init__(self, path):
         self.path = path
 
+    @classmethod
+    def fromConfig(cls, settings, config):
+        # Create from configuration section (settings other than type are passed as keyword arguments)
+        return cls(**{key: value for key, value in settings.items() if key != "type"})
+
     def getRainfall(self, startTime, endTime, minRainAmount):
     # Calculates total rainfall between start and end times
     # Inputs:
@@ -14,3 +23,17 @@ class PWSInterface:
 
         return -1.0, 0
 
+    def getDailyRainfall(self, startTime, endTime):
+    # Retrieves daily rainfall totals between start and end times
+    # Inputs:
+    # startTime- start time of period to extract from database
+    # endTime- end time of period to extract from database
+    #
+    # Outputs:
+    # rainRows- list of [epoch time of day, rainfall] entries
+
+        return []
+
+    async def getDailyRainfallAsync(self, startTime, endTime):
+        # Awaitable getDailyRainfall (blocking query runs in worker thread)
+        return await asyncio.to_thread(self.getDailyRainfall, startTime, endTime)
@@ -0,0 +1,181 @@
+import datetime
+import os
+import struct
+import tempfile
+import threading
+from array import array
+import stageTimer
+
+HEADER = struct.Struct('<qqi') # first day ordinal, last closed day dateTime, number of days
+
+class RainRollup(object):
+# Incremental daily rainfall rollup over the weeWX archive_day_rain table
+# Closed days (every day before the newest row) are stored once in compact arrays indexed by day, with prefix sums of rainfall
+# and a running "last rain day" index per threshold, so range sums and last rain day lookups are O(1).  Only the open (newest)
+# day and any rows after the last closed day are re-read on each update.  Closed days are optionally persisted to disk.
+
+    rollups = dict() # rollup file -> rollup shared by interfaces in process
+    rollupsLock = threading.Lock()
+
+    @classmethod
+    def forFile(cls, path=None):
+        # Rollup for file, shared by all interfaces in the process using it (e.g. fleet sites on the same database)
+        if (not path):
+            return cls()
+        with cls.rollupsLock:
+            path = os.path.abspath(path)
+            if (path not in cls.rollups):
+                cls.rollups[path] = cls(path)
+            return cls.rollups[path]
+
+    def __init__(self, path=None):
+        self.path = path
+        self.lock = threading.Lock()
+
+        self.firstOrdinal = None # ordinal of first day stored
+        self.lastClosed = None # dateTime of last closed day row
+        self.dayTimes = array('q') # dateTime of each day row (0 if no row)
+        self.rain = array('d') # rainfall of each day (positive amounts only)
+        self.prefix = array('d', [0.0]) # prefix sums of rain
+        self.lastRainIndex = dict() # minimum rain amount -> array of index of last day with rain above amount (-1 if none)
+        self.openDay = None # [dateTime, rainfall] of newest row
+
+        if (path):
+            self.load()
+
+    def load(self):
+        try:
+            with open(self.path, 'rb') as f:
+                firstOrdinal, lastClosed, numDays = HEADER.unpack(f.read(HEADER.size))
+                dayTimes = array('q')
+                rain = array('d')
+                dayTimes.fromfile(f, numDays)
+                rain.fromfile(f, numDays)
+        except (OSError, EOFError, struct.error): # missing or corrupt rollup is rebuilt from database
+            return
+
+        self.firstOrdinal = firstOrdinal
+        self.lastClosed = lastClosed
+        self.dayTimes = dayTimes
+        self.rain = rain
+        self.prefix = array('d', [0.0])
+        for amount in rain:
+            self.prefix.append(self.prefix[-1] + amount)
+
+    def save(self):
+        # Write rollup atomically so concurrent readers never see a partial file
+        fd, tmpPath = tempfile.mkstemp(prefix=os.path.basename(self.path) + ".", suffix=".tmp", dir=os.path.dirname(self.path))
+        try:
+            with os.fdopen(fd, 'wb') as f:
+                f.write(HEADER.pack(self.firstOrdinal, self.lastClosed, len(self.rain)))
+                self.dayTimes.tofile(f)
+                self.rain.tofile(f)
+            os.replace(tmpPath, self.path)
+        except OSError:
+            try:
+                os.remove(tmpPath)
+            except OSError:
+                pass
+            raise
+
+    def dayIndex(self, epoch):
+        return datetime.date.fromtimestamp(epoch).toordinal() - self.firstOrdinal
+
+    def append(self, epoch, rainfall):
+        # Add closed day to arrays
+        if (self.firstOrdinal is None):
+            self.firstOrdinal = datetime.date.fromtimestamp(epoch).toordinal()
+        idx = self.dayIndex(epoch)
+        while (len(self.rain) < idx): # days without rows
+            self.dayTimes.append(0)
+            self.rain.append(0.0)
+            self.prefix.append(self.prefix[-1])
+        amount = rainfall if rainfall and rainfall > 0 else 0.0
+        self.dayTimes.append(int(epoch) if rainfall is not None else 0) # days without a rain sum are skipped like in SQL queries
+        self.rain.append(amount)
+        self.prefix.append(self.prefix[-1] + amount)
+        self.lastClosed = epoch
+
+    @stageTimer.timed("rainRollup.update")
+    def update(self, fetchRows):
+    # Read new rows from database
+    # Inputs:
+    # fetchRows- function(afterDateTime) returning [dateTime, rainfall] rows newer than afterDateTime in time order
+        with self.lock:
+            rows = fetchRows(self.lastClosed if self.lastClosed is not None else -1)
+            if (not rows):
+                return
+
+            # All rows but the newest are closed days
+            for epoch, rainfall in rows[:-1]:
+                self.append(epoch, rainfall)
+            self.openDay = rows[-1] if rows[-1][1] is not None else None # match SQL queries, which skip NULL sums
+
+            if (len(rows) > 1):
+                self.lastRainIndex = dict() # rebuilt on demand
+                if (self.path):
+                    try:
+                        self.save()
+                    except OSError as e: # rollup is an optimization so keep running without persistence
+                        print("RainRollup - Unable to write rollup file {}: {}".format(self.path, e))
+
+    def getLastRainIndex(self, minRainAmount):
+        index = self.lastRainIndex.get(minRainAmount)
+        if (index is None):
+            index = array('q')
+            last = -1
+            for idx, amount in enumerate(self.rain):
+                if (amount > 0 and amount > minRainAmount):
+                    last = idx
+                index.append(last)
+            self.lastRainIndex[minRainAmount] = index
+
+        return index
+
+    def getRainfall(self, startTime, endTime, minRainAmount):
+    # Total rainfall and last day with rain above minRainAmount for day rows with dateTime between start and end times
+        with self.lock:
+            rainfall = 0.0
+            lastDayOfRain = 0
+            startEpoch = datetime.datetime.timestamp(startTime)
+            endEpoch = datetime.datetime.timestamp(endTime)
+
+            if (self.firstOrdinal is not None and len(self.rain) > 0):
+                # Day rows fall at the start of their day, so include start day only if its row is at or after start time
+                first = max(startTime.date().toordinal() - self.firstOrdinal, 0)
+                if (first < len(self.rain) and self.dayTimes[first] < startEpoch):
+                    first += 1
+                last = min(endTime.date().toordinal() - self.firstOrdinal, len(self.rain) - 1)
+                if (last >= 0 and self.dayTimes[last] > endEpoch):
+                    last -= 1
+
+                if (first <= last):
+                    rainfall = self.prefix[last + 1] - self.prefix[first]
+                    lastRain = self.getLastRainIndex(minRainAmount)[last]
+                    if (lastRain >= first):
+                        lastDayOfRain = self.dayTimes[lastRain]
+
+            # Open day
+            if (self.openDay and startEpoch <= self.openDay[0] <= endEpoch and self.openDay[1] and self.openDay[1] > 0):
+                rainfall += self.openDay[1]
+                if (self.openDay[1] > minRainAmount):
+                    lastDayOfRain = self.openDay[0]
+
+        return rainfall, lastDayOfRain
+
+    def getDailyRainfall(self, startTime, endTime):
+        # Daily rainfall rows ([dateTime, rainfall]) between start and end times
+        with self.lock:
+            startEpoch = datetime.datetime.timestamp(startTime)
+            endEpoch = datetime.datetime.timestamp(endTime)
+            rainRows = []
+            if (self.firstOrdinal is not None and len(self.rain) > 0):
+                first = max(startTime.date().toordinal() - self.firstOrdinal, 0)
+                last = min(endTime.date().toordinal() - self.firstOrdinal, len(self.rain) - 1)
+                for idx in range(first, last + 1):
+                    if (self.dayTimes[idx] and startEpoch <= self.dayTimes[idx] <= endEpoch):
+                        rainRows.append([self.dayTimes[idx], self.rain[idx]])
+            if (self.openDay and startEpoch <= self.openDay[0] <= endEpoch):
+                rainRows.append(list(self.openDay))
+
+        return rainRows
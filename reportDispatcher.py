@@ -0,0 +1,177 @@
+import atexit
+import collections
+import json
+import os
+import random
+import tempfile
+import threading
+from reportInterface import ReportInterface, RETRY, REJECTED
+
+class ReportDispatcher(ReportInterface):
+# Non-blocking report queue in front of a report interface
+# post() only queues the event; a worker thread delivers queued events in order, retrying failed deliveries with exponential
+# backoff (events the interface rejects permanently are logged and dropped).  A queued status event is replaced by a newer one for the same site so a backlog collapses to the latest status.
+# The queue is bounded (oldest events are dropped when full) and undelivered events are persisted so they survive restarts.
+
+    mergeEvents = ("smartSprinkler_status",) # events where only the newest queued event is delivered
+
+    def __init__(self, reportInt, queueFile=None, maxQueue=100, backoff=5.0, maxBackoff=600.0, flushTimeout=10.0):
+        super().__init__()
+
+        self.reportInt = reportInt
+        self.queueFile = queueFile
+
+        self.queue = collections.deque()
+        self.cond = threading.Condition()
+        self.saveLock = threading.Lock() # serializes queue file writes (worker and close)
+        self.worker = None
+        self.failures = 0 # consecutive failed deliveries
+        self.dirty = False # queue changed since last save
+        self.stopping = False
+        self.configure(maxQueue, backoff, maxBackoff, flushTimeout)
+
+        self.load()
+        atexit.register(self.close)
+        with self.cond:
+            if (self.queue): # deliver events left from previous run
+                self.startWorker()
+
+    def configure(self, maxQueue=100, backoff=5.0, maxBackoff=600.0, flushTimeout=10.0):
+        # Apply queue settings (also used when a reloaded configuration reuses the dispatcher)
+        with self.cond:
+            self.backoff = backoff # seconds before first retry
+            self.maxBackoff = maxBackoff
+            self.flushTimeout = flushTimeout # seconds to wait for delivery at exit
+            if (self.queue.maxlen != maxQueue): # keeps newest events if queue shrinks
+                self.queue = collections.deque(self.queue, maxlen=maxQueue)
+                self.dirty = True
+
+    def load(self):
+        if (not self.queueFile):
+            return
+
+        try:
+            with open(self.queueFile) as f:
+                self.queue.extend(json.load(f))
+        except (OSError, ValueError): # missing or corrupt queue file starts empty
+            pass
+
+    def save(self, events):
+        # Write queue atomically so a crash never leaves a partial file
+        fd, tmpPath = tempfile.mkstemp(prefix=os.path.basename(self.queueFile) + ".", suffix=".tmp", dir=os.path.dirname(os.path.abspath(self.queueFile)))
+        try:
+            with os.fdopen(fd, "w") as f:
+                json.dump(events, f)
+            os.replace(tmpPath, self.queueFile)
+        except (OSError, TypeError, ValueError):
+            try:
+                os.remove(tmpPath)
+            except OSError:
+                pass
+            raise
+
+    def saveQueue(self):
+        # Persist queue if changed (called without lock held; writes are serialized so an older queue never replaces a newer one)
+        with self.saveLock:
+            with self.cond:
+                if (not self.queueFile or not self.dirty):
+                    return
+                events = list(self.queue)
+                self.dirty = False
+
+            try:
+                self.save(events)
+            except (OSError, TypeError, ValueError) as e: # delivery continues without persistence
+                print("ReportDispatcher - Unable to write report queue {}: {}".format(self.queueFile, e))
+
+    def post(self, event):
+        with self.cond:
+            if (event['name'] in self.mergeEvents): # newer status supersedes queued status
+                for queued in self.queue:
+                    if (queued['name'] == event['name']):
+                        self.queue.remove(queued)
+                        break
+
+            if (len(self.queue) == self.queue.maxlen):
+                print("ReportDispatcher - Report queue full, dropping oldest event:", self.queue[0]['name'])
+            self.queue.append(event)
+            self.dirty = True
+
+            self.cond.notify()
+            self.startWorker()
+
+    def startWorker(self):
+        # Start worker thread if not running (called with lock held)
+        if (self.worker is None and not self.stopping):
+            self.worker = threading.Thread(target=self.run, name="ReportDispatcher", daemon=True)
+            self.worker.start()
+
+    def run(self):
+        while (True):
+            self.saveQueue()
+            with self.cond:
+                if (not self.queue or self.stopping): # worker exits when idle and restarts on next post
+                    self.worker = None
+                    return
+                event = self.queue[0]
+
+            try:
+                result = self.reportInt.post(event)
+            except Exception as e: # e.g. connection error or timeout
+                print("ReportDispatcher - Error delivering event {} of type {}: {}".format(event['name'], type(e).__name__, e))
+                result = RETRY
+
+            if (result == REJECTED): # retrying would block every event behind it
+                print("ReportDispatcher - Event {} rejected by report interface, dropping it.".format(event['name']))
+            delivered = result is not RETRY
+
+            with self.cond:
+                if (delivered):
+                    if (self.queue and self.queue[0] is event): # event may have been merged or dropped during delivery
+                        self.queue.popleft()
+                        self.dirty = True
+                    self.failures = 0
+                else:
+                    # Exponential backoff with jitter
+                    delay = min(self.maxBackoff, self.backoff * 2**self.failures) * random.uniform(0.5, 1.0)
+                    self.failures += 1
+                    self.cond.wait_for(lambda: self.stopping, timeout=delay)
+
+    def flush(self, timeout=None):
+        # Wait until queue is empty (returns True if all events were delivered)
+        with self.cond:
+            worker = self.worker
+        if (worker):
+            worker.join(timeout)
+
+        with self.cond:
+            return not self.queue
+
+    def close(self):
+        # Deliver what can be delivered within flush timeout and persist the rest
+        self.flush(self.flushTimeout)
+        with self.cond:
+            self.stopping = True
+            self.cond.notify_all()
+            worker = self.worker
+        if (worker):
+            worker.join(1.0)
+        self.saveQueue()
+        atexit.unregister(self.close)
+
+dispatchers = dict()
+dispatchersLock = threading.Lock()
+
+def getReportDispatcher(reportInt, queueFile=None, **settings):
+    # One dispatcher per queue file so reloaded configurations keep delivering the same queue
+    if (not queueFile):
+        return ReportDispatcher(reportInt, None, **settings)
+
+    with dispatchersLock:
+        if (queueFile not in dispatchers):
+            dispatchers[queueFile] = ReportDispatcher(reportInt, queueFile, **settings)
+        else:
+            dispatchers[queueFile].reportInt = reportInt
+            dispatchers[queueFile].configure(**settings)
+
+        return dispatchers[queueFile]
@@ -1,6 +1,19 @@
+# Results of ReportInterface.post
+DELIVERED = True
+RETRY = False # temporary failure (connection error, timeout, 429 or 5xx) worth retrying
+REJECTED = "rejected" # permanent failure (e.g. invalid key or event), retrying will not help
+
 class ReportInterface(object):
+    capabilities = frozenset() # fast paths supported (see backendRegistry)
+
     def __init__(self):
         pass
 
+    @classmethod
+    def fromConfig(cls, settings, config):
+        # Create from configuration section (settings other than type are passed as keyword arguments)
+        return cls(**{key: value for key, value in settings.items() if key != "type"})
+
     def post(self, event):
+        # Send event (returns DELIVERED, RETRY or REJECTED)
         pass
@@ -0,0 +1,25 @@
+import datetime
+import heapq
+
+def scheduleRuns(runs, maxConcurrent=1):
+# Place zone runs so no more than maxConcurrent stations run at once
+# Runs are taken in order of requested start time and each starts at the later of its requested time and the time the
+# earliest station slot becomes free, so start times are only ever delayed.  O(n log n) for n runs.
+# Inputs:
+# runs- list of [start time, zone, duration (seconds)] entries
+# maxConcurrent- number of stations the controller may run at once
+#
+# Outputs:
+# scheduledRuns- list of [start time, zone, duration (seconds)] entries sorted by start time
+    scheduledRuns = []
+    slots = [] # heap of times station slots become free
+
+    for requestedStart, zone, duration in sorted(runs, key=lambda run: run[0]):
+        startTime = requestedStart
+        if (len(slots) >= maxConcurrent): # all slots in use so wait for earliest free slot
+            startTime = max(requestedStart, heapq.heappop(slots))
+
+        heapq.heappush(slots, startTime + datetime.timedelta(seconds=duration))
+        scheduledRuns.append([startTime, zone, duration])
+
+    return scheduledRuns
@@ -0,0 +1,318 @@
+import argparse
+import collections
+import copy
+import datetime
+import gzip
+import json
+import os
+import sys
+import tempfile
+import time
+from urllib.parse import urlsplit
+import httpTransport
+from exceptions import ModuleException, BasicException
+from pwsInterface import PWSInterface
+from backendRegistry import supports
+from smartSprinkler import SmartSprinkler
+
+# Snapshot of every external input of one runSprinklerLogic call (gzip compressed JSON)
+# Record mode runs the sprinkler logic normally with a fixed clock and local caches disabled, capturing PWS results, raw HTTP
+# responses (OSPi log and programs, NWS XML), sunrise/sunset times and the decision made.  It is a real run: programs are
+# written to the controller and reports are posted, so only record when a normal run would be made anyway.  Replay mode runs the logic offline
+# against the snapshot and compares decisions, so optimizations can be profiled on production inputs without changing results.
+
+SNAPSHOT_VERSION = 1
+WRITE_COMMANDS = ("cp", "dp", "cv", "cr", "mp") # OSPi commands that change controller state
+SECRET_PARAMS = ("pw",)
+
+def requestParams(params):
+    return {key: str(value) for key, value in sorted((params or dict()).items()) if key not in SECRET_PARAMS}
+
+def requestKey(url, params):
+    return url + "?" + json.dumps(requestParams(params), sort_keys=True)
+
+def isWrite(url):
+    return urlsplit(url).path.rstrip("/").split("/")[-1] in WRITE_COMMANDS
+
+class RecordingTransport(object):
+# Transport wrapper recording GET responses and controller writes (report posts are passed through unrecorded)
+    def __init__(self, transport):
+        self.transport = transport
+        self.responses = []
+        self.writes = []
+
+    def configure(self, settings):
+        self.transport.configure(settings)
+
+    def get(self, url, params=None, stream=False):
+        r = self.transport.get(url, params=params, stream=stream)
+        self.responses.append({'url': url, 'params': requestParams(params), 'status': r.status_code,
+                               'contentType': r.headers.get('Content-Type', ''), 'body': r.content.decode('utf-8', 'replace')})
+        if (isWrite(url)):
+            self.writes.append({'url': url, 'params': requestParams(params)})
+        return r
+
+    def post(self, url, data=None, retry=False):
+        return self.transport.post(url, data=data, retry=retry)
+
+class ReplayResponse(object):
+# Minimal requests.Response stand-in for recorded responses
+    def __init__(self, status, body, contentType=''):
+        self.status_code = status
+        self.ok = status < 400
+        self.content = body.encode('utf-8')
+        self.text = body
+        self.headers = {'Content-Type': contentType}
+
+    def json(self):
+        return json.loads(self.text)
+
+    def iter_content(self, chunk_size=1):
+        for start in range(0, len(self.content), chunk_size):
+            yield self.content[start:start + chunk_size]
+
+    def close(self):
+        pass
+
+class ReplayTransport(object):
+# Transport serving recorded responses in order (controller writes are acknowledged and collected for comparison)
+    def __init__(self, responses):
+        self.recorded = responses
+        self.reset()
+
+    def reset(self):
+        self.responses = collections.defaultdict(collections.deque)
+        for response in self.recorded:
+            self.responses[requestKey(response['url'], response['params'])].append(response)
+        self.writes = []
+
+    def configure(self, settings):
+        pass
+
+    def get(self, url, params=None, stream=False):
+        if (isWrite(url)):
+            self.writes.append({'url': url, 'params': requestParams(params)})
+
+        responses = self.responses.get(requestKey(url, params))
+        if (not responses):
+            if (isWrite(url)):
+                return ReplayResponse(200, '{"result":1}', 'application/json')
+            raise BasicException("RunSnapshot - No recorded response for " + requestKey(url, params))
+
+        response = responses.popleft() if len(responses) > 1 else responses[0] # last response repeats
+        return ReplayResponse(response['status'], response['body'], response['contentType'])
+
+    def post(self, url, data=None, retry=False):
+        return ReplayResponse(200, '', 'text/plain')
+
+def encodeArgs(args):
+    return [arg.isoformat() if isinstance(arg, datetime.datetime) else arg for arg in args]
+
+class RecordingPWS(PWSInterface):
+# PWS wrapper recording query results
+    def __init__(self, pws):
+        super().__init__(pws.path)
+        self.pws = pws
+        self.calls = []
+
+    def getRainfall(self, startTime, endTime, minRainAmount):
+        result = self.pws.getRainfall(startTime, endTime, minRainAmount)
+        self.calls.append({'method': 'getRainfall', 'args': encodeArgs([startTime, endTime, minRainAmount]), 'result': list(result)})
+        return result
+
+    def getDailyRainfall(self, startTime, endTime):
+        result = self.pws.getDailyRainfall(startTime, endTime)
+        self.calls.append({'method': 'getDailyRainfall', 'args': encodeArgs([startTime, endTime]), 'result': [list(row) for row in result]})
+        return result
+
+class ReplayPWS(PWSInterface):
+# PWS serving recorded query results
+    def __init__(self, calls):
+        super().__init__(None)
+        self.results = {json.dumps([call['method']] + call['args']): call['result'] for call in calls}
+
+    def getResult(self, method, args):
+        key = json.dumps([method] + encodeArgs(args))
+        if (key not in self.results):
+            raise ModuleException("RunSnapshot - No recorded PWS result for " + key, None, None)
+        return self.results[key]
+
+    def getRainfall(self, startTime, endTime, minRainAmount):
+        return tuple(self.getResult('getRainfall', [startTime, endTime, minRainAmount]))
+
+    def getDailyRainfall(self, startTime, endTime):
+        return self.getResult('getDailyRainfall', [startTime, endTime])
+
+def clearSharedForecasts(smartSprinkler):
+    # Forecasts shared between runs in a process would bypass the transport
+    sharedForecasts = getattr(type(smartSprinkler.config.weatherPredict), 'sharedForecasts', None)
+    if (sharedForecasts is not None):
+        sharedForecasts.clear()
+
+def getDecision(smartSprinkler, writes):
+    # Watering decision of last run (log entry without timestamp and timings, and controller writes)
+    logEntry = None
+    if (smartSprinkler.lastLogEntry):
+        logEntry = {key: value for key, value in smartSprinkler.lastLogEntry.items() if key not in ('timestamp', 'timing')}
+
+    return json.loads(json.dumps({'log': logEntry, 'writes': writes})) # same form as when loaded from snapshot
+
+def compareDecisions(recorded, replayed):
+    # Descriptions of differences between decisions (empty if identical)
+    differences = []
+    recordedLog = recorded['log'] or dict()
+    replayedLog = replayed['log'] or dict()
+    for key in sorted(set(recordedLog) | set(replayedLog)):
+        if (recordedLog.get(key) != replayedLog.get(key)):
+            differences.append("{}: recorded {} replayed {}".format(key, recordedLog.get(key), replayedLog.get(key)))
+    if (recorded['writes'] != replayed['writes']):
+        differences.append("writes: recorded {} replayed {}".format(recorded['writes'], replayed['writes']))
+
+    return differences
+
+def loadSnapshot(snapshotFile):
+    with gzip.open(snapshotFile, 'rt', encoding='utf-8') as f:
+        snapshot = json.load(f)
+    if (snapshot.get('version') != SNAPSHOT_VERSION):
+        raise BasicException("RunSnapshot - Unsupported snapshot version {}.".format(snapshot.get('version')))
+
+    return snapshot
+
+def saveSnapshot(snapshot, snapshotFile):
+    fd, tmpPath = tempfile.mkstemp(prefix=os.path.basename(snapshotFile) + ".", suffix=".tmp", dir=os.path.dirname(os.path.abspath(snapshotFile)))
+    try:
+        with os.fdopen(fd, 'wb') as raw, gzip.open(raw, 'wt', encoding='utf-8') as f:
+            json.dump(snapshot, f, separators=(',', ':'))
+        os.replace(tmpPath, snapshotFile)
+    except (OSError, TypeError, ValueError): # unwritable file or unserializable snapshot
+        try:
+            os.remove(tmpPath)
+        except OSError:
+            pass
+        raise
+
+def recordRun(settings, snapshotFile):
+    # Run sprinkler logic once and record its inputs and decision
+    # This is a real run: controller programs are changed and reports posted exactly as by smartSprinklerMain.
+    from smartSprinklerExecute import runLogic
+
+    # Local caches would hide inputs from the snapshot
+    settings = copy.deepcopy(settings)
+    settings.pop('cacheDir', None)
+    for section, key in (('sprinklerInterface', 'logMirror'), ('weatherPredict', 'cacheFile')):
+        if (section in settings):
+            settings[section].pop(key, None)
+
+    smartSprinkler = SmartSprinkler(settings, [])
+    now = datetime.datetime.now()
+    smartSprinkler.clock = lambda: now # one instant for the whole run so replays see the same times
+    if (smartSprinkler.config.pws):
+        smartSprinkler.config.pws = RecordingPWS(smartSprinkler.config.pws)
+    clearSharedForecasts(smartSprinkler)
+
+    recorder = RecordingTransport(httpTransport.getTransport())
+    previous = httpTransport.setTransport(recorder)
+    try:
+        errString = runLogic(smartSprinkler)
+    finally:
+        httpTransport.setTransport(previous)
+
+    # Secrets are not needed for replay
+    recordedSettings = copy.deepcopy(settings)
+    recordedSettings.pop('reportInterface', None)
+    if ('sprinklerInterface' in recordedSettings):
+        recordedSettings['sprinklerInterface']['pw'] = ""
+
+    snapshot = {'version': SNAPSHOT_VERSION, 'now': now.isoformat(), 'utcOffset': now.astimezone().utcoffset().total_seconds(),
+                'settings': recordedSettings, 'error': errString,
+                'pws': smartSprinkler.config.pws.calls if smartSprinkler.config.pws else [],
+                'http': recorder.responses,
+                'sunTimes': {day.isoformat(): times for day, times in smartSprinkler.config.runTimeSchedule.timesByDay.items()},
+                'decision': getDecision(smartSprinkler, recorder.writes)}
+    saveSnapshot(snapshot, snapshotFile)
+
+    return snapshot
+
+def replayRun(snapshot, repeat=1, profileFile=None):
+    # Run sprinkler logic against recorded inputs (no network, controller or database access)
+    # Outputs:
+    # decision- decision of last replayed run
+    # times- wall time of each replayed run (seconds)
+    now = datetime.datetime.fromisoformat(snapshot['now'])
+    if (now.astimezone().utcoffset().total_seconds() != snapshot['utcOffset']):
+        print("RunSnapshot - Local time zone differs from recording, program start times may differ.")
+
+    with tempfile.TemporaryDirectory() as tmpDir:
+        settings = copy.deepcopy(snapshot['settings'])
+        settings['logFile'] = os.path.join(tmpDir, "replay.log")
+        settings['statusFile'] = os.path.join(tmpDir, "replayStatus.json")
+        settings.pop('metricsFile', None)
+
+        smartSprinkler = SmartSprinkler(settings, [])
+        smartSprinkler.clock = lambda: now
+        config = smartSprinkler.config
+        if (config.pws):
+            config.pws = ReplayPWS(snapshot['pws'])
+        if (supports(config.weatherPredict, "cached")):
+            config.weatherPredict.cache = None
+        for day, times in snapshot['sunTimes'].items():
+            config.runTimeSchedule.timesByDay[datetime.date.fromisoformat(day)] = times
+
+        transport = ReplayTransport(snapshot['http'])
+        previous = httpTransport.setTransport(transport)
+        profiler = None
+        if (profileFile):
+            import cProfile
+            profiler = cProfile.Profile()
+
+        times = []
+        try:
+            for rep in range(repeat):
+                transport.reset()
+                clearSharedForecasts(smartSprinkler)
+                start = time.perf_counter()
+                if (profiler):
+                    profiler.enable()
+                smartSprinkler.runSprinklerLogic()
+                if (profiler):
+                    profiler.disable()
+                times.append(time.perf_counter() - start)
+        finally:
+            httpTransport.setTransport(previous)
+            if (profiler):
+                profiler.dump_stats(profileFile)
+
+    return getDecision(smartSprinkler, transport.writes), times
+
+def main():
+    parser = argparse.ArgumentParser(description="Record or replay the inputs of a SmartSprinkler run.")
+    subparsers = parser.add_subparsers(dest="mode", required=True)
+    recordParser = subparsers.add_parser("record", help="run sprinkler logic once for real (controller programs are changed and reports posted) and record its inputs",
+        description="Run sprinkler logic once and record its inputs. This is a real run: programs are written to the controller and reports are posted.")
+    recordParser.add_argument("--config", default="smartSprinkler.yaml", help="configuration file")
+    recordParser.add_argument("--snapshot", required=True, help="snapshot file to write (gzip JSON)")
+    replayParser = subparsers.add_parser("replay", help="replay recorded inputs offline and compare decisions")
+    replayParser.add_argument("--snapshot", required=True, help="snapshot file to replay")
+    replayParser.add_argument("--repeat", type=int, default=1, help="number of replayed runs")
+    replayParser.add_argument("--profile", metavar="FILE", help="write cProfile statistics of replayed runs to FILE")
+    args = parser.parse_args()
+
+    if (args.mode == "record"):
+        from smartSprinklerExecute import loadSettings
+        snapshot = recordRun(loadSettings(args.config), args.snapshot)
+        print("RunSnapshot - Recorded {} HTTP responses and {} PWS results to {}".format(len(snapshot['http']), len(snapshot['pws']), args.snapshot))
+        return
+
+    snapshot = loadSnapshot(args.snapshot)
+    decision, times = replayRun(snapshot, args.repeat, args.profile)
+    print("RunSnapshot - Replayed {} runs, median {:.4f} s, min {:.4f} s".format(len(times), sorted(times)[len(times)//2], min(times)))
+
+    differences = compareDecisions(snapshot['decision'], decision)
+    for difference in differences:
+        print("RunSnapshot - Decision differs:", difference)
+    if (differences):
+        sys.exit(1)
+    print("RunSnapshot - Decisions match recording.")
+
+if __name__ == "__main__":
+    main()
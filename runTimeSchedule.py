@@ -0,0 +1,80 @@
+import datetime
+import re
+from exceptions import BasicException
+from sunTable import lookupSunRiseAndSet
+
+OFFSET_PATTERN = re.compile(r'^([+-])(\d{1,2}):(\d{2})$')
+TIME_PATTERN = re.compile(r'^(\d{1,2}):(\d{2})$')
+
+class RunTimeEntry(object):
+# Desired run time of day relative to sunrise or sunset, or absolute
+    def __init__(self, base, offset, text):
+        self.base = base # 'sunrise', 'sunset' or 'absolute'
+        self.offset = offset # seconds (signed offset from base, or seconds after midnight for absolute times)
+        self.text = text
+
+    @classmethod
+    def parse(cls, text):
+        # Parse entries such as "sunrise -02:00", "sunset +00:30" or "05:30"
+        fields = str(text).split()
+        if (len(fields) == 2): # relative time
+            base = fields[0].lower()
+            match = OFFSET_PATTERN.match(fields[1])
+            if (base not in ('sunrise', 'sunset') or not match or int(match.group(3)) >= 60):
+                raise BasicException("RunTimeSchedule - Invalid run time of day '{}', expected 'sunrise|sunset +HH:MM'.".format(text))
+            offset = int(match.group(2))*60*60 + int(match.group(3))*60
+            return cls(base, -offset if match.group(1) == '-' else offset, text)
+        elif (len(fields) == 1): # absolute time
+            match = TIME_PATTERN.match(fields[0])
+            if (not match or int(match.group(1)) >= 24 or int(match.group(2)) >= 60):
+                raise BasicException("RunTimeSchedule - Invalid run time of day '{}', expected 'HH:MM'.".format(text))
+            return cls('absolute', int(match.group(1))*60*60 + int(match.group(2))*60, text)
+
+        raise BasicException("RunTimeSchedule - Invalid run time of day '{}'.".format(text))
+
+    def timeOfDay(self, sunrise, sunset):
+        # Time of day in seconds (None if base does not occur on this day)
+        if (self.base == 'sunrise'):
+            return sunrise + self.offset if sunrise >= 0 else None
+        elif (self.base == 'sunset'):
+            return sunset + self.offset if sunset >= 0 else None
+
+        return self.offset
+
+class RunTimeSchedule(object):
+# Compiled desiredRunTimeOfDay configuration
+# Entries are parsed and validated once when the configuration is loaded; times of day are memoized per day.
+
+    def __init__(self, entries, location, cacheDir=None):
+        self.entries = entries
+        self.location = location
+        self.cacheDir = cacheDir
+        self.timesByDay = dict()
+
+    @classmethod
+    def compile(cls, desiredRunTimes, location, cacheDir=None):
+        if (not desiredRunTimes):
+            raise BasicException("RunTimeSchedule - At least one desired run time of day is required.")
+
+        return cls([RunTimeEntry.parse(text) for text in desiredRunTimes], location, cacheDir)
+
+    def timesOfDay(self, day):
+        # Run times of day (seconds after midnight) of each entry for day
+        if (day not in self.timesByDay):
+            sunrise, sunset = lookupSunRiseAndSet(self.location, day, self.cacheDir)
+            self.timesByDay[day] = [entry.timeOfDay(sunrise, sunset) for entry in self.entries]
+
+        return self.timesByDay[day]
+
+    def resolve(self, runDays):
+    # Candidate run times for each day
+    # Inputs:
+    # runDays- list of day start datetimes
+    #
+    # Outputs:
+    # runTimes- list (one per day) of lists of candidate run datetimes in entry order (None where the entry does not occur)
+        runTimes = []
+        for runDay in runDays:
+            runTimes.append([runDay + datetime.timedelta(seconds=timeOfDay) if timeOfDay is not None else None for timeOfDay in self.timesOfDay(runDay.date())])
+
+        return runTimes
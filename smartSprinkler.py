@@ -1,12 +1,20 @@
 import time # time module
+import asyncio
 import datetime
 import json
 import math
 import copy
+import os
 from enum import IntEnum
-from astral import LocationInfo
-import astral.sun
 from exceptions import ModuleException, BasicException
+from waterHistory import WaterHistory
+from runScheduler import scheduleRuns
+from runTimeSchedule import RunTimeSchedule
+from zoneBalance import ZoneBalance
+from zoneTable import ZoneTable
+from backendRegistry import supports
+import stageTimer
+import metrics
 
 class SSStatus(IntEnum):
     Requirement_Met = 0
@@ -32,95 +40,128 @@ class SmartSprinklerConfig(dict):
 
     def loadConfig(self, settings, sprinklerLog):
         self.update(settings)
+        self.compileSettings()
+        self.loadInterfaces()
+
+    def compileSettings(self):
+        # Validate and compile settings (no connections are made so the result can be saved in a configuration snapshot)
+
+        # Site name (metrics label)
+        self.siteName = str(self['siteName']) if 'siteName' in self else "default"
 
         # Location
         self['location'] = {'lat': self['location'][0], 'lon': self['location'][1], 'zipcode': self['location'][2], 'timezone': self['location'][3]}
 
+        # Compile desired run times of day
+        try:
+            self.runTimeSchedule = RunTimeSchedule.compile(self['desiredRunTimeOfDay'], self['location'], self['cacheDir'] if 'cacheDir' in self else None)
+        except BasicException as e:
+            message = "SmartSprinklerConfig - Invalid desiredRunTimeOfDay setting: " + e.message
+            raise ModuleException(message, e, None)
+
         # Generate zone by zone config
         overrides = self['overrides'] if 'overrides' in self else None
         self.loadZoneConfig(overrides)
 
-        # Check config
-        if ("pws" in self): # Validate PWS config
-            try:
-                if (self["pws"]["type"].lower() == "weewx"): # weeWX PWS
-                    from weewxInterface import WeeWXInterface
-                    self.pws = WeeWXInterface(self["pws"]["weatherDbFile"])
-                else:
-                    self.pws = None
-            except Exception as e:
-                message = "SmartSprinklerConfig - Error experienced while loading PWS information, of type " + type(e).__name__
-                raise ModuleException(message, e, None)
-        else:
-            self.pws = None
-
-        if ("sprinklerInterface" in self): # Validate sprinkler interface config
+        # Number of stations the controller may run at once
+        maxConcurrent = self['maxConcurrentStations'] if 'maxConcurrentStations' in self else 1
+        if (isinstance(maxConcurrent, bool) or not isinstance(maxConcurrent, int) or maxConcurrent < 1):
+            message = "SmartSprinklerConfig - Invalid maxConcurrentStations setting: expected an integer of at least 1, got " + repr(maxConcurrent)
+            raise ModuleException(message, None, None)
+
+    def loadInterfaces(self):
+        # Apply process-wide settings and create interfaces (also done when configuration is loaded from a snapshot)
+
+        # HTTP transport settings (defaults if not set, e.g. when removed before a daemon reload)
+        from httpTransport import getTransport
+        getTransport().configure(self["http"] if "http" in self else dict())
+
+        # Create interfaces for configured backend types (backend modules are imported only when selected)
+        from backendRegistry import registry
+        for kind, attribute, description in [("pws", "pws", "PWS"), ("sprinklerInterface", "sprinklerInterface", "sprinkler interface"),
+                                             ("weatherPredict", "weatherPredict", "weather predict interface"), ("reportInterface", "reportInt", "report interface")]:
+            backend = None
+            if (kind in self):
+                try:
+                    backend = registry.create(kind, self[kind], self)
+                except Exception as e:
+                    message = "SmartSprinklerConfig - Error experienced while loading " + description + " information, of type " + type(e).__name__
+                    raise ModuleException(message, e, None)
+            setattr(self, attribute, backend)
+
+        # Deliver reports from background queue
+        if (self.reportInt and (self["reportInterface"]["background"] if "background" in self["reportInterface"] else True)):
             try:
-                if (self["sprinklerInterface"]["type"].lower() == "ospi"): # OSPi
-                    from openSprinklerInterface import OSPiInterface
-                    self.sprinklerInterface = OSPiInterface(self["sprinklerInterface"]["url"], len(self["zones"]), self["sprinklerInterface"]["pw"])
-                else:
-                    self.sprinklerInterface = None
+                from reportDispatcher import getReportDispatcher
+                queueSettings = {key: self["reportInterface"][key] for key in ["queueFile", "maxQueue", "backoff", "maxBackoff", "flushTimeout"] if key in self["reportInterface"]}
+                if ("queueFile" not in queueSettings and "cacheDir" in self): # default report queue location (one per site)
+                    import hashlib
+                    queueSettings["queueFile"] = os.path.join(self["cacheDir"], "reportQueue_" + hashlib.md5(str(self["logFile"]).encode('utf-8')).hexdigest()[:12] + ".json")
+                self.reportInt = getReportDispatcher(self.reportInt, **queueSettings)
             except Exception as e:
-                message = "SmartSprinklerConfig - Error experienced while loading sprinkler interface information, of type " + type(e).__name__
-                raise ModuleException(message, e, None)
-        else:
-            self.sprinklerInterface = None
-        
-        if ("weatherPredict" in self): # Validate weather predict config
-            try:
-                if (self["weatherPredict"]["type"].lower() == "wunderground"): # Wunderground
-                    from wundergroundPredict import WundergroundPredict
-                    self.weatherPredict = WundergroundPredict(self["weatherPredict"]["url"])
-                elif (self["weatherPredict"]["type"].lower() == "nws"): # National Weather Service
-                    from nwsPredict import NWSPredict
-                    self.weatherPredict = NWSPredict()
-                else:
-                    self.weatherPredict = None
-            except Exception as e:
-                message = "SmartSprinklerConfig - Error experienced while loading weather predict interface information, of type " + type(e).__name__
+                message = "SmartSprinklerConfig - Error experienced while loading report interface interface information, of type " + type(e).__name__
                 raise ModuleException(message, e, None)
-        else:
-            self.weatherPredict = None
 
-        if ("reportInterface" in self): # Validate report interface config
+    def closeInterfaces(self, keep=()):
+        # Close connections and worker threads held by interfaces (e.g. when configuration is replaced), except interfaces in keep
+        for interface in [self.pws, self.sprinklerInterface, self.weatherPredict, self.reportInt]:
+            if (interface is None or any(interface is kept for kept in keep) or not hasattr(interface, 'close')):
+                continue
             try:
-                if (self["reportInterface"]["type"].lower() == "ifttt"): # IFTTT reporting
-                    from iftttInterface import IFTTTInterface
-                    self.reportInt = IFTTTInterface(self["reportInterface"]["key"])
-                else:
-                    self.reportInt = None
+                interface.close()
             except Exception as e:
-                message = "SmartSprinklerConfig - Error experienced while loading report interface interface information, of type " + type(e).__name__
-                raise ModuleException(message, e, None)
-        else:
-            self.reportInt = None
+                print("SmartSprinklerConfig - Error closing interface of type " + type(interface).__name__ + ":", str(e))
 
     def loadZoneConfig(self, overrides):
         # Create zone-specific configuration 
-        self.zoneConfig = dict()
-        for idx, zone in enumerate(self['zones']):
-            self.zoneConfig[zone] = {'zoneWateringRate': self['zoneWateringRate'][idx], 'weeklyWaterReq': self['weeklyWaterReq'][idx],
-                'minWateringLength': self['minWateringLength'][idx], 'maxWateringLength': self['maxWateringLength'][idx]}
-            if (overrides and zone in overrides):
-                self.zoneConfig[zone]['overrides'] = overrides[zone]
-
-def calculateSunRiseAndSet(location):
-    # Create location
-    loc = LocationInfo(('name', 'region', location['lat'], location['lon'], location['timezone'], 0))
-
-    now = datetime.datetime.now()
-    #sun = loc.sun()
-    sun = astral.sun.sun(loc.observer, date=datetime.date.today())  
-    midnight = now.replace(hour=0, minute=0, second=0, microsecond=0)
-    sunrise = (sun['sunrise'].replace(tzinfo=None) - midnight).seconds
-    sunset = (sun['sunset'].replace(tzinfo=None) - midnight).seconds
-    
-    return sunrise, sunset
+        try:
+            self.zoneTable = ZoneTable.compile(self['zones'], self['zoneWateringRate'], self['weeklyWaterReq'], self['minWateringLength'], self['maxWateringLength'], overrides)
+        except BasicException as e:
+            message = "SmartSprinklerConfig - Invalid zone settings: " + e.message
+            raise ModuleException(message, e, None)
+
+        # Zone settings as arrays for whole-zone water balance calculations
+        self.zoneBalance = ZoneBalance(self['zoneWateringRate'], self['weeklyWaterReq'], self['minWateringLength'], self['maxWateringLength'])
+
+    def __getstate__(self):
+        # Compiled settings only (interfaces hold connections and threads and are recreated by loadInterfaces)
+        return {'siteName': self.siteName, 'runTimeSchedule': self.runTimeSchedule, 'zoneTable': self.zoneTable}
+
+    def __setstate__(self, state):
+        self.__dict__.update(state)
+        self.zoneBalance = ZoneBalance(self['zoneWateringRate'], self['weeklyWaterReq'], self['minWateringLength'], self['maxWateringLength'])
+
+def calculateWeekTimes(currentTime):
+    # Start of current day and start and end of current week
+    midnightToday = datetime.datetime(currentTime.year, currentTime.month, currentTime.day)
+    currentDayOfWeek = (midnightToday.weekday() + 1) % 7
+    startOfCurWeek = midnightToday - datetime.timedelta(days=currentDayOfWeek) # start week on Sunday
+    endOfCurWeek = startOfCurWeek + datetime.timedelta(days=7, seconds=-30) # subtraction of 30 seconds ensures end time is part of same week
+
+    return midnightToday, startOfCurWeek, endOfCurWeek
 
 class SmartSprinkler(object):
     def __init__(self, configSettings, sprinklerLog):
-        self.config = SmartSprinklerConfig(configSettings, sprinklerLog)
+        if (isinstance(configSettings, SmartSprinklerConfig)): # already loaded (from configuration snapshot)
+            self.config = configSettings
+        else:
+            self.config = SmartSprinklerConfig(configSettings, sprinklerLog)
+        self.waterHistory = None
+        self.clock = None # function returning current time (None for system clock)
+        self.lastLogEntry = None
+        self.eventLoop = None # event loop reused across runs (None for new event loop per run)
+
+    def now(self):
+        # Current time (replaceable so recorded runs can be replayed)
+        if (self.clock):
+            return self.clock()
+        return datetime.datetime.now()
+
+    def runAsync(self, coroutine):
+        # Run coroutine to completion (reusing event loop when simulating many runs)
+        if (self.eventLoop):
+            return self.eventLoop.run_until_complete(coroutine)
+        return asyncio.run(coroutine)
 
     def calculateWeeklyWaterAvg(self, startOfCurWeek):
     # Calculate average weekly water total over desired averaging period
@@ -139,9 +180,79 @@ class SmartSprinkler(object):
         
         return avgTotals
 
+    async def gatherInputs(self, historyStart, historyEnd, forecastStart, forecastEnd):
+    # Fetch rainfall history, sprinkler run log and precipitation forecast concurrently
+    # Inputs:
+    # historyStart, historyEnd- widest window of water history needed by this run
+    # forecastStart, forecastEnd- period of precipitation forecast
+    #
+    # Outputs:
+    # waterHistory- rainfall and sprinkler history for window
+    # precipProb- precipitation probability forecast ([] if unavailable)
+    # forecastError- forecast exception (non-fatal) or None
+
+        async def noData():
+            return []
+
+        def fetch(backend, method, *args):
+            # Await non-blocking backends directly, run blocking calls in worker thread
+            if (supports(backend, "async")):
+                return getattr(backend, method + "Async")(*args)
+            return asyncio.to_thread(getattr(backend, method), *args)
+
+        # Daily rainfall
+        if (self.config.pws):
+            rainTask = fetch(self.config.pws, "getDailyRainfall", historyStart, historyEnd)
+        else:
+            rainTask = noData()
+
+        # Sprinkler run log
+        if (self.config.sprinklerInterface):
+            logTask = fetch(self.config.sprinklerInterface, "getSprinklerLog", self.config['zones'], historyStart, historyEnd)
+        else:
+            logTask = noData()
+
+        # Weather forecast
+        if (self.config.weatherPredict):
+            forecastTask = fetch(self.config.weatherPredict, "getPrecipProb", forecastStart, forecastEnd, self.config['location']['zipcode'])
+        else:
+            forecastTask = noData()
+
+        rainRows, sprinklerLog, precipProb = await asyncio.gather(rainTask, logTask, forecastTask, return_exceptions=True)
+
+        # History errors are fatal, forecast errors are not
+        for result in (rainRows, sprinklerLog):
+            if (isinstance(result, BaseException)):
+                raise result
+
+        forecastError = None
+        if (isinstance(precipProb, (BasicException, ModuleException))):
+            forecastError = precipProb # store exception and continue
+            precipProb = []
+        elif (isinstance(precipProb, BaseException)):
+            raise precipProb
+        elif (self.config.weatherPredict and hasattr(self.config.weatherPredict, "staleForecastError")):
+            forecastError = self.config.weatherPredict.staleForecastError(self.config['location']['zipcode']) # out of date forecast used
+
+        return WaterHistory(self.config['zones'], self.config['minRainAmount'], historyStart, historyEnd, rainRows, sprinklerLog), precipProb, forecastError
+
     def getTotalWaterForPeriod(self, startTime, endTime):
     # Calculate the total water (rain and sprinklers) for the requested time period 
         
+        if (self.waterHistory and self.waterHistory.covers(startTime, endTime)): # answer from history loaded for this run
+            rainTotal, lastTimeRain = self.waterHistory.getRainfall(startTime, endTime)
+            sprinklerTotal = self.waterHistory.getSprinklerTotals(startTime, endTime)
+        else:
+            rainTotal, lastTimeRain, sprinklerTotal = self.fetchWaterForPeriod(startTime, endTime)
+
+        # Total water for this period by zone (rain and sprinklers)
+        totalWater = self.config.zoneBalance.totalWater(rainTotal, [sprinklerTotal[zone]['totalRunTime'] for zone in self.config['zones']])
+        
+        return rainTotal, lastTimeRain, sprinklerTotal, totalWater
+
+    def fetchWaterForPeriod(self, startTime, endTime):
+    # Query the PWS and sprinkler interfaces directly for the requested time period
+
         # Calculate total rain
         if (self.config.pws):
             try:
@@ -170,13 +281,10 @@ class SmartSprinkler(object):
 
         else:
             sprinklerTotal = dict()
-            for zone in zones:
+            for zone in self.config['zones']:
                 sprinklerTotal.update({zone: {'totalRunTime': 0, 'lastRunTime': 0}})  
 
-        # Total water for this period by zone (rain and sprinklers)
-        totalWater = [rainTotal + sprinklerTotal[self.config['zones'][i]]['totalRunTime']/60.0*self.config['zoneWateringRate'][i] for i in range(len(self.config['zones']))]
-        
-        return rainTotal, lastTimeRain, sprinklerTotal, totalWater
+        return rainTotal, lastTimeRain, sprinklerTotal
         
     def calculateWateringRequired(self, startOfCurWeek):
     # Calculate how much water is required this week
@@ -188,33 +296,45 @@ class SmartSprinkler(object):
         print("Total water over averaging period:", totalWater, startTime, endTime)
  
         # Calculate water required this week to meet desired watering over average period
-        wateringReq = [0] * len(self.config['zones'])
-        for zone in range(len(wateringReq)):
-            desiredWaterTotal = self.config['avgWeeks'] * self.config['weeklyWaterReq'][zone]
-            wateringReq[zone] = desiredWaterTotal - totalWater[zone] # desired total minus actual water received 
-            print("Calculated water required:", zone, desiredWaterTotal, wateringReq[zone])
+        wateringReq = self.config.zoneBalance.wateringRequired(totalWater, self.config['avgWeeks']) # desired total minus actual water received
+        print("Calculated water required:", wateringReq)
         return wateringReq
 
     def applyOverrides(self, zone, totalWaterThisWeek, lastTimeWater, waterRequired, runDayEpoch):
         print("Applying overrides for zone {}".format(zone))
        
         newRun = None 
-        if ('dailyWater' in self.config.zoneConfig[zone]['overrides']):
+        zoneSettings = self.config.zoneTable[zone]
+        if ('dailyWater' in zoneSettings.overrides):
             # Check if daily water requirement already met
             _, _, _, totalWater = self.getTotalWaterForPeriod(runDayEpoch, runDayEpoch + datetime.timedelta(hours=24))
-            waterToday = totalWater[self.config['zones'].index(zone) ]
-            waterNeed = self.config.zoneConfig[zone]['overrides']['dailyWater'] - waterToday
+            waterToday = totalWater[zoneSettings.index]
+            waterNeed = zoneSettings.overrides['dailyWater'] - waterToday
             if (waterNeed > 0):
                 # Schedule daily water requirement for last available daily run time
-                wateringLength = math.ceil(waterNeed/self.config.zoneConfig[zone]['zoneWateringRate']*60.0) # needed length (seconds)
-                runTime = self.getRunTime(self.config['desiredRunTimeOfDay'][-1], runDayEpoch, self.config)
-                if (wateringLength >= self.config.zoneConfig[zone]['minWateringLength']):
+                wateringLength = math.ceil(waterNeed/zoneSettings.zoneWateringRate*60.0) # needed length (seconds)
+                runTime = self.getRunTime(-1, runDayEpoch)
+                if (wateringLength >= zoneSettings.minWateringLength):
                     newRun = [runTime, zone, wateringLength]
             else:
                 print("Daily water override already met for zone {}".format(zone))           
 
         return newRun
 
+    def changeProgram(self, nonFatalException, change, *args):
+        # Apply controller program change; a failed change is recorded as non-fatal so the remaining zones are still updated
+        # Outputs:
+        # nonFatalException- non-fatal exception of run including any error from this change
+        try:
+            change(*args)
+        except ModuleException as err:
+            print(err.message)
+            if (nonFatalException is None):
+                return err
+            return ModuleException(nonFatalException.message + "; " + err.message, err, None)
+
+        return nonFatalException
+
     def runSprinklerLogic(self):
         nonFatalException = None    
 
@@ -222,6 +342,7 @@ class SmartSprinkler(object):
         if (self.config['enable'] == False):
             # Disable all programs
             if (self.config.sprinklerInterface):
+                self.config.sprinklerInterface.loadPrograms()
                 for i in range(len(self.config['zones'])):
                     try:
                         self.config.sprinklerInterface.disableProgram(self.config['zones'][i])
@@ -246,13 +367,17 @@ class SmartSprinkler(object):
         waterRequired = self.config['weeklyWaterReq']
    
         # Determine important times (does not account for DST)
-        currentTime = datetime.datetime.now()
-        midnightToday = datetime.datetime(currentTime.year, currentTime.month, currentTime.day)
-        currentDayOfWeek = (midnightToday.weekday() + 1) % 7
-        startOfCurWeek = midnightToday - datetime.timedelta(days=currentDayOfWeek) # start week on Sunday
+        currentTime = self.now()
+        midnightToday, startOfCurWeek, endOfCurWeek = calculateWeekTimes(currentTime)
         midWeek = startOfCurWeek + datetime.timedelta(days=3) # midweek epoch for splitting up long watering times
-        endOfCurWeek = startOfCurWeek + datetime.timedelta(days=7, seconds=-30) # subtraction of 30 seconds ensures end time is part of same week
         lastDayOfWeek = datetime.datetime(endOfCurWeek.year, endOfCurWeek.month, endOfCurWeek.day) # start of last day of week
+
+        # Fetch water history covering all periods queried during this run and weather forecast concurrently
+        historyWeeks = 2 if (self.config['excessRollover'] and self.config['deficitMakeup']) else 1
+        historyStart = startOfCurWeek - datetime.timedelta(days=7*historyWeeks)
+        historyEnd = max(endOfCurWeek, midnightToday + datetime.timedelta(hours=24))
+        with stageTimer.span("gatherInputs"):
+            self.waterHistory, precipProb, nonFatalException = self.runAsync(self.gatherInputs(historyStart, historyEnd, currentTime, endOfCurWeek))
         
         # Total water this week
         _, _, _, totalWaterThisWeek = self.getTotalWaterForPeriod(startOfCurWeek, endOfCurWeek)
@@ -268,14 +393,8 @@ class SmartSprinkler(object):
             else:
                 _, _, _, totalWaterLastWeek = self.getTotalWaterForPeriod(startOfCurWeek - datetime.timedelta(days=7), startOfCurWeek)
 
-            # Calculate excess or deficit
-            waterAdj = [0]*len(totalWaterLastWeek)
-            for idx,zone in enumerate(self.config['zones']):
-                waterDelta = totalWaterLastWeek[idx] - self.config.zoneConfig[zone]['weeklyWaterReq']
-                if (self.config['excessRollover'] and waterDelta > 0):
-                    waterAdj[idx] -= waterDelta # subtract excess from watering requirement
-                elif (self.config['deficitMakeup'] and waterDelta < 0):
-                    waterAdj[idx] += -waterDelta # add deficit to watering requirement
+            # Calculate excess (subtracted from watering requirement) or deficit (added to watering requirement)
+            waterAdj = self.config.zoneBalance.rolloverAdjustment(totalWaterLastWeek, self.config['excessRollover'], self.config['deficitMakeup'])
 
             waterRequired = [req + adj for req, adj in zip(waterRequired, waterAdj)] 
 
@@ -293,22 +412,26 @@ class SmartSprinkler(object):
         nextDayToWater = [0]*len(self.config['zones'])
         status = [SSStatus.Requirement_Met]*len(self.config['zones'])
         runData = []
-    
-        # Check weather forecast 
-        precipProb = []
-        if (self.config.weatherPredict):
-            try:    
-                precipProb = self.config.weatherPredict.getPrecipProb(currentTime, endOfCurWeek, self.config['location']['zipcode'])
-            except BasicException as err:
-                nonFatalException = err # store exception and continue    
-            except ModuleException as err:
-                nonFatalException = err # store exception and continue    
-                #raise err
+
+        # Current controller programs (only changed programs are written)
+        if (self.config.sprinklerInterface):
+            self.config.sprinklerInterface.loadPrograms()
         
+        # Determine amount to water (in inches) and when to run sprinklers for each zone, accounting for predicted weather
+        runNow = currentTime > lastDayOfWeek # last day of week so force sprinkler run
+        updates = [None]*len(self.config['zones'])
+        for idx,zone in enumerate(self.config['zones']):
+            if (self.config.zoneTable[zone].overrides is None):
+                updates[idx] = self.getWateringUpdate(idx, totalWaterThisWeek[idx], lastTimeWater[idx], waterRequired[idx], self.config, startOfCurWeek, endOfCurWeek, runNow, precipProb)
+
+        # Run durations (bounded by min and max watering length) and watering requirement beyond max run length for all zones
+        requestedLength, splitRun = self.config.zoneBalance.wateringLengths([update[1] if update else 0 for update in updates])
+        excessLength = self.config.zoneBalance.excessLengths(waterRequired, totalWaterThisWeek)
+
         for idx,zone in enumerate(self.config['zones']):
             
             # Check for override
-            if ('overrides' in self.config.zoneConfig[zone]):
+            if (self.config.zoneTable[zone].overrides is not None):
                 newRun = self.applyOverrides(zone, totalWaterThisWeek[idx], lastTimeWater[idx], waterRequired[idx], midnightToday)
                 if (newRun):
                     runData.append(newRun)
@@ -316,53 +439,39 @@ class SmartSprinkler(object):
                 continue            
 
             newRun = []
-            runNow = False
-            if (currentTime > lastDayOfWeek): # last day of week so force sprinkler run
-                runNow = True
-
-            # Determine amount to water (in inches) and when to run sprinklers for zone, accounting for predicted weather
-            nextDayToWater[idx], amountToWater, status[idx], runTime, timeChoice = self.getWateringUpdate(idx, totalWaterThisWeek[idx], lastTimeWater[idx], waterRequired[idx], self.config, startOfCurWeek, endOfCurWeek, runNow, precipProb)
+            nextDayToWater[idx], amountToWater, status[idx], runTime, timeChoice = updates[idx]
             
             if amountToWater > 0: # need to run sprinklers in this zone
-                ## Determine run duration
-                wateringLength[idx] = math.ceil(amountToWater/self.config.zoneConfig[zone]['zoneWateringRate']*60.0) # requested length (seconds)
-                # Do bounds checking
-                wateringLength[idx] = max(wateringLength[idx], self.config.zoneConfig[zone]['minWateringLength']) # lower bound
-                #wateringLength[zone] = min(wateringLength[zone], self.config['maxWateringLength'][zone]) # upper bound
-                
-                # Round run length to nearest minute
-                #wateringLength[zone] = int(math.ceil(wateringLength[zone]/60.0)*60.0)
+                wateringLength[idx] = requestedLength[idx]
             
                 # Check if longer than max run time
-                if (wateringLength[idx] > self.config.zoneConfig[zone]['maxWateringLength']): # need to split run
+                if (splitRun[idx]): # need to split run
                     print("Splitting run time for zone {} due to max length exceedance.".format(zone))
-                    wateringLength[idx] = min(wateringLength[idx], self.config.zoneConfig[zone]['maxWateringLength']) # upper bound
-                
                     if (runTime > (midWeek)): # run midweek
-                        runTime = self.determineRunTime(self.config['desiredRunTimeOfDay'], midWeek, self.config, timeChoice) 
+                        runTime = self.determineRunTime(midWeek, timeChoice) 
                 
                 # Store run time data
                 newRun = [runTime, zone, wateringLength[idx]]
             
             else: # disable zone program    
                 if (self.config.sprinklerInterface):
-                    self.config.sprinklerInterface.disableProgram(zone)
+                    nonFatalException = self.changeProgram(nonFatalException, self.config.sprinklerInterface.disableProgram, zone)
 
             # Check for watering requirement exceeding maximum run length
-            if ((waterRequired[idx] - totalWaterThisWeek[idx]) / self.config.zoneConfig[zone]['zoneWateringRate'] > self.config.zoneConfig[zone]['maxWateringLength']): # schedule watering of excess
-                excessAmount = (waterRequired[idx] - totalWaterThisWeek[idx]) / self.config.zoneConfig[zone]['zoneWateringRate'] - self.config.zoneConfig[zone]['maxWateringLength'] # water excess over max length
+            if (excessLength[idx] > 0): # schedule watering of excess
+                excessAmount = excessLength[idx] # water excess over max length
                 if (newRun): # update existing schedule run
                     newRun[2] = max(newRun[2], excessAmount) # update amount
                     if (currentTime < midWeek): # update time
                         runTime = min(newRun[0], midWeek) # run by midweek
-                        newRun[0] = self.determineRunTime(self.config['desiredRunTimeOfDay'], runTime, self.config, timeChoice) 
+                        newRun[0] = self.determineRunTime(runTime, timeChoice) 
 
                     else: # already past midweek
-                        newRun[0] = self.determineRunTime(self.config['desiredRunTimeOfDay'], midnight, self.config, timeChoice) 
+                        newRun[0] = self.determineRunTime(midnightToday, timeChoice) 
                 
                 else: # schedule run by midweek
-                    runEpoch = max(midnight, midWeek)
-                    runTime = self.determineRunTime(self.config['desiredRunTimeOfDay'], runEpoch, self.config, timeChoice)
+                    runEpoch = max(midnightToday, midWeek)
+                    runTime = self.determineRunTime(runEpoch, timeChoice)
                     wateringLength[idx] = excessAmount
 
 
@@ -374,29 +483,32 @@ class SmartSprinkler(object):
         # Modify sprinkler programs 
         logTime = 0
         if any(run[2] > 0 for run in runData): # Watering required by at least one zone
-            # Sort by run times
-            sortedRuns = sorted(runData, key=lambda tup: tup[0])    
-            # Check for run time conflicts
-            for i in range(1,len(sortedRuns)):
-                for j in range(0,i):
-                    if sortedRuns[i][0] == sortedRuns[j][0]: # same run start time so increment
-                        sortedRuns[i][0] = sortedRuns[j][0] + datetime.timedelta(seconds=sortedRuns[j][2])
-                    elif sortedRuns[i][0] > sortedRuns[j][0] and sortedRuns[i][0] < (sortedRuns[j][0] + datetime.timedelta(seconds=sortedRuns[j][2])): # scheduled to start while other station running
-                        sortedRuns[i][0] = sortedRuns[j][0] + datetime.timedelta(sortedRuns[j][2])
+            # Sort by run times and resolve run time conflicts
+            maxConcurrent = self.config['maxConcurrentStations'] if 'maxConcurrentStations' in self.config else 1
+            runData = scheduleRuns(runData, maxConcurrent)
 
             # Update programs
             if (self.config.sprinklerInterface):
-                for run in sortedRuns:
-                    self.config.sprinklerInterface.updateProgram(run[1], run[2], datetime.datetime.timestamp(run[0]))
+                with stageTimer.span("updatePrograms"):
+                    for run in runData:
+                        nonFatalException = self.changeProgram(nonFatalException, self.config.sprinklerInterface.updateProgram, run[1], run[2], datetime.datetime.timestamp(run[0]))
         
         else: # No watering required - disable all programs
             if (self.config.sprinklerInterface):
-                for i in range(len(self.config['zones'])):
-                    self.config.sprinklerInterface.disableProgram(self.config['zones'][i])
+                with stageTimer.span("updatePrograms"):
+                    for i in range(len(self.config['zones'])):
+                        nonFatalException = self.changeProgram(nonFatalException, self.config.sprinklerInterface.disableProgram, self.config['zones'][i])
 
         # Log execution data
         print(totalWaterThisWeek)
         logEntry = self.logStatus(self.config['logFile'], self.config['statusFile'], status, runData, totalWaterThisWeek, lastTimeWater, waterRequired)
+
+        # Zone status metrics
+        for ssStatus in SSStatus:
+            numZones = sum(1 for zoneStatus in status if zoneStatus == ssStatus)
+            metrics.zoneStatus.set(numZones, site=self.config.siteName, status=ssStatus.name)
+            if (numZones):
+                metrics.zoneStatusTotal.inc(numZones, site=self.config.siteName, status=ssStatus.name)
         
         # Report status
         if (self.config.reportInt and self.config['reportEnable'] != ReportEnable.Disable):
@@ -411,64 +523,27 @@ class SmartSprinkler(object):
 
             self.config.reportInt.post({'name': "smartSprinkler_status", 'data': [logEntry, exceptionStr]})
 
-    def calculateRunTime(self, timeEntries, settings):
-        """Converts inputted run time to a time of day in seconds."""
-        if (len(timeEntries) == 2): # relative time
-            # Calculate offset
-            offsetSign = timeEntries[1][0] # negative or positive offset
-            offset = timeEntries[1][1:].split(":")
-            offset = int(offsetSign + str(int(offset[0])*60*60 + int(offset[1])*60))
-            
-            # Calculate sunset and sunrise times
-            sunrise, sunset = calculateSunRiseAndSet(settings['location'])
-
-            # Apply offset to base
-            if (timeEntries[0] == 'sunrise'):
-                # Add offset to sunrise time
-                timeOfDaySec = sunrise + offset
-            elif (timeEntries[0] == 'sunset'):
-                # Add offset to sunset time
-                timeOfDaySec = sunset + offset
-            else: # invalid base
-                # TODO - raise exception
-                print("Invalid time offset base")
-                return None
-        else: # absolute time
-            timeOfDay = rtime.split(":")
-            timeOfDaySec = int(timeOfDay[0])*60*60 + int(timeOfDay[1])*60
-        
-        return timeOfDaySec
+    def getRunTime(self, entryIndex, runDayEpoch):
+        # Run time of desired run time of day entry on run day
+        return self.config.runTimeSchedule.resolve([runDayEpoch])[0][entryIndex]
 
-    def getRunTime(self, runTime, runDayEpoch, settings):
-        timeEntries = runTime.split()
-        timeOfDaySec = self.calculateRunTime(timeEntries, settings)
-        runTime = runDayEpoch + datetime.timedelta(seconds=timeOfDaySec)
-        
-        return runTime
-
-    def determineRunTime(self, desiredRunTimes, runDayEpoch, settings, timeChoice='first'):
-        # Input desiredRunTimes are assumed to be monotonically increasing
-        currentTime = datetime.datetime.now()
+    def determineRunTime(self, runDayEpoch, timeChoice='first'):
+        # Desired run times are assumed to be monotonically increasing
+        currentTime = self.now()
         runTime = None   
  
-        for rtime in desiredRunTimes:
-            timeEntries = rtime.split()
-            timeOfDaySec = self.calculateRunTime(timeEntries, settings)
+        # Candidate run times today and tomorrow
+        candidates, candidatesTomorrow = self.config.runTimeSchedule.resolve([runDayEpoch, runDayEpoch + datetime.timedelta(days=1)])
+        for candidate in candidates:
             # Check if time has already passed 
-            if (timeOfDaySec and currentTime < (runDayEpoch + datetime.timedelta(seconds=timeOfDaySec))): # can run at this time
-                runTime = runDayEpoch + datetime.timedelta(seconds=timeOfDaySec)
+            if (candidate and currentTime < candidate): # can run at this time
+                runTime = candidate
                 if (timeChoice == 'first'): # looking for first valid run time
                     break
 
         if not runTime: # desired times already passed
             # Run tomorrow
-            timeOfDay = desiredRunTimes[0].split(":")
-            for rtime in desiredRunTimes:
-                timeEntries = rtime.split()
-                timeOfDaySec = self.calculateRunTime(timeEntries, settings)
-                if (timeOfDaySec):
-                    break
-            runTime = runDayEpoch + datetime.timedelta(days=1,seconds=timeOfDaySec)
+            runTime = next(candidate for candidate in candidatesTomorrow if candidate)
         
         return runTime
 
@@ -500,7 +575,7 @@ class SmartSprinkler(object):
             running = False
             if (runNow):
                 print("Run now override for zone:", zone)
-                waterTime = datetime.datetime.now()
+                waterTime = self.now()
                 nextDayToWater = datetime.datetime(waterTime.year, waterTime.month, waterTime.day) # midnight
                 #nextDayToWater = waterTime - (waterTime - time.altzone)%86400 # midnight of day to water
                 amountToWater = weeklyWaterReq - amountOfWater
@@ -519,8 +594,8 @@ class SmartSprinkler(object):
                     else:  # water a reduced amount in case of rain
                         print("Watering a reduced amount in case of rain")
                         waterTime = min(endTime, lastTimeWater + datetime.timedelta(days=config['maxDaysBetweenWater'])) 
-                        if (waterTime < datetime.datetime.now()): # check for watering times in the past
-                            waterTime = datetime.datetime.now()
+                        if (waterTime < self.now()): # check for watering times in the past
+                            waterTime = self.now()
                         nextDayToWater = datetime.datetime(waterTime.year, waterTime.month, waterTime.day) # midnight
                         #nextDayToWater = waterTime - (waterTime - time.altzone)%86400 # midnight of day to water
                         amountToWater = 0.5*(weeklyWaterReq - amountOfWater) # water half of remaining weekly requirement
@@ -531,8 +606,8 @@ class SmartSprinkler(object):
                 waterTime = min(endTime, lastTimeWater + datetime.timedelta(days=config['maxDaysBetweenWater'])) 
             
                 # Check for watering times in the past
-                if (waterTime < datetime.datetime.now()):
-                    waterTime = datetime.datetime.now()
+                if (waterTime < self.now()):
+                    waterTime = self.now()
 
                 nextDayToWater = datetime.datetime(waterTime.year, waterTime.month, waterTime.day) # midnight
                 amountToWater = weeklyWaterReq - amountOfWater
@@ -540,7 +615,7 @@ class SmartSprinkler(object):
                 running = True
             
             if (running): # determine run time
-                runTime = self.determineRunTime(config['desiredRunTimeOfDay'], nextDayToWater, config, timeChoice)
+                runTime = self.determineRunTime(nextDayToWater, timeChoice)
 
         return nextDayToWater, amountToWater, status, runTime, timeChoice
 
@@ -570,5 +645,12 @@ class SmartSprinkler(object):
         return logEntry
    
     def writeLogEntry(self, logEntry):
+        self.lastLogEntry = logEntry
+
+        # Timings of run so far
+        timings = stageTimer.current()
+        if (timings):
+            logEntry['timing'] = timings.summary()
+
         with open(self.config['logFile'], "a") as f:
             f.write(json.dumps(logEntry) + "\n")
@@ -0,0 +1,113 @@
+import asyncio
+import datetime
+import signal
+from smartSprinkler import SmartSprinkler
+from smartSprinklerExecute import loadSettings, runLogic
+from exceptions import ModuleException
+import metrics
+
+class SmartSprinklerDaemon(object):
+# Long-running service that keeps a SmartSprinkler instance (and its interfaces and caches) loaded between runs
+# Sprinkler logic is run on a fixed interval and shortly before each desired run time of day.  Configuration is reloaded on SIGHUP.
+
+    def __init__(self, settingsFile, sprinklerLog=[]):
+        self.settingsFile = settingsFile
+        self.sprinklerLog = sprinklerLog
+        self.smartSprinkler = None
+        self.reloadEvent = None
+        self.stopping = False
+        self.metricsServer = None
+
+        self.load()
+
+    def load(self):
+        settings = loadSettings(self.settingsFile)
+        daemonSettings = settings['daemon'] if 'daemon' in settings else dict()
+        smartSprinkler = SmartSprinkler(settings, self.sprinklerLog)
+
+        # Replace running instance only once new config loaded successfully, then close interfaces of previous instance (report
+        # dispatchers are shared per queue file, so those reused by the new config are kept)
+        previous = self.smartSprinkler
+        self.smartSprinkler = smartSprinkler
+        if (previous):
+            config = smartSprinkler.config
+            previous.config.closeInterfaces(keep=[config.pws, config.sprinklerInterface, config.weatherPredict, config.reportInt])
+        self.interval = daemonSettings['interval'] if 'interval' in daemonSettings else 3600 # seconds between runs
+        self.leadTime = daemonSettings['leadTime'] if 'leadTime' in daemonSettings else 600 # seconds before desired run times to run
+        self.metricsPort = daemonSettings['metricsPort'] if 'metricsPort' in daemonSettings else None # local metrics endpoint (disabled if not set)
+        self.metricsAddress = daemonSettings['metricsAddress'] if 'metricsAddress' in daemonSettings else "127.0.0.1"
+
+    def reload(self):
+        print("SmartSprinklerDaemon - Reloading configuration from", self.settingsFile)
+        try:
+            self.load()
+        except ModuleException as err:
+            print("SmartSprinklerDaemon - Unable to reload configuration, keeping previous configuration:", err.message)
+        except Exception as err:
+            print("SmartSprinklerDaemon - Unable to reload configuration, keeping previous configuration:", str(err))
+
+    def nextRunTime(self, lastRun):
+        # Next interval run
+        now = datetime.datetime.now()
+        nextRun = max(lastRun + datetime.timedelta(seconds=self.interval), now)
+
+        # Runs shortly before desired run times of day today and tomorrow
+        midnight = datetime.datetime(now.year, now.month, now.day)
+        for runTimes in self.smartSprinkler.config.runTimeSchedule.resolve([midnight, midnight + datetime.timedelta(days=1)]):
+            for runTime in runTimes:
+                if (not runTime):
+                    continue
+                preRun = runTime - datetime.timedelta(seconds=self.leadTime)
+                if (lastRun < preRun and now <= preRun < nextRun):
+                    nextRun = preRun
+
+        return nextRun
+
+    def requestReload(self):
+        self.reloadEvent.set()
+
+    def requestStop(self):
+        self.stopping = True
+        self.reloadEvent.set()
+
+    async def run(self):
+        loop = asyncio.get_running_loop()
+        self.reloadEvent = asyncio.Event()
+        loop.add_signal_handler(signal.SIGHUP, self.requestReload)
+        loop.add_signal_handler(signal.SIGTERM, self.requestStop)
+        loop.add_signal_handler(signal.SIGINT, self.requestStop)
+
+        # Serve metrics (port changes take effect on restart)
+        if (self.metricsPort):
+            self.metricsServer = metrics.serveMetrics(self.metricsPort, self.metricsAddress)
+            print("SmartSprinklerDaemon - Serving metrics on {}:{}".format(self.metricsAddress, self.metricsPort))
+
+        lastRun = datetime.datetime.min
+        while (not self.stopping):
+            # Run sprinkler logic (blocking so run in worker thread)
+            if (self.smartSprinkler.config['enable'] == True):
+                await asyncio.to_thread(runLogic, self.smartSprinkler, False)
+            lastRun = datetime.datetime.now()
+
+            # Wait for next run time or reload request
+            while (not self.stopping):
+                nextRun = self.nextRunTime(lastRun)
+                delay = (nextRun - datetime.datetime.now()).total_seconds()
+                print("SmartSprinklerDaemon - Next run at", nextRun)
+                try:
+                    await asyncio.wait_for(self.reloadEvent.wait(), timeout=max(delay, 0))
+                except asyncio.TimeoutError: # time for next run
+                    break
+
+                self.reloadEvent.clear()
+                if (not self.stopping):
+                    await asyncio.to_thread(self.reload)
+
+        if (self.metricsServer):
+            self.metricsServer.shutdown()
+
+def runDaemon(settingsFile, sprinklerLog=[]):
+    from zoneBalance import loadNumpy
+    loadNumpy() # import cost is paid once, so zone calculations can use numpy arrays
+    daemon = SmartSprinklerDaemon(settingsFile, sprinklerLog)
+    asyncio.run(daemon.run())
@@ -1,30 +1,80 @@
 from smartSprinkler import SmartSprinkler
-import time 
-import yaml
+import time
 import sys
 from exceptions import ModuleException
+from configSnapshot import snapshotKey, readSnapshot, writeSnapshot
+import stageTimer
+import metrics
 
-def execute(settings=[], settingsFile=[], sprinklerLog=[]):
-    ### Load config
-    if (settingsFile):
-        with open(settingsFile) as f:
-            settings = yaml.load(f, Loader=yaml.Loader)
-    elif (not settings):    
-        print("SmartSprinklerExecute - No settings provided. Exiting.")
-        sys.exit()
+def parseSettings(stream):
+    import yaml # not imported when configuration is loaded from a snapshot
+    return yaml.load(stream, Loader=yaml.CLoader if hasattr(yaml, "CLoader") else yaml.Loader) # libyaml parser when available
+
+def loadSettings(settingsFile):
+    with open(settingsFile) as f:
+        return parseSettings(f)
+
+def loadSmartSprinkler(settingsFile, sprinklerLog=[], snapshotFile=None, onlyIfEnabled=False):
+    # Create SmartSprinkler from settings file, reusing compiled configuration snapshot while settings file is unchanged
+    # onlyIfEnabled- return None without creating interfaces if settings are not enabled
+    with stageTimer.span("loadSettings"):
+        with open(settingsFile, 'rb') as f:
+            settingsData = f.read()
+        key = snapshotKey(settingsData)
+        config = readSnapshot(snapshotFile, key) if snapshotFile else None
+        if (not config):
+            settings = parseSettings(settingsData)
+
+    if (onlyIfEnabled and (config if config else settings)['enable'] != True):
+        return None
+
+    with stageTimer.span("loadConfig"):
+        if (config): # only interfaces need to be created
+            config.loadInterfaces()
+            return SmartSprinkler(config, sprinklerLog)
 
-    try:     
         smartSprinkler = SmartSprinkler(settings, sprinklerLog)
-    except ModuleException as err:
-        errString = err.message + ": " + str(err.exception) + "\nTraceback: " + str(err.traceback)
-        print(errString)
-        sys.exit()
-    except Exception as err:
-        print("Exception while creating SmartSprinkler instance:", str(err))
-        sys.exit()
+        if (snapshotFile):
+            writeSnapshot(snapshotFile, key, smartSprinkler.config)
+
+    return smartSprinkler
 
+def execute(settings=[], settingsFile=[], sprinklerLog=[], snapshotFile=None, onlyIfEnabled=False):
+    with stageTimer.collect(): # timings for this run
+        ### Load config
+        if (not settings and not settingsFile):
+            print("SmartSprinklerExecute - No settings provided. Exiting.")
+            sys.exit()
+
+        try:
+            if (settingsFile):
+                smartSprinkler = loadSmartSprinkler(settingsFile, sprinklerLog, snapshotFile, onlyIfEnabled)
+            elif (onlyIfEnabled and settings['enable'] != True):
+                smartSprinkler = None
+            else:
+                with stageTimer.span("loadConfig"):
+                    smartSprinkler = SmartSprinkler(settings, sprinklerLog)
+        except ModuleException as err:
+            errString = err.message + ": " + str(err.exception) + "\nTraceback: " + str(err.traceback)
+            print(errString)
+            sys.exit()
+        except Exception as err:
+            print("Exception while creating SmartSprinkler instance:", str(err))
+            sys.exit()
+
+        if (not smartSprinkler): # not enabled
+            return
+
+        runLogic(smartSprinkler)
+
+def runLogic(smartSprinkler, oneShot=True):
+    ### Run sprinkler logic and report any errors (returns error description or None)
+    ### oneShot- process does not keep running between runs (metrics in metricsFile are carried over in a state file)
+    errString = None
+    startTime = time.perf_counter()
     try:
-        smartSprinkler.runSprinklerLogic()
+        with stageTimer.collect(), stageTimer.span("runSprinklerLogic"):
+            smartSprinkler.runSprinklerLogic()
     except ModuleException as err:
         # Report error
         errString = err.message + ": " + str(err.exception) + "\nTraceback: " + str(err.traceback)
@@ -34,9 +84,28 @@ def execute(settings=[], settingsFile=[], sprinklerLog=[]):
     except Exception as err:
         import traceback
         tb = traceback.format_exc()
-        
+
         errString = "An unexpected error of type " + type(err).__name__ + " occurred: " + str(err) + "\nTraceback: " + str(tb)
         print(errString)
 
         if (smartSprinkler.config['reportEnable'] > 0 and smartSprinkler.config.reportInt):
             smartSprinkler.config.reportInt.post({'name': "smartSprinkler_error", 'data': [errString]})
+
+    recordRunMetrics(smartSprinkler, time.perf_counter() - startTime, errString, oneShot)
+
+    return errString
+
+def recordRunMetrics(smartSprinkler, duration, errString, oneShot=True):
+    ### Record run metrics and write textfile collector file if configured
+    ### Counters and histograms restart at zero in every one-shot (cron) process, so their totals are kept in a state file
+    ### alongside metricsFile; a long-running process (daemon) holds them in memory.
+    site = smartSprinkler.config.siteName
+    metrics.runDuration.observe(duration, site=site)
+    metrics.runs.inc(site=site, result="error" if errString else "ok")
+
+    if ('metricsFile' in smartSprinkler.config):
+        try:
+            metricsFile = smartSprinkler.config['metricsFile']
+            metrics.registry.writeTextfile(metricsFile, metricsFile + ".state" if oneShot else None)
+        except OSError as err:
+            print("SmartSprinklerExecute - Unable to write metrics file:", str(err))
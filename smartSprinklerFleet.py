@@ -0,0 +1,197 @@
+import argparse
+import concurrent.futures
+import contextlib
+import datetime
+import glob
+import json
+import math
+import os
+import time
+from smartSprinkler import SmartSprinkler, calculateWeekTimes
+from smartSprinklerExecute import loadSettings, runLogic
+from exceptions import ModuleException, BasicException
+from backendRegistry import supports
+import httpTransport
+
+TIMEOUT_GRACE = 5.0 # time allowed past a site's timeout for its worker to give up and report (seconds)
+
+def findConfigs(paths):
+    # Expand directories into the YAML configuration files they contain
+    configs = []
+    for path in paths:
+        if (os.path.isdir(path)):
+            configs += sorted(glob.glob(os.path.join(path, "*.yaml")) + glob.glob(os.path.join(path, "*.yml")))
+        else:
+            configs.append(path)
+
+    return configs
+
+def errorString(err):
+    if (isinstance(err, ModuleException)):
+        return err.message + ": " + str(err.exception)
+    if (isinstance(err, BasicException)):
+        return err.message
+
+    return type(err).__name__ + ": " + str(err)
+
+def loadSite(settingsFile, sprinklerLog=[], fleetHttp=None):
+    # Create SmartSprinkler instance for site (returns None if site disabled)
+    # fleetHttp- http settings of sites already loaded in this process, if any ([settings] or empty list); the HTTP transport is
+    # process-wide, so a site with different http settings would change them for every other site and is rejected
+    settings = loadSettings(settingsFile)
+    if (settings['enable'] != True):
+        return None
+
+    if (fleetHttp is not None):
+        siteHttp = settings['http'] if 'http' in settings else dict()
+        if (not fleetHttp):
+            fleetHttp.append(siteHttp)
+        elif (siteHttp != fleetHttp[0]):
+            raise BasicException("SmartSprinklerFleet - http settings differ from other sites run in this process (use --processes for per-site http settings).")
+
+    return SmartSprinkler(settings, sprinklerLog)
+
+def runSite(settingsFile, smartSprinkler=None, sprinklerLog=[], timeout=None):
+    # Run a single site, isolating any errors
+    # HTTP requests made by the site fail once timeout seconds have passed, so a hung host does not hold the worker.  The
+    # timeout only bounds HTTP; other blocking work (e.g. a locked SQLite database) is not interrupted.
+    summary = {'config': settingsFile, 'status': 'ok', 'error': None, 'duration': 0.0}
+    startTime = time.time()
+    try:
+        with httpTransport.deadline(timeout) if timeout else contextlib.nullcontext():
+            if (not smartSprinkler):
+                smartSprinkler = loadSite(settingsFile, sprinklerLog)
+
+            if (not smartSprinkler):
+                summary['status'] = 'disabled'
+            else:
+                errString = runLogic(smartSprinkler)
+                if (errString):
+                    summary['status'] = 'error'
+                    summary['error'] = errString
+    except Exception as err:
+        summary['status'] = 'error'
+        summary['error'] = errorString(err)
+
+    summary['duration'] = time.time() - startTime
+    if (summary['status'] == 'error' and timeout and summary['duration'] >= timeout):
+        summary['status'] = 'timeout'
+
+    return summary
+
+def prefetchForecasts(sites):
+    # Request forecasts for all sites sharing a forecast interface type together so batch-capable interfaces make one request
+    currentTime = datetime.datetime.now()
+    _, _, endOfCurWeek = calculateWeekTimes(currentTime)
+
+    groups = dict()
+    for smartSprinkler in sites.values():
+        weatherPredict = smartSprinkler.config.weatherPredict
+        if (weatherPredict and supports(weatherPredict, "batch")): # other interfaces fetch one location per request anyway
+            group = groups.setdefault(type(weatherPredict), [weatherPredict, set()])
+            group[1].add(smartSprinkler.config['location']['zipcode'])
+
+    for weatherPredict, locations in groups.values():
+        try:
+            weatherPredict.getPrecipProbBatch(currentTime, endOfCurWeek, sorted(locations))
+        except Exception as err: # sites will retry on their own
+            print("SmartSprinklerFleet - Unable to prefetch forecasts:", errorString(err))
+
+def runFleet(configs, maxWorkers=4, timeout=300, useProcesses=False, sprinklerLog=[]):
+# Run many SmartSprinkler configurations concurrently
+# Inputs:
+# configs- list of configuration files
+# maxWorkers- maximum number of sites run at once
+# timeout- maximum run time per site (seconds); enforced on HTTP requests, and sites still running after it are reported as
+#          timed out, but a site blocked in other work keeps its worker (and delays process exit) until it returns
+# useProcesses- run sites in separate processes instead of threads
+#
+# Outputs:
+# summaries- list of per-site summaries (config, status, error, duration) in config order
+    summaries = dict()
+    sites = dict()
+
+    if (not useProcesses):
+        # Load sites up front so forecasts can be fetched for all sites together
+        fleetHttp = []
+        for settingsFile in configs:
+            try:
+                sites[settingsFile] = loadSite(settingsFile, sprinklerLog, fleetHttp)
+            except Exception as err:
+                summaries[settingsFile] = {'config': settingsFile, 'status': 'error', 'error': errorString(err), 'duration': 0.0}
+        with httpTransport.deadline(timeout):
+            prefetchForecasts({settingsFile: site for settingsFile, site in sites.items() if site})
+
+    if (useProcesses):
+        executor = concurrent.futures.ProcessPoolExecutor(max_workers=maxWorkers)
+    else:
+        executor = concurrent.futures.ThreadPoolExecutor(max_workers=maxWorkers)
+
+    # Site start times (recorded when workers are seen running so queued sites are not timed)
+    started = dict()
+
+    futures = dict()
+    for settingsFile in configs:
+        if (settingsFile in summaries):
+            continue
+        if (not useProcesses and not sites[settingsFile]): # enable already checked when site was loaded
+            summaries[settingsFile] = {'config': settingsFile, 'status': 'disabled', 'error': None, 'duration': 0.0}
+            continue
+        if (useProcesses):
+            future = executor.submit(runSite, settingsFile, None, sprinklerLog, timeout)
+        else:
+            future = executor.submit(runSite, settingsFile, sites[settingsFile], sprinklerLog, timeout)
+        futures[future] = settingsFile
+
+    # Overall deadline (every site given its timeout in turn) so sites still queued behind hung workers are not waited on forever
+    fleetDeadline = time.time() + math.ceil(len(futures)/maxWorkers)*timeout + TIMEOUT_GRACE
+
+    pending = set(futures)
+    while (pending):
+        done, pending = concurrent.futures.wait(pending, timeout=0.5, return_when=concurrent.futures.FIRST_COMPLETED)
+        for future in done:
+            try:
+                summaries[futures[future]] = future.result()
+            except Exception as err: # worker process failure
+                summaries[futures[future]] = {'config': futures[future], 'status': 'error', 'error': errorString(err), 'duration': 0.0}
+
+        # Sites are stopped by their own deadline; stop waiting for any that have not reported shortly after it
+        now = time.time()
+        for future in list(pending):
+            if (future.running()):
+                started.setdefault(future, now)
+                if (now - started[future] > timeout + TIMEOUT_GRACE or now > fleetDeadline):
+                    pending.discard(future)
+                    summaries[futures[future]] = {'config': futures[future], 'status': 'timeout', 'error': "Site did not finish within {} seconds.".format(timeout), 'duration': now - started[future]}
+            elif (now > fleetDeadline and future.cancel()): # still queued
+                pending.discard(future)
+                summaries[futures[future]] = {'config': futures[future], 'status': 'timeout', 'error': "Site was not started before the fleet deadline.", 'duration': 0.0}
+
+    executor.shutdown(wait=False, cancel_futures=True)
+
+    return [summaries[settingsFile] for settingsFile in configs]
+
+def summarize(summaries):
+    counts = dict()
+    for summary in summaries:
+        counts[summary['status']] = counts.get(summary['status'], 0) + 1
+
+    return {'timestamp': time.strftime("%H:%M:%S %m-%d-%Y"), 'counts': counts, 'sites': summaries}
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Run SmartSprinkler logic for many sites.")
+    parser.add_argument("configs", nargs="+", help="configuration files or directories of configuration files")
+    parser.add_argument("--workers", type=int, default=4, help="maximum number of sites run at once")
+    parser.add_argument("--timeout", type=float, default=300, help="maximum run time per site (seconds, enforced on HTTP requests)")
+    parser.add_argument("--processes", action="store_true", help="run sites in separate processes")
+    parser.add_argument("--summary", help="file to write JSON summary to")
+    args = parser.parse_args()
+
+    summary = summarize(runFleet(findConfigs(args.configs), args.workers, args.timeout, args.processes))
+    for site in summary['sites']:
+        print("{:<10} {:>8.2f}s  {}{}".format(site['status'], site['duration'], site['config'], "  - " + site['error'].splitlines()[0] if site['error'] else ""))
+    print("Totals:", summary['counts'])
+
+    if (args.summary):
+        with open(args.summary, "w") as f:
+            json.dump(summary, f)
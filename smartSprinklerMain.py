@@ -1,9 +1,27 @@
-import yaml
+import argparse
 from smartSprinklerExecute import execute
+from configSnapshot import defaultSnapshotFile
 
-with open("smartSprinkler.yaml") as f:
-    config = yaml.load(f, Loader=yaml.Loader)
+parser = argparse.ArgumentParser(description="Run SmartSprinkler logic.")
+parser.add_argument("--config", default="smartSprinkler.yaml", help="configuration file")
+parser.add_argument("--daemon", action="store_true", help="run as a long-running service instead of a single run")
+parser.add_argument("--noSnapshot", action="store_true", help="always parse configuration file instead of reusing compiled configuration snapshot")
+parser.add_argument("--profile", metavar="FILE", help="write cProfile statistics to FILE (viewable with pstats, snakeviz or flameprof)")
+args = parser.parse_args()
 
-# Execute SmartSprinkler logic
-if (config['enable'] == True): 	
-    execute(settings=config)
+if (args.profile):
+    import cProfile
+    profiler = cProfile.Profile()
+    profiler.enable()
+
+try:
+    if (args.daemon):
+        from smartSprinklerDaemon import runDaemon
+        runDaemon(args.config)
+    else:
+        # Execute SmartSprinkler logic (if enabled)
+        execute(settingsFile=args.config, snapshotFile=None if args.noSnapshot else defaultSnapshotFile(args.config), onlyIfEnabled=True)
+finally:
+    if (args.profile):
+        profiler.disable()
+        profiler.dump_stats(args.profile)
@@ -1,14 +1,36 @@
+import asyncio
 import time
 
 class SprinklerInterface:
+    capabilities = frozenset() # fast paths supported (see backendRegistry)
+
     def __init__(self, path, numZones, log):
         self.path = path
         self.numZones = numZones
         self.log = log
 
+    @classmethod
+    def fromConfig(cls, settings, config):
+        # Create from configuration section (settings other than type are passed as keyword arguments)
+        return cls(**{key: value for key, value in settings.items() if key != "type"})
+
     def getSprinklerTotals(zones, startTime, endTime):
         pass
+
+    def getSprinklerLog(self, zones, startTime, endTime):
+    # Retrieves sprinkler run log entries between start and end times
+    # Outputs:
+    # runLog- list of [zone, duration (seconds), end epoch time] entries
+        return []
+
+    async def getSprinklerLogAsync(self, zones, startTime, endTime):
+        # Awaitable getSprinklerLog (blocking request runs in worker thread)
+        return await asyncio.to_thread(self.getSprinklerLog, zones, startTime, endTime)
     
+    def loadPrograms(self):
+        # Read current controller programs (used to skip unchanged program updates)
+        pass
+
     def updateProgram(self, zoneNum, durationSec, runTimeEpoch):
         pass
 
@@ -0,0 +1,110 @@
+import contextlib
+import contextvars
+import functools
+import threading
+import time
+from urllib.parse import urlsplit
+
+class Timings(object):
+# Wall time, call counts and bytes received per stage, and time, requests and bytes per external host, for one run
+# Stages and requests recorded from worker threads (e.g. asyncio.to_thread, which copies the context) go to the same run.
+# Bytes are counted in every stage active when they are received (stages nest, like their times).
+
+    def __init__(self):
+        self.start = time.perf_counter()
+        self.stages = dict() # stage -> [seconds, calls, bytes]
+        self.hosts = dict() # host -> [seconds, requests, bytes]
+        self.lock = threading.Lock()
+
+    def addStage(self, stage, seconds):
+        with self.lock:
+            entry = self.stages.setdefault(stage, [0.0, 0, 0])
+            entry[0] += seconds
+            entry[1] += 1
+
+    def addRequest(self, host, seconds, numBytes, stages=()):
+        with self.lock:
+            entry = self.hosts.setdefault(host, [0.0, 0, 0])
+            entry[0] += seconds
+            entry[1] += 1
+            entry[2] += numBytes
+            for stage in stages:
+                self.stages.setdefault(stage, [0.0, 0, 0])[2] += numBytes
+
+    def addBytes(self, host, numBytes, stages=()):
+        with self.lock:
+            self.hosts.setdefault(host, [0.0, 0, 0])[2] += numBytes
+            for stage in stages:
+                self.stages.setdefault(stage, [0.0, 0, 0])[2] += numBytes
+
+    def summary(self):
+        # Timings for log entries (seconds rounded to milliseconds)
+        with self.lock:
+            return {'total': round(time.perf_counter() - self.start, 3),
+                    'stages': {stage: {'time': round(seconds, 3), 'calls': calls, 'bytes': numBytes} for stage, (seconds, calls, numBytes) in self.stages.items()},
+                    'hosts': {host: {'time': round(seconds, 3), 'requests': requests, 'bytes': numBytes} for host, (seconds, requests, numBytes) in self.hosts.items()}}
+
+currentTimings = contextvars.ContextVar('currentTimings', default=None)
+activeStages = contextvars.ContextVar('activeStages', default=()) # stages of the run in progress entered and not yet left
+
+def current():
+    # Timings of run in progress (None if not collecting)
+    return currentTimings.get()
+
+@contextlib.contextmanager
+def collect():
+    # Collect timings for a run (nested collections share the outer run's timings)
+    timings = currentTimings.get()
+    if (timings is not None):
+        yield timings
+        return
+
+    timings = Timings()
+    token = currentTimings.set(timings)
+    try:
+        yield timings
+    finally:
+        currentTimings.reset(token)
+
+@contextlib.contextmanager
+def span(stage):
+    # Time a stage of the run in progress
+    timings = currentTimings.get()
+    if (timings is None):
+        yield
+        return
+
+    start = time.perf_counter()
+    token = activeStages.set(activeStages.get() + (stage,))
+    try:
+        yield
+    finally:
+        activeStages.reset(token)
+        timings.addStage(stage, time.perf_counter() - start)
+
+def timed(stage):
+    # Decorator timing every call of a function as stage
+    def decorator(func):
+        @functools.wraps(func)
+        def wrapper(*args, **kwargs):
+            with span(stage):
+                return func(*args, **kwargs)
+        return wrapper
+    return decorator
+
+def hostName(url):
+    return urlsplit(url).netloc
+
+def recordRequest(url, seconds, numBytes):
+    timings = currentTimings.get()
+    if (timings is not None):
+        timings.addRequest(hostName(url), seconds, numBytes, set(activeStages.get()))
+
+def meteredChunks(url, chunks):
+    # Pass through streamed response chunks, counting bytes received from host (and in stages active when request was made)
+    timings = currentTimings.get()
+    stages = set(activeStages.get())
+    for chunk in chunks:
+        if (timings is not None):
+            timings.addBytes(hostName(url), len(chunk), stages)
+        yield chunk
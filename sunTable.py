@@ -0,0 +1,96 @@
+import datetime
+import mmap
+import os
+import re
+import struct
+import tempfile
+import threading
+import stageTimer
+
+ENTRY = struct.Struct('<ii') # sunrise, sunset (seconds after local midnight)
+DAYS_PER_TABLE = 366
+
+class SunTable(object):
+# Sunrise and sunset times for every day of a year at one location
+# The table is computed once per location and year and, when a cache directory is given, persisted to disk and memory-mapped
+# so later processes read it without solving the sun equations.  Missing values (e.g. polar day or night) are stored as -1.
+
+    def __init__(self, location, year, cacheDir=None):
+        self.location = location
+        self.year = year
+        self.data = None
+
+        if (cacheDir):
+            path = os.path.join(cacheDir, self.fileName())
+            try:
+                size = os.path.getsize(path)
+            except OSError:
+                size = None
+            if (size != ENTRY.size * DAYS_PER_TABLE): # missing, or truncated (e.g. by a crash while writing), so recompute
+                self.data = self.compute()
+                try:
+                    self.write(path, self.data)
+                except OSError as e: # table file is an optimization so keep computed table in memory
+                    print("SunTable - Unable to write table file {}: {}".format(path, e))
+                return
+            with open(path, 'rb') as f:
+                self.data = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+        else:
+            self.data = self.compute()
+
+    def fileName(self):
+        name = "sunTable_{:.4f}_{:.4f}_{}_{}.bin".format(self.location['lat'], self.location['lon'], self.location['timezone'], self.year)
+        return re.sub(r'[^A-Za-z0-9_.+-]', '_', name)
+
+    @stageTimer.timed("sunTable.compute")
+    def compute(self):
+        from astral import LocationInfo # only needed when table is not cached
+        import astral.sun
+        loc = LocationInfo('name', 'region', self.location['timezone'], self.location['lat'], self.location['lon'])
+        data = bytearray(ENTRY.size * DAYS_PER_TABLE)
+        firstDay = datetime.date(self.year, 1, 1)
+        for dayOfYear in range(DAYS_PER_TABLE):
+            day = firstDay + datetime.timedelta(days=dayOfYear)
+            try:
+                sun = astral.sun.sun(loc.observer, date=day, tzinfo=loc.tzinfo)
+                midnight = datetime.datetime(day.year, day.month, day.day)
+                sunrise = int((sun['sunrise'].replace(tzinfo=None) - midnight).total_seconds())
+                sunset = int((sun['sunset'].replace(tzinfo=None) - midnight).total_seconds())
+            except ValueError: # sun does not rise or set on this day
+                sunrise, sunset = -1, -1
+            ENTRY.pack_into(data, dayOfYear * ENTRY.size, sunrise, sunset)
+
+        return bytes(data)
+
+    def write(self, path, data):
+        # Write table atomically so concurrent readers never map a partial file
+        fd, tmpPath = tempfile.mkstemp(prefix=os.path.basename(path) + ".", suffix=".tmp", dir=os.path.dirname(os.path.abspath(path)))
+        try:
+            with os.fdopen(fd, 'wb') as f:
+                f.write(data)
+            os.replace(tmpPath, path)
+        except OSError:
+            try:
+                os.remove(tmpPath)
+            except OSError:
+                pass
+            raise
+
+    def lookup(self, day):
+        # Sunrise and sunset for day (seconds after midnight)
+        return ENTRY.unpack_from(self.data, (day.timetuple().tm_yday - 1) * ENTRY.size)
+
+tables = dict()
+tablesLock = threading.Lock()
+
+def getSunTable(location, year, cacheDir=None):
+    key = (location['lat'], location['lon'], location['timezone'], year)
+    with tablesLock:
+        if (key not in tables):
+            tables[key] = SunTable(location, year, cacheDir)
+
+        return tables[key]
+
+def lookupSunRiseAndSet(location, day, cacheDir=None):
+    # Sunrise and sunset for location and day (seconds after midnight)
+    return getSunTable(location, day.year, cacheDir).lookup(day)
@@ -0,0 +1,136 @@
+import datetime
+from bisect import bisect_left, bisect_right
+
+class DailyPrefixSeries(object):
+# Per-day, per-channel prefix sums over a fixed window of days
+# Entries are (epoch, channel, amount) tuples.  Totals over whole days are answered from the prefix sums and only the
+# (at most two) partial edge days of a query window are scanned, so the cost of a query does not depend on window length.
+
+    def __init__(self, numChannels, startTime, endTime):
+        self.numChannels = numChannels
+        self.baseOrdinal = startTime.date().toordinal()
+        self.numDays = endTime.date().toordinal() - self.baseOrdinal + 1
+
+        # Entries bucketed by day
+        self.dayEntries = [[] for _ in range(self.numDays)]
+
+        self.prefixTotal = None
+        self.prefixLatest = None
+        self.dayTimes = None
+
+    def dayIndex(self, epoch):
+        return datetime.date.fromtimestamp(epoch).toordinal() - self.baseOrdinal
+
+    def add(self, epoch, channel, amount, markLatest=True):
+        day = self.dayIndex(epoch)
+        if (day < 0 or day >= self.numDays): # outside of window
+            return
+
+        self.dayEntries[day].append((epoch, channel, amount, markLatest))
+
+    def build(self):
+        # Sort entries within each day and compute prefix totals and running latest times
+        self.prefixTotal = [[0] * self.numChannels]
+        self.prefixLatest = []
+        self.dayTimes = []
+        total = [0] * self.numChannels
+        latest = [0] * self.numChannels
+        for entries in self.dayEntries:
+            entries.sort(key=lambda entry: entry[0])
+            for epoch, channel, amount, markLatest in entries:
+                total[channel] += amount
+                if (markLatest and epoch > latest[channel]):
+                    latest[channel] = epoch
+            self.prefixTotal.append(list(total))
+            self.prefixLatest.append(list(latest))
+            self.dayTimes.append([entry[0] for entry in entries])
+
+    def query(self, startTime, endTime):
+    # Totals and latest entry times per channel between start and end times (inclusive)
+        totals = [0] * self.numChannels
+        latest = [0] * self.numChannels
+
+        startEpoch = datetime.datetime.timestamp(startTime)
+        endEpoch = datetime.datetime.timestamp(endTime)
+        startDay = max(startTime.date().toordinal() - self.baseOrdinal, 0)
+        endDay = min(endTime.date().toordinal() - self.baseOrdinal, self.numDays - 1)
+        if (startDay > endDay or endEpoch < startEpoch):
+            return totals, latest
+
+        # Partial first day
+        times = self.dayTimes[startDay]
+        first = bisect_left(times, startEpoch)
+        last = bisect_right(times, endEpoch) if startDay == endDay else len(times)
+        for epoch, channel, amount, markLatest in self.dayEntries[startDay][first:last]:
+            totals[channel] += amount
+
+        if (endDay > startDay):
+            # Whole days in between
+            fullTotal = [a - b for a, b in zip(self.prefixTotal[endDay], self.prefixTotal[startDay + 1])]
+            totals = [a + b for a, b in zip(totals, fullTotal)]
+
+            # Partial last day
+            times = self.dayTimes[endDay]
+            last = bisect_right(times, endEpoch)
+            for epoch, channel, amount, markLatest in self.dayEntries[endDay][:last]:
+                totals[channel] += amount
+
+        # Latest entry at or before end time
+        if (endDay > 0):
+            latest = list(self.prefixLatest[endDay - 1])
+        times = self.dayTimes[endDay]
+        for epoch, channel, amount, markLatest in self.dayEntries[endDay][:bisect_right(times, endEpoch)]:
+            if (markLatest and epoch > latest[channel]):
+                latest[channel] = epoch
+
+        # Discard latest times that fall before the start of the query window
+        latest = [epoch if epoch >= startEpoch else 0 for epoch in latest]
+
+        return totals, latest
+
+class WaterHistory(object):
+# Per-run store of rainfall and sprinkler history
+# History for the widest window needed by a run is fetched once and all later window queries are answered in memory.
+
+    def __init__(self, zones, minRainAmount, startTime, endTime, rainRows, sprinklerLog):
+    # Inputs:
+    # zones- list of zone numbers
+    # minRainAmount- minimum daily rainfall to count as a "rain day"
+    # startTime- start of history window
+    # endTime- end of history window
+    # rainRows- list of [epoch of day, rainfall] entries
+    # sprinklerLog- list of [zone, duration (seconds), end epoch] run entries
+        self.zones = zones
+        self.zoneIndex = {zone: idx for idx, zone in enumerate(zones)}
+        self.startTime = startTime
+        self.endTime = endTime
+
+        # Rainfall
+        self.rain = DailyPrefixSeries(1, startTime, endTime)
+        for epoch, rainfall in rainRows:
+            if (rainfall > 0):
+                self.rain.add(epoch, 0, rainfall, rainfall > minRainAmount)
+        self.rain.build()
+
+        # Sprinkler runs
+        self.sprinkler = DailyPrefixSeries(len(zones), startTime, endTime)
+        for zone, duration, endEpoch in sprinklerLog:
+            if (zone in self.zoneIndex):
+                self.sprinkler.add(endEpoch, self.zoneIndex[zone], duration)
+        self.sprinkler.build()
+
+    def covers(self, startTime, endTime):
+        return startTime >= self.startTime and endTime <= self.endTime
+
+    def getRainfall(self, startTime, endTime):
+        totals, latest = self.rain.query(startTime, endTime)
+        return totals[0], latest[0]
+
+    def getSprinklerTotals(self, startTime, endTime):
+        totals, latest = self.sprinkler.query(startTime, endTime)
+
+        runTimes = dict()
+        for idx, zone in enumerate(self.zones):
+            runTimes.update({zone: {'totalRunTime': totals[idx], 'lastRunTime': latest[idx]}})
+
+        return runTimes
@@ -1,7 +1,28 @@
 
+import asyncio
+
 class WeatherPredict:
+    capabilities = frozenset() # fast paths supported (see backendRegistry)
+
     def __init__(self, path):
         self.path = path
 
+    @classmethod
+    def fromConfig(cls, settings, config):
+        # Create from configuration section (settings other than type are passed as keyword arguments)
+        return cls(**{key: value for key, value in settings.items() if key != "type"})
+
     def getPrecipProb(self, startTime, endTime, location):
         return []
+
+    def getPrecipProbBatch(self, startTime, endTime, locations):
+        # Precipitation probability for several locations (dictionary of location to precipitation probability)
+        return {location: self.getPrecipProb(startTime, endTime, location) for location in locations}
+
+    def staleForecastError(self, location):
+        # Error behind an out of date (e.g. cached) forecast served for location by last request, or None if forecast was current
+        return None
+
+    async def getPrecipProbAsync(self, startTime, endTime, location):
+        # Awaitable getPrecipProb (blocking request runs in worker thread)
+        return await asyncio.to_thread(self.getPrecipProb, startTime, endTime, location)
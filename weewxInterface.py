@@ -1,41 +1,103 @@
 from pwsInterface import PWSInterface
 from exceptions import ModuleException
+from rainRollup import RainRollup
+import stageTimer
 from datetime import datetime
+import hashlib
+import os
 import sqlite3 # sqlite3 module
+import threading
+
+# Rainfall queries (kept constant so sqlite3 reuses the prepared statements)
+RAIN_TOTAL_QUERY = 'SELECT TOTAL(CASE WHEN sum > 0 THEN sum END), MAX(CASE WHEN sum > 0 AND sum > ? THEN dateTime END) FROM archive_day_rain WHERE dateTime BETWEEN ? AND ?'
+DAILY_RAIN_QUERY = 'SELECT dateTime, sum FROM archive_day_rain WHERE dateTime BETWEEN ? AND ? AND sum IS NOT NULL ORDER BY dateTime'
+NEW_RAIN_QUERY = 'SELECT dateTime, sum FROM archive_day_rain WHERE dateTime > ? ORDER BY dateTime'
 
 class WeeWXInterface(PWSInterface):
-    
-    def getRainfall(self, startTime, endTime, minRainAmount):
-        rainfall = 0.0
-        lastDayOfRain = 0
+    capabilities = frozenset(["cached"]) # daily rainfall rollup
+
+    def __init__(self, path, rollup=True, rollupFile=None):
+        super().__init__(path)
+
+        self.conn = None
+        self.lock = threading.Lock() # connection is shared between threads
+
+        # Incremental daily rainfall rollup
+        self.rollup = RainRollup.forFile(rollupFile) if rollup else None
+
+    @classmethod
+    def fromConfig(cls, settings, config):
+        rollup = settings["rainRollup"] if "rainRollup" in settings else True
+        rollupFile = settings["rainRollupFile"] if "rainRollupFile" in settings else None
+        if (rollup and not rollupFile and "cacheDir" in config): # default rollup location (one per database)
+            rollupFile = os.path.join(config["cacheDir"], "rainRollup_" + hashlib.md5(os.path.abspath(settings["weatherDbFile"]).encode('utf-8')).hexdigest()[:12] + ".bin")
+        return cls(settings["weatherDbFile"], rollup, rollupFile)
+
+    def connect(self):
+        # Open read-only connection to stats database (held for the lifetime of the interface)
+        if (not self.conn):
+            from urllib.request import pathname2url # slow to import and only needed once
+            uri = "file:" + pathname2url(os.path.abspath(self.path)) + "?mode=ro"
+            self.conn = sqlite3.connect(uri, uri=True, timeout=1.0, check_same_thread=False)
+
+        return self.conn
+
+    def close(self):
+        with self.lock:
+            if (self.conn):
+                self.conn.close()
+                self.conn = None
+
+    @stageTimer.timed("weewx.query")
+    def query(self, sql, params):
+        with self.lock:
+            try:
+                return self.connect().execute(sql, params).fetchall()
+            except sqlite3.Error:
+                # Connection may have gone stale (e.g. database replaced) so reopen once
+                if (self.conn):
+                    self.conn.close()
+                    self.conn = None
+                return self.connect().execute(sql, params).fetchall()
+
+    def updateRollup(self):
+        # Read rows added or changed since last closed day
+        self.rollup.update(lambda after: [list(row) for row in self.query(NEW_RAIN_QUERY, (after,))])
 
+    def getRainfall(self, startTime, endTime, minRainAmount):
         try:
-            # Open connection to stats database
-            conn = sqlite3.connect(self.path) 
+            if (self.rollup):
+                self.updateRollup()
+                return self.rollup.getRainfall(startTime, endTime, minRainAmount)
+
+            # Total rainfall and last day with rain greater than minimum rain amount ("rain day")
+            rainfall, lastDayOfRain = self.query(RAIN_TOTAL_QUERY, (minRainAmount, datetime.timestamp(startTime), datetime.timestamp(endTime)))[0]
 
-            c = conn.cursor() # cursor to operate on database
+        except Exception as e:
+            # Get traceback
+            import traceback
+            tb = traceback.format_exc()
 
-            # Get rainfall table from database
-            c.execute('SELECT * FROM archive_day_rain WHERE dateTime BETWEEN ? AND ?', (datetime.timestamp(startTime), datetime.timestamp(endTime)))
+            message = "WeeWXInterface - An error occurred of type " + type(e).__name__
+            raise ModuleException(message, e, tb)
 
-            rainTable = c.fetchall()
+        return rainfall, lastDayOfRain or 0
 
-            # Compute total rainfall between start and end times
-            for i in range(len(rainTable)):
-                if rainTable[i][5] > 0:
-                    rainfall += rainTable[i][5]
-                    if rainTable[i][5] > minRainAmount: # minimum rain amount to count as "rain day"
-                        lastDayOfRain = rainTable[i][0]
+    def getDailyRainfall(self, startTime, endTime):
+        try:
+            if (self.rollup):
+                self.updateRollup()
+                return self.rollup.getDailyRainfall(startTime, endTime)
 
-            conn.close()
+            # Get daily rainfall totals from database
+            rainRows = [list(row) for row in self.query(DAILY_RAIN_QUERY, (datetime.timestamp(startTime), datetime.timestamp(endTime)))]
 
         except Exception as e:
             # Get traceback
             import traceback
             tb = traceback.format_exc()
-            
+
             message = "WeeWXInterface - An error occurred of type " + type(e).__name__
             raise ModuleException(message, e, tb)
-        
-        return rainfall, lastDayOfRain
 
+        return rainRows
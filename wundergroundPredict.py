@@ -1,9 +1,13 @@
 from weatherPredict import WeatherPredict
-import requests
+from httpTransport import getTransport
 
 class WundergroundPredict(WeatherPredict):
 # DEPRECATED: Weather Underground API has been deprecated due to purchase of Wunderground by IBM. 
 
+    @classmethod
+    def fromConfig(cls, settings, config):
+        return cls(settings["url"])
+
     def getPrecipProb(self, startTime, endTime, location):
     # Get precipitation probability for desired period
     # Inputs:
@@ -16,7 +20,7 @@ class WundergroundPredict(WeatherPredict):
 
         try:
             #f = request.urlopen(self.path + str(location) + '.json')
-            f = requests.get(self.path + str(location) + '.json')
+            f = getTransport().get(self.path + str(location) + '.json')
         except: # failed to get weather forecast
             return [] 
 
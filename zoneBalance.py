@@ -0,0 +1,134 @@
+import math
+import sys
+
+NUMPY_MIN_ZONES = 16 # below this, list operations are faster than numpy call overhead
+
+def loadNumpy(importIfNeeded=True):
+    # numpy module, or None if not installed
+    # numpy is slow to import, so single runs only use it if it is already loaded (importIfNeeded False).  Long-running and
+    # bulk callers (daemon, backtests) load it up front.
+    if (not importIfNeeded and "numpy" not in sys.modules):
+        return None
+    try:
+        import numpy
+    except ImportError: # numpy is optional, fall back to lists
+        return None
+    return numpy
+
+class ZoneBalance(object):
+# Per-zone water balance computed over all zones at once
+# Zone settings are held as parallel arrays (numpy arrays when numpy is available, otherwise lists).  Per-zone inputs are
+# sequences in zone order; with numpy they may also be 2-D (weeks x zones) to evaluate many weeks in one call.
+# Outputs are lists (JSON serializable).
+
+    def __init__(self, zoneWateringRate, weeklyWaterReq, minWateringLength, maxWateringLength, useNumpy=None):
+    # Inputs:
+    # zoneWateringRate- watering rate per zone (inches per minute)
+    # weeklyWaterReq- weekly water requirement per zone (inches)
+    # minWateringLength, maxWateringLength- bounds of a single run per zone (seconds)
+    # useNumpy- use numpy arrays when numpy is installed (None to use numpy if already loaded and there are enough zones)
+        self.numZones = len(zoneWateringRate)
+        if (useNumpy is None):
+            self.np = loadNumpy(importIfNeeded=False) if self.numZones >= NUMPY_MIN_ZONES else None
+        else:
+            self.np = loadNumpy() if useNumpy else None
+        if (self.np):
+            self.wateringRate = self.np.array(zoneWateringRate, dtype=float)
+            self.weeklyWaterReq = self.np.array(weeklyWaterReq, dtype=float)
+            self.minWateringLength = self.np.array(minWateringLength, dtype=float)
+            self.maxWateringLength = self.np.array(maxWateringLength, dtype=float)
+        else:
+            self.wateringRate = list(zoneWateringRate)
+            self.weeklyWaterReq = list(weeklyWaterReq)
+            self.minWateringLength = list(minWateringLength)
+            self.maxWateringLength = list(maxWateringLength)
+
+    def totalWater(self, rainTotal, runTimes):
+    # Total water (rain and sprinklers) per zone
+    # Inputs:
+    # rainTotal- rainfall over period (inches; with numpy may be per-week column)
+    # runTimes- sprinkler run time per zone (seconds)
+        if (self.np):
+            return (self.np.asarray(rainTotal, dtype=float) + self.np.asarray(runTimes, dtype=float)/60.0*self.wateringRate).tolist()
+        return [rainTotal + runTime/60.0*rate for runTime, rate in zip(runTimes, self.wateringRate)]
+
+    def wateringRequired(self, totalWater, numWeeks):
+    # Water still required to meet weekly requirement over numWeeks given water received
+        if (self.np):
+            return (numWeeks*self.weeklyWaterReq - self.np.asarray(totalWater, dtype=float)).tolist()
+        return [numWeeks*req - water for req, water in zip(self.weeklyWaterReq, totalWater)]
+
+    def rolloverAdjustment(self, waterLastWeek, excessRollover, deficitMakeup):
+    # Adjustment to weekly requirement from previous week's excess (negative) or deficit (positive)
+        if (self.np):
+            waterDelta = self.np.asarray(waterLastWeek, dtype=float) - self.weeklyWaterReq
+            apply = ((waterDelta > 0) & excessRollover) | ((waterDelta < 0) & deficitMakeup)
+            return self.np.where(apply, -waterDelta, 0.0).tolist()
+
+        waterAdj = [0.0]*self.numZones
+        for idx, (water, req) in enumerate(zip(waterLastWeek, self.weeklyWaterReq)):
+            waterDelta = water - req
+            if ((excessRollover and waterDelta > 0) or (deficitMakeup and waterDelta < 0)):
+                waterAdj[idx] = -waterDelta
+        return waterAdj
+
+    def wateringLengths(self, amountToWater):
+    # Run lengths for requested water amounts
+    # Outputs:
+    # lengths- run length per zone (whole seconds, at least minWateringLength, at most maxWateringLength, 0 if no water requested)
+    # split- zones whose requested length exceeded maxWateringLength
+        if (self.np):
+            amountToWater = self.np.asarray(amountToWater, dtype=float)
+            lengths = self.np.maximum(self.np.ceil(amountToWater/self.wateringRate*60.0), self.minWateringLength)
+            split = (lengths > self.maxWateringLength) & (amountToWater > 0)
+            lengths = self.np.where(amountToWater > 0, self.np.minimum(lengths, self.maxWateringLength), 0)
+            return lengths.astype(int).tolist(), split.tolist()
+
+        lengths = [0]*self.numZones
+        split = [False]*self.numZones
+        for idx, amount in enumerate(amountToWater):
+            if (amount > 0):
+                length = max(math.ceil(amount/self.wateringRate[idx]*60.0), self.minWateringLength[idx])
+                split[idx] = length > self.maxWateringLength[idx]
+                lengths[idx] = int(min(length, self.maxWateringLength[idx]))
+        return lengths, split
+
+    def excessLengths(self, waterRequired, totalWater):
+    # Run time needed beyond maxWateringLength to deliver remaining requirement
+    # Matches the original run logic: remaining water divided by watering rate (minutes) less maxWateringLength (seconds), so
+    # the units are mixed.  Values are signed (not clipped at 0); callers treat only positive values as excess.
+        if (self.np):
+            return ((self.np.asarray(waterRequired, dtype=float) - self.np.asarray(totalWater, dtype=float))/self.wateringRate - self.maxWateringLength).tolist()
+        return [(req - water)/rate - maxLength for req, water, rate, maxLength in zip(waterRequired, totalWater, self.wateringRate, self.maxWateringLength)]
+
+    def weeklyShortfall(self, weeklyRain, weeklyRunTimes, metFraction=0.9):
+    # Weeks below requirement and water in excess of requirement per zone over many weeks
+    # Inputs:
+    # weeklyRain- rainfall per week
+    # weeklyRunTimes- sprinkler run time per week per zone (weeks x zones, seconds)
+    # metFraction- fraction of weekly requirement counted as met
+    #
+    # Outputs:
+    # sprinklerWater- sprinkler water per zone over all weeks (inches)
+    # shortWeeks- number of weeks below requirement per zone
+    # excessWater- water above requirement per zone summed over weeks (inches)
+        if (self.np):
+            runTimes = self.np.asarray(weeklyRunTimes, dtype=float).reshape(len(weeklyRain), self.numZones)
+            sprinklerWater = runTimes/60.0*self.wateringRate
+            water = self.np.asarray(weeklyRain, dtype=float)[:, None] + sprinklerWater
+            shortWeeks = (water < metFraction*self.weeklyWaterReq).sum(axis=0)
+            excessWater = self.np.maximum(water - self.weeklyWaterReq, 0.0).sum(axis=0)
+            return sprinklerWater.sum(axis=0).tolist(), shortWeeks.tolist(), excessWater.tolist()
+
+        sprinklerWater = [0.0]*self.numZones
+        shortWeeks = [0]*self.numZones
+        excessWater = [0.0]*self.numZones
+        for rain, runTimes in zip(weeklyRain, weeklyRunTimes):
+            for idx, runTime in enumerate(runTimes):
+                zoneWater = runTime/60.0*self.wateringRate[idx]
+                sprinklerWater[idx] += zoneWater
+                water = rain + zoneWater
+                if (water < metFraction*self.weeklyWaterReq[idx]):
+                    shortWeeks[idx] += 1
+                excessWater[idx] += max(water - self.weeklyWaterReq[idx], 0.0)
+        return sprinklerWater, shortWeeks, excessWater
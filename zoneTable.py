@@ -0,0 +1,73 @@
+import numbers
+from exceptions import BasicException
+
+class Zone(object):
+# Settings of one zone
+    __slots__ = ('zone', 'index', 'zoneWateringRate', 'weeklyWaterReq', 'minWateringLength', 'maxWateringLength', 'overrides')
+
+    def __init__(self, zone, index, zoneWateringRate, weeklyWaterReq, minWateringLength, maxWateringLength, overrides=None):
+        self.zone = zone # zone (station) number
+        self.index = index # position in zones list
+        self.zoneWateringRate = zoneWateringRate # inches per minute
+        self.weeklyWaterReq = weeklyWaterReq # inches
+        self.minWateringLength = minWateringLength # seconds
+        self.maxWateringLength = maxWateringLength # seconds
+        self.overrides = overrides # zone override settings (None if not overridden)
+
+    def __repr__(self):
+        return "Zone({}, rate={}, weeklyReq={}, length={}-{})".format(self.zone, self.zoneWateringRate, self.weeklyWaterReq, self.minWateringLength, self.maxWateringLength)
+
+class ZoneTable(object):
+# Validated zone settings with constant time lookup by zone number
+# Built once when the configuration is loaded from the parallel per-zone setting lists.
+
+    __slots__ = ('zones', 'entries', 'indexOf')
+
+    def __init__(self, entries):
+        self.entries = entries
+        self.zones = [entry.zone for entry in entries]
+        self.indexOf = {entry.zone: entry.index for entry in entries}
+
+    @classmethod
+    def compile(cls, zones, zoneWateringRate, weeklyWaterReq, minWateringLength, maxWateringLength, overrides=None):
+        # Validate per-zone settings and build table
+        for name, values in (('zoneWateringRate', zoneWateringRate), ('weeklyWaterReq', weeklyWaterReq), ('minWateringLength', minWateringLength), ('maxWateringLength', maxWateringLength)):
+            if (len(values) != len(zones)):
+                raise BasicException("ZoneTable - {} has {} entries but {} zones are configured.".format(name, len(values), len(zones)))
+            for value in values:
+                if (not isinstance(value, numbers.Real) or isinstance(value, bool) or value < 0):
+                    raise BasicException("ZoneTable - Invalid {} value '{}', expected non-negative number.".format(name, value))
+
+        entries = []
+        seen = set()
+        for idx, zone in enumerate(zones):
+            if (not isinstance(zone, int) or isinstance(zone, bool) or zone < 1):
+                raise BasicException("ZoneTable - Invalid zone '{}', expected zone number of 1 or more.".format(zone))
+            if (zone in seen):
+                raise BasicException("ZoneTable - Zone {} is configured more than once.".format(zone))
+            seen.add(zone)
+            if (zoneWateringRate[idx] <= 0):
+                raise BasicException("ZoneTable - zoneWateringRate of zone {} must be greater than zero.".format(zone))
+            if (minWateringLength[idx] > maxWateringLength[idx]):
+                raise BasicException("ZoneTable - minWateringLength of zone {} is greater than its maxWateringLength.".format(zone))
+
+            entries.append(Zone(zone, idx, zoneWateringRate[idx], weeklyWaterReq[idx], minWateringLength[idx], maxWateringLength[idx],
+                                overrides[zone] if (overrides and zone in overrides) else None))
+
+        return cls(entries)
+
+    def __getitem__(self, zone):
+        return self.entries[self.indexOf[zone]]
+
+    def __contains__(self, zone):
+        return zone in self.indexOf
+
+    def __iter__(self):
+        return iter(self.entries)
+
+    def __len__(self):
+        return len(self.entries)
+
+    def index(self, zone):
+        # Position of zone in zones list
+        return self.indexOf[zone]